@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2019 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+"""
+Streaming checksum of files and directories
+"""
+
+import os
+import io
+import errno
+import hashlib
+from multiprocessing.pool import ThreadPool
+
+ALGORITHMS = [ 'md5', 'sha1', 'sha256', 'blake2b' ]
+
+CHUNK_SIZE = 1048576
+WORKERS = 4
+
+def getAlgorithms(checksumType):
+    """
+    Return the list of algorithms requested, md5 by default
+    """
+    if not checksumType:
+        return [ 'md5' ]
+    if not isinstance(checksumType, (list, tuple)):
+        checksumType = [ checksumType ]
+    algorithms = []
+    for algo in checksumType:
+        algo = algo.lower()
+        if algo not in ALGORITHMS or not hasattr(hashlib, algo):
+            raise ValueError("checksum type not supported: %s" % algo)
+        algorithms.append(algo)
+    return algorithms
+
+def checksumFile(path, algorithms, chunkSize=CHUNK_SIZE):
+    """
+    Return the size of the file and the checksums by algorithm,
+    the file is read by chunks and hashed once for all algorithms
+    """
+    hashes = [ getattr(hashlib, algo)() for algo in algorithms ]
+    buf = bytearray(chunkSize)
+    view = memoryview(buf)
+    size = 0
+    with io.open(path, 'rb', buffering=0) as fd:
+        while True:
+            n = fd.readinto(buf)
+            if not n:
+                break
+            size += n
+            for h in hashes:
+                h.update(view[:n])
+    return size, dict( (algo, h.hexdigest()) for algo, h in zip(algorithms, hashes) )
+
+def checksumDirectory(path, algorithms, workers=WORKERS, chunkSize=CHUNK_SIZE):
+    """
+    Return the manifest of all files in the directory, sorted by path.
+    Files are hashed in parallel, the hash functions release the GIL.
+    The directories not readable are reported in the manifest with their error.
+    """
+    if not os.path.isdir(path):
+        raise OSError(errno.ENOENT, "directory not found: %s" % path)
+
+    files = []
+    def onError(e):
+        """
+        Directory not readable, its error is kept at its place in the manifest
+        """
+        files.append( { 'path': os.path.relpath(e.filename, path), 'error': str(e) } )
+
+    for dirpath, dirnames, filenames in os.walk(path, onerror=onError):
+        dirnames.sort()
+        for f in sorted(filenames):
+            fp = os.path.join(dirpath, f)
+            if os.path.isfile(fp):
+                files.append(fp)
+
+    def checksumEntry(fp):
+        """
+        Return the manifest entry of one file
+        """
+        if isinstance(fp, dict):
+            return fp
+        entry = { 'path': os.path.relpath(fp, path) }
+        try:
+            entry['size'], entry['checksums'] = checksumFile(fp, algorithms, chunkSize)
+        except (IOError, OSError) as e:
+            entry['error'] = str(e)
+        return entry
+
+    if len(files) <= 1 or workers <= 1:
+        return [ checksumEntry(fp) for fp in files ]
+
+    pool = ThreadPool( min(workers, len(files)) )
+    try:
+        return pool.map(checksumEntry, files, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
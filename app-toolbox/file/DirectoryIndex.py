@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2019 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+"""
+Parallel directory walker with an optional index cache
+"""
+
+import os
+import threading
+import time
+
+try:
+    import queue
+except ImportError: # support python 2
+    import Queue as queue
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+WORKERS = 8
+# max number of directories kept in the cache
+CACHE_ENTRIES = 100000
+# directories modified recently are not cached, a change in the same
+# mtime tick would not be detected
+CACHE_MIN_AGE = 2
+
+class DirectoryIndex(object):
+    """
+    Walk a tree like os.walk, the directories are scanned in parallel
+    and only one stat is done per file when the sizes are needed.
+
+    With the cache, an unchanged directory (same mtime) is not scanned again;
+    note that the size of a file updated in place does not change the mtime
+    of its directory.
+    """
+    def __init__(self, maxEntries=CACHE_ENTRIES):
+        """
+        Constructor
+        """
+        self.mutex = threading.Lock()
+        self.maxEntries = maxEntries
+        # path -> (mtime, with size, files, dirs)
+        self.cache = {}
+
+    def clear(self):
+        """
+        Clear the cache
+        """
+        self.mutex.acquire()
+        try:
+            self.cache = {}
+        finally:
+            self.mutex.release()
+
+    def scanDirectory(self, path, withSize=False, useCache=False):
+        """
+        Return the files of the directory as a list of (name, size) and the
+        sub-directories to walk; as os.walk, links to directories are not
+        followed and the errors are ignored.
+        The size is None if not requested or if the file does not exist.
+        """
+        if useCache:
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                return [], []
+            cached = self.cache.get(path)
+            if cached is not None and cached[0] == mtime and (cached[1] or not withSize):
+                return cached[2], cached[3]
+
+        files = []
+        dirs = []
+        try:
+            if scandir is not None:
+                self.scanEntries(path, withSize, files, dirs)
+            else:
+                self.scanNames(path, withSize, files, dirs)
+        except OSError:
+            return [], []
+
+        if useCache and (time.time() - mtime) >= CACHE_MIN_AGE:
+            self.mutex.acquire()
+            try:
+                if len(self.cache) >= self.maxEntries:
+                    self.cache = {}
+                self.cache[path] = (mtime, withSize, files, dirs)
+            finally:
+                self.mutex.release()
+        return files, dirs
+
+    def scanEntries(self, path, withSize, files, dirs):
+        """
+        Scan the directory with scandir, the type of the entries
+        is given by the directory listing
+        """
+        it = scandir(path)
+        try:
+            for entry in it:
+                try:
+                    isDir = entry.is_dir()
+                except OSError:
+                    isDir = False
+                if isDir:
+                    if not entry.is_symlink():
+                        dirs.append(entry.path)
+                    continue
+                size = None
+                if withSize:
+                    try:
+                        size = entry.stat().st_size
+                    except OSError:
+                        pass
+                files.append( (entry.name, size) )
+        finally:
+            if hasattr(it, 'close'):
+                it.close()
+
+    def scanNames(self, path, withSize, files, dirs):
+        """
+        Scan the directory with listdir, when scandir is not available
+        """
+        for name in os.listdir(path):
+            fp = os.path.join(path, name)
+            if os.path.isdir(fp):
+                if not os.path.islink(fp):
+                    dirs.append(fp)
+                continue
+            size = None
+            if withSize:
+                try:
+                    size = os.path.getsize(fp)
+                except OSError:
+                    pass
+            files.append( (name, size) )
+
+    def scanTree(self, path, withSize=False, workers=WORKERS, useCache=False):
+        """
+        Scan all directories of the tree, return a dict path -> (files, dirs)
+        """
+        nodes = {}
+        if workers <= 1:
+            pending = [ path ]
+            while pending:
+                p = pending.pop()
+                nodes[p] = self.scanDirectory(p, withSize, useCache)
+                pending.extend( nodes[p][1] )
+            return nodes
+
+        pending = queue.Queue()
+        def worker():
+            """
+            Scan the directories of the queue
+            """
+            while True:
+                p = pending.get()
+                try:
+                    if p is None:
+                        break
+                    nodes[p] = self.scanDirectory(p, withSize, useCache)
+                    for d in nodes[p][1]:
+                        pending.put(d)
+                except Exception:
+                    # skipped like an unreadable directory
+                    nodes[p] = ([], [])
+                finally:
+                    pending.task_done()
+
+        threads = [ threading.Thread(target=worker) for i in range(workers) ]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        pending.put(path)
+        pending.join()
+        for t in threads:
+            pending.put(None)
+        for t in threads:
+            t.join()
+        return nodes
+
+    def walk(self, path, withSize=False, workers=WORKERS, useCache=False):
+        """
+        Yield (dirpath, files) in the order of os.walk
+        """
+        nodes = self.scanTree(path, withSize, workers, useCache)
+        stack = [ path ]
+        while stack:
+            p = stack.pop()
+            files, dirs = nodes.get(p, ([], []))
+            yield p, files
+            stack.extend( reversed(dirs) )
+
+    def listFiles(self, path, workers=WORKERS, useCache=False):
+        """
+        Return the names of all files in the tree
+        """
+        listFiles = []
+        for dirpath, files in self.walk(path, False, workers, useCache):
+            listFiles.extend( [ name for name, size in files ] )
+        return listFiles
+
+    def getSize(self, path, workers=WORKERS, useCache=False):
+        """
+        Return the size of all files in the tree
+        """
+        totalSize = 0
+        for dirpath, files in self.walk(path, True, workers, useCache):
+            for name, size in files:
+                if size is not None:
+                    totalSize += size
+        return totalSize
@@ -31,19 +31,37 @@ import Libs.Settings as Settings
 
 
 try:
-    import LogWatcher
+    import FollowService
 except ImportError:
-    from . import LogWatcher
+    from . import FollowService
+try:
+    import Checksum
+except ImportError:
+    from . import Checksum
+try:
+    import DirectoryIndex
+except ImportError:
+    from . import DirectoryIndex
+try:
+    import PathWatcher
+except ImportError:
+    from . import PathWatcher
+try:
+    import FileCompare
+except ImportError:
+    from . import FileCompare
+try:
+    import FileCopy
+except ImportError:
+    from . import FileCopy
 import sys
 import threading
 import os
-import hashlib
 import time
 import shutil
 import datetime
-import difflib
-import filecmp
 import copy
+import zlib
 
 try:
     xrange
@@ -77,18 +95,16 @@ Events messages:
 
 Targetted operating system: Windows and Linux"""
 
+# Get File: above this size the file is uploaded in a zip instead of notified
+GET_FILE_UPLOAD_SIZE = 67108864
+# size of the blocks read when a file is copied in the temp area
+READ_BLOCK_SIZE = 1048576
+
 def get_size_path(path):
     """
     Return the size of the given path
     """
-    total_size = 0
-    for dirpath, dirnames, filenames in os.walk(path):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            if os.path.exists(fp):
-                total_size += os.path.getsize(fp)
-
-    return total_size   # in megabytes
+    return DirectoryIndex.DirectoryIndex().getSize(path)
     
 def initialize (controllerIp, controllerPort, toolName, toolDesc, defaultTool, 
                 supportProxy, proxyIp, proxyPort, sslSupport):
@@ -98,119 +114,6 @@ def initialize (controllerIp, controllerPort, toolName, toolDesc, defaultTool,
     return File( controllerIp, controllerPort, toolName, toolDesc, defaultTool, 
                 supportProxy, proxyIp, proxyPort, sslSupport )
     
-class FollowThread(threading.Thread):
-    """
-    Follow thread
-    """
-    def __init__(self, parent, request):
-        """
-        Constructor
-        """
-        threading.Thread.__init__(self)
-        self.stopEvent = threading.Event()
-        self.parent = parent
-        self.request = request 
-        self.following = False
-        self.logfile = None
-        self.filter = None
-        self.watcher = None
-        if len(self.request['data']['filter']):
-            self.filter = self.request['data']['filter']
-
-    def error(self, msg):
-        """
-        Trace to log file
-        """
-        self.parent.error(msg)
-        
-    def trace(self, msg):
-        """
-        Trace to log file
-        """
-        self.parent.trace(msg)
-
-    def startFollow(self, path, extensions):
-        """
-        Start to follow the path
-        """
-        self.following = True	
-        self.trace("To inspect Path=%s" % path)
-        self.watcher =  LogWatcher.LogWatcher(path, self.callback, parent=self, extensions=extensions)
-        return self.following
-		
-    def callback(self, filename, lines):
-        """
-        Callback function
-        """
-        for line in lines:
-            if self.filter is not None:
-
-                if sys.version_info > (3,):
-                    line = unicode(line, 'utf8') # to support python3 
-                    if self.filter in line:
-                        self.sendNotify(content={'filename': filename, 'content': line} )
-                else:
-                    if self.filter in line:
-                        self.sendNotify(content={'filename': filename, 'content': line} )
-            else:
-                self.sendNotify(content={'filename': filename, 'content': line})
-                
-    def sendError(self, data):
-        """
-        Send error to the server
-        """
-        self.error( "send error: %s"  % str(data) )
-        req =  self.request
-        req['event'] = "agent-error"
-        req['data'] = data
-        self.parent.notify( data=req )
-        
-    def sendNotify(self, content):
-        """
-        Send error to the server
-        """
-        req =  self.request
-        req['data']['cmd'] = 'Log File'
-        req['event'] = "agent-notify"
-        req['data']['log'] = content
-        self.parent.notify( data=req )
-        
-    def log(self, content):
-        """
-        Log
-        """
-        self.sendFollow(content)
-        
-    def sendFollow(self, content):
-        """
-        Send error to the server
-        """
-        req =  self.request
-        req['data']['cmd'] = 'Event File'
-        req['event'] = "agent-notify"
-        req['data'] = content
-        self.parent.notify( data=req )
-        
-    def run(self):
-        """
-        On run function
-        """
-        try:
-            while not self.stopEvent.isSet():
-                if self.following:
-                    self.watcher.loop(blocking=False)
-                    time.sleep(0.1)
-        except Exception as e:
-            self.sendError("generic exception on thread: %s" % e)
-
-    def stop(self):
-        """
-        Stop the thread
-        """
-        self.watcher.close()
-        self.following = False
-        self.stopEvent.set()
-
 class File(GenericTool.Tool):
     """
     File agent class
@@ -240,7 +143,10 @@ class File(GenericTool.Tool):
                                     sslSupport=sslSupport)
         self.__type__ = __TYPE__
 
-        self.followThreads = {}
+        self.followService = FollowService.FollowService(parent=self)
+        self.directoryIndex = DirectoryIndex.DirectoryIndex()
+        self.nbGetFile = 0
+        self.__mutexActionId__ = threading.RLock()
        
     def getType(self):
         """
@@ -251,6 +157,118 @@ class File(GenericTool.Tool):
         """
         return self.__type__
 
+    def getId(self):
+        """
+        Return the ID
+        """
+        self.__mutexActionId__.acquire()
+        self.nbGetFile += 1
+        ret = self.nbGetFile
+        self.__mutexActionId__.release()
+        return ret
+
+    def getCopyEngine(self, request):
+        """
+        Return a copy engine sending the progress of the copy
+        """
+        def onProgress(counters):
+            """
+            Send the progress to the server
+            """
+            self.sendNotify(request, data={ 'cmd': 'Copy Progress',
+                                            'request-id': request['data']['request-id'],
+                                            'path':request['data']['path'],
+                                            'path-dst':request['data']['path-dst'],
+                                            'counters': counters } )
+        return FileCopy.CopyEngine(workers=int(request['data'].get('workers', FileCopy.WORKERS)),
+                                   metadata=request['data'].get('metadata', True),
+                                   progress=onProgress,
+                                   interval=float(request['data'].get('progress-interval', 
+                                                                      FileCopy.PROGRESS_INTERVAL)) )
+
+    def getRange(self, data, sizeFile):
+        """
+        Return the offset and the length to read according to the
+        offset, length and tail-bytes options, the whole file by default
+        """
+        if data.get('tail-bytes') is not None:
+            offset = max(0, sizeFile - int(data['tail-bytes']))
+        else:
+            offset = min( int(data.get('offset', 0)), sizeFile )
+        length = sizeFile - offset
+        if data.get('length') is not None:
+            length = min( int(data['length']), length )
+        if offset < 0 or length < 0:
+            raise ValueError("invalid range offset=%s length=%s" % (offset, length) )
+        return offset, length
+
+    def sendFileChunks(self, request, fd, offset, length, sizeFile):
+        """
+        Send the file range by chunks, each chunk is notified with
+        its sequence number, the last one is flagged
+        """
+        chunkSize = int(request['data']['chunk-size'])
+        if chunkSize <= 0:
+            raise ValueError("invalid chunk size: %s" % chunkSize)
+        compress = request['data'].get('compress', False)
+        seq = 0
+        while True:
+            chunk = fd.read( min(chunkSize, length) )
+            length -= len(chunk)
+            last = not chunk or length <= 0
+            data = { 'cmd': request['data']['cmd'], 
+                     'request-id': request['data']['request-id'],
+                     'file':request['data']['path'],
+                     'seq': seq, 'offset': offset, 'size': sizeFile, 
+                     'last': last }
+            offset += len(chunk)
+            if compress:
+                chunk = zlib.compress(chunk)
+                data['compressed'] = True
+            data['content'] = chunk
+            self.sendNotify(request, data=data)
+            seq += 1
+            if last:
+                break
+        self.trace("file sent in %s chunks" % seq )
+
+    def uploadFile(self, request, fd, offset, length, sizeFile):
+        """
+        Copy the file range in the temp area then upload it in a zip
+        """
+        internalID = self.getId()
+        self.addCallIdTmpDir("%s" % internalID )
+        destFile = "%s/%s/%s" % (self.getTemp(), internalID, 
+                                 os.path.basename( os.path.normpath(request['data']['path']) ) )
+        with open(destFile, "wb") as f:
+            remaining = length
+            while remaining > 0:
+                block = fd.read( min(READ_BLOCK_SIZE, remaining) )
+                if not block:
+                    break
+                f.write(block)
+                remaining -= len(block)
+
+        ret, pathZip, filenameZip = self.createZip(callId=internalID, 
+                                                   zipReplayId=request['test-replay-id'],
+                                                   zipPrefix="agent") 
+        if not ret:
+            self.error('unable to create zip file')
+            try:
+                os.remove(destFile)
+            except Exception as e:
+                pass
+            self.sendError( request , data="unable to create zip file")
+        else:
+            self.uploadZip(callId=internalID, fileName=filenameZip, pathZip=pathZip, 
+                           resultPath=request['result-path'])
+            self.sendNotify(request, data={ 'cmd': request['data']['cmd'], 
+                                            'request-id': request['data']['request-id'],
+                                            'file':request['data']['path'],
+                                            'uploaded': filenameZip,
+                                            'offset': offset, 'length': length,
+                                            'size': sizeFile } )
+
     def onCleanup(self):
         """
         Cleanup all
@@ -258,9 +276,7 @@ class File(GenericTool.Tool):
         """
         try:
             # reset all threads
-            for fileId, followThread in self.followThreads.items():
-                followThread.stop()
-                followThread.join()
+            self.followService.stop()
         except Exception as e:
             self.error("unable to cleanup properly: %s" % e)
             
@@ -298,20 +314,9 @@ class File(GenericTool.Tool):
         self.onToolLogWarningCalled( "<< Resetting ScriptId=%s AdapterId=%s" % (scriptId, adapterId) )
         self.trace("Resetting follow threads ScriptId=%s - AdapterId=%s" % (scriptId, adapterId) )
         
-        threadDetected = False
-        testId = None
-        for testId, followThread in self.followThreads.items():
-            if testId.startswith( "%s_%s" % (scriptId, adapterId) ):
-                threadDetected = True
-                break
-
-        if threadDetected:
-            if testId is not None:
-                fThread = self.followThreads.pop(testId)
-                fThread.stop()
-                fThread.join()
-                del fThread
-            
+        for followId in self.followService.getFollowIds():
+            if followId.startswith( "%s_%s_" % (scriptId, adapterId) ):
+                self.followService.unsubscribe(followId)
         
         self.trace("reset test terminated")
         self.onToolLogWarningCalled( "<< Reset terminated"  )
@@ -412,21 +417,39 @@ class File(GenericTool.Tool):
                 
                 # read the file and close it
                 filePath = os.path.normpath(request['data']['path'])
+                sizeFile = os.path.getsize(filePath)
+                offset, length = self.getRange(request['data'], sizeFile)
+                threshold = int(request['data'].get('upload-threshold', GET_FILE_UPLOAD_SIZE))
                 
                 if sys.version_info > (3,):
                     fd = open(filePath, 'rb') 
                 else:
                     fd = open(request['data']['path'], 'r')
-                read_data = fd.read()
-                fd.close()
-
-                self.trace("length of the file read: %s" % len(read_data) )
-                
-                # send the result
-                self.sendNotify(request, data={'content': read_data, 
-                                                'cmd': request['data']['cmd'], 
-                                                'request-id': request['data']['request-id'],
-                                                'file':request['data']['path']} )
+                try:
+                    fd.seek(offset)
+                    if threshold and length > threshold:
+                        # too big for the notify channel
+                        self.uploadFile(request, fd, offset, length, sizeFile)
+                    elif request['data'].get('chunk-size'):
+                        self.sendFileChunks(request, fd, offset, length, sizeFile)
+                    else:
+                        read_data = fd.read(length)
+
+                        self.trace("length of the file read: %s" % len(read_data) )
+                        
+                        data = {'cmd': request['data']['cmd'], 
+                                'request-id': request['data']['request-id'],
+                                'file':request['data']['path'],
+                                'offset': offset, 'size': sizeFile }
+                        if request['data'].get('compress', False):
+                            read_data = zlib.compress(read_data)
+                            data['compressed'] = True
+                        data['content'] = read_data
+                        
+                        # send the result
+                        self.sendNotify(request, data=data )
+                finally:
+                    fd.close()
                                                 
             elif request['data']['cmd'] == 'Exists File':
                 self.trace("check if the file exists: %s" % request['data']['path'] )
@@ -455,7 +478,9 @@ class File(GenericTool.Tool):
                 self.trace("get the size of the folder: %s" % request['data']['path'] )
                 existsFolder = True
                 try:
-                    folderSize =  get_size_path(request['data']['path'] )
+                    folderSize =  self.directoryIndex.getSize(request['data']['path'],
+                                                              workers=int(request['data'].get('workers', DirectoryIndex.WORKERS)),
+                                                              useCache=request['data'].get('cache', False) )
                 except Exception as e:
                     self.error("unable to get the size of the file: %s" % e )
                     v = False
@@ -469,8 +494,10 @@ class File(GenericTool.Tool):
             elif request['data']['cmd'] == 'Copy File':
                 self.trace("copy file %s to %s" % (request['data']['path'], request['data']['path-dst']) )
                 fileCopied = True
+                counters = {}
                 try:
-                    shutil.copyfile(request['data']['path'], request['data']['path-dst'])
+                    counters = self.getCopyEngine(request).copySingle(request['data']['path'], 
+                                                                      request['data']['path-dst'])
                 except Exception as e:
                     self.error("unable to get copy the file: %s" % e )
                     fileCopied = False
@@ -480,13 +507,15 @@ class File(GenericTool.Tool):
                                                 'request-id': request['data']['request-id'],
                                                 'path':request['data']['path'],
                                                 'path-dst':request['data']['path-dst'],
+                                                'counters': counters
                                                 } )
                                                 
             elif request['data']['cmd'] == 'Copy Directory':
                 self.trace("copy folder %s to %s" % (request['data']['path'], request['data']['path-dst']) )
                 dirCopied = True
+                engine = self.getCopyEngine(request)
                 try:
-                    shutil.copytree(request['data']['path'], request['data']['path-dst'])
+                    engine.copyTree(request['data']['path'], request['data']['path-dst'])
                 except Exception as e:
                     self.error("unable to get copy the dir: %s" % e )
                     dirCopied = False
@@ -496,6 +525,7 @@ class File(GenericTool.Tool):
                                                 'request-id': request['data']['request-id'],
                                                 'path':request['data']['path'],
                                                 'path-dst':request['data']['path-dst'],
+                                                'counters': engine.getCounters()
                                                 } )
                                                 
             elif request['data']['cmd'] == 'Move File':
@@ -552,9 +582,9 @@ class File(GenericTool.Tool):
                 dirExists = True
                 listFiles = []
                 try:
-                    for dirpath, dirnames, filenames in os.walk(request['data']['path'] ):
-                        for f in filenames:
-                            listFiles.append( f )
+                    listFiles = self.directoryIndex.listFiles(request['data']['path'],
+                                                              workers=int(request['data'].get('workers', DirectoryIndex.WORKERS)),
+                                                              useCache=request['data'].get('cache', False) )
                 except Exception as e:
                     self.error("unable to delete file: %s" % e)
                     dirExists = False
@@ -626,59 +656,71 @@ class File(GenericTool.Tool):
 
             elif request['data']['cmd'] == 'Checksum File':
                 self.trace("checksum of the file: %s" % str(request['data']['path']) )
-                checksumFile = hashlib.md5(open(request['data']['path'], 'rb').read()).hexdigest()
+                algorithms = Checksum.getAlgorithms( request['data'].get('checksum-type') )
+                sizeFile, checksums = Checksum.checksumFile(request['data']['path'], algorithms)
                 # send the result
                 self.sendNotify(request, data={ 'cmd': request['data']['cmd'],
                                                 'path':request['data']['path'],
                                                 'request-id': request['data']['request-id'],
-                                                'checksum': checksumFile, 'checksum-type': 'md5' } )
+                                                'checksum': checksums[algorithms[0]], 
+                                                'checksum-type': algorithms[0],
+                                                'checksums': checksums, 'size': sizeFile } )
+
+            elif request['data']['cmd'] == 'Checksum Directory':
+                self.trace("checksum of the directory: %s" % str(request['data']['path']) )
+                algorithms = Checksum.getAlgorithms( request['data'].get('checksum-type') )
+                manifest = Checksum.checksumDirectory(request['data']['path'], algorithms,
+                                                      workers=int(request['data'].get('workers', Checksum.WORKERS)) )
+                # send the result
+                self.sendNotify(request, data={ 'cmd': request['data']['cmd'],
+                                                'path':request['data']['path'],
+                                                'request-id': request['data']['request-id'],
+                                                'checksum-type': algorithms,
+                                                'manifest': manifest,
+                                                'files': len(manifest),
+                                                'errors': len([ e for e in manifest if 'error' in e ]) } )
             
             elif request['data']['cmd'] == 'Wait For File':
                 self.trace("wait for file: %s" % str(request['data']['path']) )
-                timeout = False
-                timeout = False
-                startTime = time.time()
-                while (not timeout):
-                    time.sleep(0.25)
-                    if (time.time() - startTime) >= int(request['data']['timeout']):
-                        timeout = True
-                    if not timeout:
-                        fileExists =  os.path.exists(request['data']['path'])
-                        if fileExists:
-                            # send the result
-                            self.sendNotify(request, data={ 'cmd': request['data']['cmd'],
-                                                            'path':request['data']['path'], 
-                                                            'result': fileExists,
-                                                            'request-id': request['data']['request-id'] } )
-                            break
-                    else:
-                            self.sendNotify(request, data={ 'cmd': request['data']['cmd'],
-                                                            'path':request['data']['path'], 
-                                                            'request-id': request['data']['request-id'],
-                                                            'result': False} )
+                # woken up as soon as the file is created
+                fileExists = PathWatcher.waitForPath(request['data']['path'], 
+                                                     int(request['data']['timeout']),
+                                                     polling=request['data'].get('polling', False) )
+                # send the result
+                self.sendNotify(request, data={ 'cmd': request['data']['cmd'],
+                                                'path':request['data']['path'], 
+                                                'result': fileExists,
+                                                'request-id': request['data']['request-id'] } )
                                                             
             elif request['data']['cmd'] == 'Wait For Directory':
                 self.trace("wait for directory: %s" % request['data']['path'] )
-                timeout = False
-                startTime = time.time()
-                while (not timeout):
-                    time.sleep(0.25)
-                    if (time.time() - startTime) >= int(request['data']['timeout']):
-                        timeout = True
-                    if not timeout:
-                        folderExists =  os.path.exists(request['data']['path'])
-                        if folderExists:
-                            # send the result
-                            self.sendNotify(request, data={ 'cmd': request['data']['cmd'],
-                                                            'path':request['data']['path'], 
-                                                            'result': folderExists,
-                                                            'request-id': request['data']['request-id'] } )
-                            break
-                    else:
-                            self.sendNotify(request, data={ 'cmd': request['data']['cmd'],
-                                                            'path':request['data']['path'], 
-                                                            'request-id': request['data']['request-id'],
-                                                            'result': False} )
+                folderExists = PathWatcher.waitForPath(request['data']['path'], 
+                                                       int(request['data']['timeout']),
+                                                       polling=request['data'].get('polling', False) )
+                # send the result
+                self.sendNotify(request, data={ 'cmd': request['data']['cmd'],
+                                                'path':request['data']['path'], 
+                                                'result': folderExists,
+                                                'request-id': request['data']['request-id'] } )
+
+            elif request['data']['cmd'] == 'Wait For File Content':
+                self.trace("wait for content in file: %s" % request['data']['path'] )
+                line = PathWatcher.waitForContent(request['data']['path'], 
+                                                  request['data']['pattern'],
+                                                  int(request['data']['timeout']),
+                                                  fromStart=request['data'].get('from-start', False),
+                                                  polling=request['data'].get('polling', False) )
+                data = { 'cmd': request['data']['cmd'],
+                         'path':request['data']['path'], 
+                         'pattern': request['data']['pattern'],
+                         'result': line is not None,
+                         'request-id': request['data']['request-id'] }
+                if line is not None:
+                    if sys.version_info > (3,):
+                        line = unicode(line, 'utf8', 'replace') # to support python3
+                    data['content'] = line
+                # send the result
+                self.sendNotify(request, data=data)
             
             elif request['data']['cmd'] == 'Start Follow File':
                 
@@ -689,15 +731,11 @@ class File(GenericTool.Tool):
                 self.trace( "Starting follow ScriptId=%s AdapterId=%s" % (request['script_id'], 
                                                                           request['source-adapter']) )
                 
-                if follow_id not in self.followThreads:
+                if not self.followService.isFollowing(follow_id):
 
                     req_saved = copy.deepcopy(request)
-                    newthread = FollowThread(parent=self, request=request  )
-                    newthread.startFollow(path=req_saved['data']['path'], 
-                                          extensions=req_saved['data']['extensions'])
-                    newthread.start()
-                    
-                    self.followThreads[ follow_id ] = newthread
+                    # the watch is shared with the other follows of the same path
+                    self.followService.subscribe(follow_id, request)
                 
 					 
                     # send the result
@@ -723,11 +761,8 @@ class File(GenericTool.Tool):
                                           request['data']['follow-id'] )
                 self.trace("stopping follow ScriptId=%s AdapterId=%s" % (request['script_id'], 
                                                                          request['source-adapter']) )
-                if follow_id in self.followThreads:
-                    self.followThreads[ follow_id ].stop()
-                    self.followThreads[ follow_id ].join()
-                    
-                    self.trace("follow id=%s - thread stopped" % follow_id)
+                if self.followService.unsubscribe(follow_id):
+                    self.trace("follow id=%s - stopped" % follow_id)
                     
                 self.sendNotify(request, data={ 'cmd': request['data']['cmd'],
                                                 'request-id': request['data']['request-id'],
@@ -739,11 +774,18 @@ class File(GenericTool.Tool):
                                                         request['data']['path-dst']) )
                 filesExists = True
                 htmlResult = ''
+                diffResult = ''
+                summary = {}
                 try:
-                    fromlines = open(request['data']['path'], 'U').readlines()
-                    tolines = open(request['data']['path-dst'], 'U').readlines()
-                    htmlResult = difflib.HtmlDiff().make_file(fromlines, tolines)
-                    compareResult = filecmp.cmp(request['data']['path'], request['data']['path-dst'])
+                    summary = FileCompare.compareFiles(request['data']['path'], 
+                                                       request['data']['path-dst'],
+                                                       context=int(request['data'].get('context', FileCompare.CONTEXT)),
+                                                       maxHunks=int(request['data'].get('max-hunks', FileCompare.MAX_HUNKS)),
+                                                       maxBytes=int(request['data'].get('max-bytes', FileCompare.MAX_BYTES)),
+                                                       html=request['data'].get('html', False) )
+                    compareResult = summary['identical']
+                    diffResult = summary.pop('diff')
+                    htmlResult = summary.pop('html', '')
                 except Exception as e:
                     self.error("unable to compare file: %s" % e )
                     filesExists = False
@@ -755,6 +797,8 @@ class File(GenericTool.Tool):
                                                 'path-dst':request['data']['path-dst'],
                                                 'result': filesExists,
                                                 'result-compare': compareResult,
+                                                'result-diff': diffResult,
+                                                'result-summary': summary,
                                                 'result-html': htmlResult} )
             # unknown command
             else:
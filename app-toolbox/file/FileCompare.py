@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2019 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+"""
+Compare two files: quick identity check then a patience diff
+rendered as a bounded unified diff
+"""
+
+import os
+import io
+import sys
+import bisect
+import difflib
+
+CHUNK_SIZE = 1048576
+CONTEXT = 3
+MAX_HUNKS = 100
+MAX_BYTES = 1048576
+# html rendering is quadratic, not done above this number of lines
+HTML_MAX_LINES = 5000
+# regions without unique lines are diffed with difflib below this size
+# (lines of the first file x lines of the second file)
+FALLBACK_CELLS = 1000000
+# above, they are diffed by windows of lines around each difference,
+# the diff is valid but may not be the smallest one; the window is doubled
+# while nothing matches in it, up to FALLBACK_CELLS
+FALLBACK_WINDOW = 50
+
+def isIdentical(path, pathDst, chunkSize=CHUNK_SIZE):
+    """
+    Return True if both files have the same content,
+    the reading stops on the first difference
+    """
+    if os.path.getsize(path) != os.path.getsize(pathDst):
+        return False
+    with io.open(path, 'rb') as fa:
+        with io.open(pathDst, 'rb') as fb:
+            while True:
+                a = fa.read(chunkSize)
+                b = fb.read(chunkSize)
+                if a != b:
+                    return False
+                if not a:
+                    return True
+
+def getMatchingBlocks(a, b):
+    """
+    Return the list of (i, j, n) blocks of lines matching in a and b,
+    computed with the patience algorithm: lines present once in both
+    sequences are used as anchors and the regions between them are diffed
+    again. The second value returned is True if a region was diffed
+    by windows, the blocks may then not be the longest ones.
+    """
+    blocks = []
+    approximate = False
+    pending = [ (0, len(a), 0, len(b)) ]
+    while pending:
+        alo, ahi, blo, bhi = pending.pop()
+
+        # common prefix and suffix
+        i, j = alo, blo
+        while i < ahi and j < bhi and a[i] == b[j]:
+            i += 1
+            j += 1
+        if i > alo:
+            blocks.append( (alo, blo, i - alo) )
+        k, l = ahi, bhi
+        while k > i and l > j and a[k-1] == b[l-1]:
+            k -= 1
+            l -= 1
+        if k < ahi:
+            blocks.append( (k, l, ahi - k) )
+        if i == k or j == l:
+            continue
+
+        # lines unique in both regions
+        countA = {}
+        for x in range(i, k):
+            countA[a[x]] = countA.get(a[x], 0) + 1
+        countB = {}
+        posB = {}
+        for y in range(j, l):
+            countB[b[y]] = countB.get(b[y], 0) + 1
+            posB[b[y]] = y
+        uniques = [ (x, posB[a[x]]) for x in range(i, k) \
+                    if countA[a[x]] == 1 and countB.get(a[x]) == 1 ]
+
+        anchors = longestIncreasing(uniques)
+        if not anchors:
+            if (k - i) * (l - j) <= FALLBACK_CELLS:
+                sm = difflib.SequenceMatcher(None, a[i:k], b[j:l], autojunk=False)
+                for x, y, n in sm.get_matching_blocks():
+                    if n:
+                        blocks.append( (i + x, j + y, n) )
+            else:
+                blocks.extend( getWindowBlocks(a, b, i, k, j, l) )
+                approximate = True
+            continue
+
+        prevA, prevB = i, j
+        for x, y in anchors:
+            pending.append( (prevA, x, prevB, y) )
+            blocks.append( (x, y, 1) )
+            prevA, prevB = x + 1, y + 1
+        pending.append( (prevA, k, prevB, l) )
+
+    # sort and merge the adjacent blocks
+    blocks.sort()
+    merged = []
+    for x, y, n in blocks:
+        if merged and merged[-1][0] + merged[-1][2] == x and merged[-1][1] + merged[-1][2] == y:
+            merged[-1] = (merged[-1][0], merged[-1][1], merged[-1][2] + n)
+        else:
+            merged.append( (x, y, n) )
+    return merged, approximate
+
+def getWindowBlocks(a, b, i, k, j, l, window=FALLBACK_WINDOW):
+    """
+    Return the matching blocks of the region a[i:k], b[j:l]: equal lines
+    are skipped and each difference is diffed with difflib in a window
+    of lines, only the matches in the first half of the window are kept
+    before to go on after them
+    """
+    blocks = []
+    maxWindow = max(window, int(FALLBACK_CELLS ** 0.5))
+    size = window
+    while i < k and j < l:
+        n = 0
+        while i + n < k and j + n < l and a[i+n] == b[j+n]:
+            n += 1
+        if n:
+            blocks.append( (i, j, n) )
+            i += n
+            j += n
+            continue
+
+        ahi = min(k, i + size)
+        bhi = min(l, j + size)
+        sm = difflib.SequenceMatcher(None, a[i:ahi], b[j:bhi], autojunk=False)
+        matches = [ m for m in sm.get_matching_blocks() if m[2] ]
+        if ahi == k and bhi == l:
+            blocks.extend( [ (i + x, j + y, n) for x, y, n in matches ] )
+            break
+        if not matches:
+            if size < maxWindow:
+                size = min(maxWindow, size * 2)
+                continue
+            # nothing in common in the largest window, considered as replaced
+            i, j = ahi, bhi
+            size = window
+            continue
+        half = max(1, size // 2)
+        kept = [ m for m in matches if m[0] < half and m[1] < half ] or matches[:1]
+        size = window
+        blocks.extend( [ (i + x, j + y, n) for x, y, n in kept ] )
+        x, y, n = kept[-1]
+        i, j = i + x + n, j + y + n
+    return blocks
+
+def longestIncreasing(pairs):
+    """
+    Return the longest sequence of pairs increasing on the second value,
+    the pairs are sorted on the first one (patience sorting)
+    """
+    tails = []
+    tailIndexes = []
+    previous = [ None ] * len(pairs)
+    for idx, (x, y) in enumerate(pairs):
+        pos = bisect.bisect_left(tails, y)
+        if pos > 0:
+            previous[idx] = tailIndexes[pos-1]
+        if pos == len(tails):
+            tails.append(y)
+            tailIndexes.append(idx)
+        else:
+            tails[pos] = y
+            tailIndexes[pos] = idx
+    result = []
+    idx = tailIndexes[-1] if tailIndexes else None
+    while idx is not None:
+        result.append( pairs[idx] )
+        idx = previous[idx]
+    result.reverse()
+    return result
+
+def getOpcodes(a, b):
+    """
+    Return the opcodes (tag, i1, i2, j1, j2) as difflib does,
+    and True if they may not describe the smallest diff
+    """
+    codes = []
+    i = j = 0
+    blocks, approximate = getMatchingBlocks(a, b)
+    for x, y, n in blocks + [ (len(a), len(b), 0) ]:
+        if i < x and j < y:
+            codes.append( ('replace', i, x, j, y) )
+        elif i < x:
+            codes.append( ('delete', i, x, j, y) )
+        elif j < y:
+            codes.append( ('insert', i, x, j, y) )
+        if n:
+            codes.append( ('equal', x, x + n, y, y + n) )
+        i, j = x + n, y + n
+    return codes, approximate
+
+def groupOpcodes(codes, n=CONTEXT):
+    """
+    Yield the groups of opcodes with n lines of context, one per hunk
+    """
+    if not codes:
+        return
+    codes = list(codes)
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == 'equal' and i2 - i1 > n + n:
+            group.append( (tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)) )
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append( (tag, i1, i2, j1, j2) )
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+def formatRange(start, stop):
+    """
+    Return a range in the unified format
+    """
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return '%s' % beginning
+    if not length:
+        beginning -= 1
+    return '%s,%s' % (beginning, length)
+
+def readLines(path):
+    """
+    Return the lines of the file as bytes
+    """
+    with io.open(path, 'rb') as f:
+        return f.readlines()
+
+def toBytes(text):
+    """
+    Encode the text in utf8
+    """
+    if isinstance(text, bytes):
+        return text
+    return text.encode('utf8')
+
+def toText(data):
+    """
+    Decode the bytes for the notify
+    """
+    if sys.version_info > (3,):
+        return data.decode('utf8', 'replace')
+    return data
+
+def compareFiles(path, pathDst, context=CONTEXT, maxHunks=MAX_HUNKS,
+                 maxBytes=MAX_BYTES, html=False):
+    """
+    Compare the files, return a summary dict with the unified diff
+    limited to maxHunks and maxBytes, and the html diff if requested.
+    approximate is True if the diff may not be the smallest one,
+    the counters of added and removed lines are then upper bounds.
+    """
+    summary = { 'identical': isIdentical(path, pathDst),
+                'size': os.path.getsize(path),
+                'size-dst': os.path.getsize(pathDst),
+                'hunks': 0, 'added': 0, 'removed': 0,
+                'truncated': False, 'approximate': False, 'diff': '' }
+    if summary['identical']:
+        return summary
+
+    a = readLines(path)
+    b = readLines(pathDst)
+    codes, summary['approximate'] = getOpcodes(a, b)
+    for tag, i1, i2, j1, j2 in codes:
+        if tag in ('replace', 'delete'):
+            summary['removed'] += i2 - i1
+        if tag in ('replace', 'insert'):
+            summary['added'] += j2 - j1
+
+    out = [ b'--- ' + toBytes(path) + b'\n',
+            b'+++ ' + toBytes(pathDst) + b'\n' ]
+    size = len(out[0]) + len(out[1])
+    for group in groupOpcodes(codes, context):
+        summary['hunks'] += 1
+        if summary['truncated']:
+            continue
+        if summary['hunks'] > maxHunks:
+            summary['truncated'] = True
+            continue
+        first, last = group[0], group[-1]
+        hunk = [ ('@@ -%s +%s @@\n' % (formatRange(first[1], last[2]),
+                                        formatRange(first[3], last[4])) ).encode('utf8') ]
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                hunk.extend( [ b' ' + line for line in a[i1:i2] ] )
+                continue
+            if tag in ('replace', 'delete'):
+                hunk.extend( [ b'-' + line for line in a[i1:i2] ] )
+            if tag in ('replace', 'insert'):
+                hunk.extend( [ b'+' + line for line in b[j1:j2] ] )
+        hunk = [ line if line.endswith(b'\n') else line + b'\n\\ No newline at end of file\n' \
+                 for line in hunk ]
+        hunkSize = sum( [ len(line) for line in hunk ] )
+        if size + hunkSize > maxBytes:
+            summary['truncated'] = True
+            continue
+        out.extend(hunk)
+        size += hunkSize
+    summary['diff'] = toText( b''.join(out) )
+
+    if html:
+        if len(a) <= HTML_MAX_LINES and len(b) <= HTML_MAX_LINES:
+            summary['html'] = difflib.HtmlDiff().make_file( [ toText(line) for line in a ],
+                                                            [ toText(line) for line in b ] )
+        else:
+            summary['html'] = ''
+    return summary
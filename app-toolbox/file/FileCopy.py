@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2019 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+"""
+Copy of files and directories with progress
+"""
+
+import os
+import errno
+import shutil
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+WORKERS = 4
+# bytes copied by the kernel per call, progress is updated between calls
+COPY_BLOCK = 8388608
+# buffer used when the kernel copy is not available
+BUFFER_SIZE = 1048576
+PROGRESS_INTERVAL = 1.0
+
+# kernel copy not supported for these files, the next method is tried
+FALLBACK_ERRORS = [ errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EBADF,
+                    getattr(errno, 'ENOTSUP', errno.EINVAL),
+                    getattr(errno, 'EOPNOTSUPP', errno.EINVAL) ]
+
+class CopyEngine(object):
+    """
+    Copy files with copy_file_range or sendfile when the platform has them,
+    the files of a directory are copied in parallel.
+    The progress callback is called at most every interval seconds
+    with the counters.
+    """
+    def __init__(self, workers=WORKERS, metadata=True, progress=None,
+                 interval=PROGRESS_INTERVAL):
+        """
+        Constructor
+        """
+        self.workers = workers
+        self.metadata = metadata
+        self.progress = progress
+        self.interval = interval
+        self.mutex = threading.Lock()
+        self.startTime = time.time()
+        self.lastProgress = self.startTime
+        self.files = 0
+        self.bytes = 0
+        self.totalFiles = 0
+        self.totalBytes = 0
+
+    def getCounters(self):
+        """
+        Return the counters of the copy
+        """
+        duration = time.time() - self.startTime
+        return { 'files': self.files, 'bytes': self.bytes,
+                 'total-files': self.totalFiles, 'total-bytes': self.totalBytes,
+                 'duration': round(duration, 3),
+                 'throughput': int(self.bytes / duration) if duration > 0 else 0 }
+
+    def addCopied(self, nbytes, nfiles=0):
+        """
+        Count the bytes copied and call the progress callback if it is time
+        """
+        counters = None
+        self.mutex.acquire()
+        try:
+            self.bytes += nbytes
+            self.files += nfiles
+            now = time.time()
+            if self.progress is not None and (now - self.lastProgress) >= self.interval:
+                self.lastProgress = now
+                counters = self.getCounters()
+        finally:
+            self.mutex.release()
+        if counters is not None:
+            self.progress(counters)
+
+    def copyKernel(self, infd, outfd):
+        """
+        Copy the file descriptors in the kernel,
+        return False if not supported
+        """
+        for name in [ 'copy_file_range', 'sendfile' ]:
+            func = getattr(os, name, None)
+            if func is None:
+                continue
+            offset = 0
+            try:
+                while True:
+                    if name == 'copy_file_range':
+                        n = func(infd, outfd, COPY_BLOCK)
+                    else:
+                        n = func(outfd, infd, offset, COPY_BLOCK)
+                    if not n:
+                        # nothing copied, maybe a file without size (procfs)
+                        return offset > 0
+                    offset += n
+                    self.addCopied(n)
+            except OSError as e:
+                if offset or e.errno not in FALLBACK_ERRORS:
+                    raise
+        return False
+
+    def copyFile(self, src, dst):
+        """
+        Copy the content of the file and its metadata
+        """
+        # dst is truncated on open, the source would be lost
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            raise OSError(errno.EINVAL, "source and destination are the same file: %s" % dst)
+        with open(src, 'rb') as fsrc:
+            with open(dst, 'wb') as fdst:
+                if not self.copyKernel(fsrc.fileno(), fdst.fileno()):
+                    while True:
+                        buf = fsrc.read(BUFFER_SIZE)
+                        if not buf:
+                            break
+                        fdst.write(buf)
+                        self.addCopied(len(buf))
+        if self.metadata:
+            shutil.copystat(src, dst)
+        self.addCopied(0, nfiles=1)
+
+    def copySingle(self, src, dst):
+        """
+        Copy one file
+        """
+        self.totalFiles = 1
+        self.totalBytes = os.path.getsize(src)
+        self.copyFile(src, dst)
+        return self.getCounters()
+
+    def copyTree(self, src, dst):
+        """
+        Copy the directory, dst must not exist; as shutil.copytree,
+        links are followed and the errors are raised together at the end
+        with shutil.Error
+        """
+        if os.path.exists(dst):
+            raise OSError(errno.EEXIST, "destination already exists: %s" % dst)
+        # the copy would be walked again while it is made
+        realSrc = os.path.join( os.path.realpath(src), '' )
+        if os.path.join( os.path.realpath(dst), '' ).startswith(realSrc):
+            raise OSError(errno.EINVAL, "destination inside the source: %s" % dst)
+
+        dirs = []
+        files = []
+        errors = []
+        def onError(e):
+            """
+            Directory not readable
+            """
+            errors.append( (e.filename, None, str(e)) )
+
+        for dirpath, dirnames, filenames in os.walk(src, onerror=onError, followlinks=True):
+            dstpath = os.path.join(dst, os.path.relpath(dirpath, src))
+            os.makedirs(dstpath)
+            dirs.append( (dirpath, dstpath) )
+            for f in filenames:
+                srcname = os.path.join(dirpath, f)
+                try:
+                    size = os.path.getsize(srcname)
+                except OSError as e:
+                    errors.append( (srcname, os.path.join(dstpath, f), str(e)) )
+                    continue
+                files.append( (srcname, os.path.join(dstpath, f)) )
+                self.totalBytes += size
+        self.totalFiles = len(files)
+
+        def copyEntry(entry):
+            """
+            Copy one file of the tree, return the error if any
+            """
+            try:
+                self.copyFile(entry[0], entry[1])
+            except (IOError, OSError, shutil.Error) as e:
+                return (entry[0], entry[1], str(e))
+            return None
+
+        if self.workers > 1 and len(files) > 1:
+            pool = ThreadPool( min(self.workers, len(files)) )
+            try:
+                results = pool.map(copyEntry, files, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [ copyEntry(entry) for entry in files ]
+        errors.extend( [ err for err in results if err is not None ] )
+
+        # directories times are set once their files are copied
+        if self.metadata:
+            for srcpath, dstpath in reversed(dirs):
+                try:
+                    shutil.copystat(srcpath, dstpath)
+                except OSError as e:
+                    errors.append( (srcpath, dstpath, str(e)) )
+        if errors:
+            raise shutil.Error(errors)
+        return self.getCounters()
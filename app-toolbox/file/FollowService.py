@@ -0,0 +1,581 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2019 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+"""
+Follow service shared by all test contexts of the file agent
+"""
+
+try:
+    import LogWatcher
+except ImportError:
+    from . import LogWatcher
+import sys
+import os
+import re
+import threading
+import time
+
+# unicode = str with python3
+if sys.version_info > (3,):
+    unicode = str
+
+# default limits of a batch of lines when the batch mode is enabled
+BATCH_LINES = 1000
+BATCH_BYTES = 65536
+BATCH_LATENCY = 0.2
+
+class LineFilter(object):
+    """
+    Filter of the followed lines, compiled once from a list of patterns.
+
+    Each pattern is a string searched as is, or a dict {'regex': expression}
+    or {'literal': string}. All patterns are combined in one regular expression
+    matched on the raw lines, the pattern found is returned.
+    """
+    def __init__(self, patterns):
+        """
+        Constructor, raise re.error if a regex is invalid
+        """
+        if not isinstance(patterns, (list, tuple)):
+            patterns = [ patterns ]
+
+        self.patterns = []
+        expressions = []
+        for pattern in patterns:
+            if isinstance(pattern, dict):
+                if 'regex' in pattern:
+                    name = pattern['regex']
+                    expression = self.toBytes(name)
+                else:
+                    name = pattern['literal']
+                    expression = re.escape( self.toBytes(name) )
+            else:
+                name = pattern
+                expression = re.escape( self.toBytes(name) )
+            self.patterns.append( name )
+            expressions.append( expression )
+
+        self.regexes = []
+        try:
+            # one pass on the line whatever the number of patterns
+            self.combined = re.compile( b"|".join( [ b"(?P<p" + str(i).encode() + b">" + expr + b")" \
+                                                     for i, expr in enumerate(expressions) ] ) )
+        except re.error:
+            # patterns not supported in an alternation (backreferences, global flags)
+            self.combined = None
+            self.regexes = [ re.compile(expr) for expr in expressions ]
+
+    @staticmethod
+    def toBytes(pattern):
+        """
+        Return the pattern encoded in utf8
+        """
+        if isinstance(pattern, bytes):
+            return pattern
+        return pattern.encode('utf8')
+
+    def match(self, line):
+        """
+        Return the pattern found in the line, None otherwise
+        """
+        if self.combined is not None:
+            m = self.combined.search(line)
+            if m is None:
+                return None
+            return self.patterns[ int(m.lastgroup[1:]) ]
+
+        for i, regex in enumerate(self.regexes):
+            if regex.search(line) is not None:
+                return self.patterns[i]
+        return None
+
+class FollowContext(object):
+    """
+    Follow requested by a test context, lines are received
+    from the shared watch thread.
+
+    The filter option is a pattern or a list of patterns (see LineFilter),
+    the pattern found is added to the notified line.
+
+    With the tail-lines and/or tail-bytes options, the last lines of the
+    files already watched are notified first.
+
+    Lines are notified one by one by default; with one of the batch-lines,
+    batch-bytes or batch-latency options, matching lines are sent
+    together in a Log File notify with a list of logs, flushed on the
+    first limit reached.
+    """
+    def __init__(self, parent, request):
+        """
+        Constructor
+        """
+        self.parent = parent
+        self.request = request
+        self.filter = None
+        if self.request['data'].get('filter'):
+            self.filter = LineFilter(self.request['data']['filter'])
+
+        self.mutex = threading.RLock()
+        self.batch = []
+        self.batchSize = 0
+        self.batchTime = None
+        data = self.request['data']
+        self.batched = bool( data.get('batch-lines') or data.get('batch-bytes') \
+                             or data.get('batch-latency') )
+        self.batchLines = int( data.get('batch-lines') or BATCH_LINES )
+        self.batchBytes = int( data.get('batch-bytes') or BATCH_BYTES )
+        self.batchLatency = float( data.get('batch-latency') or BATCH_LATENCY )
+        self.tailLines = int( data.get('tail-lines') or 0 )
+        self.tailBytes = int( data.get('tail-bytes') or 0 )
+
+    def error(self, msg):
+        """
+        Trace to log file
+        """
+        self.parent.error(msg)
+
+    def trace(self, msg):
+        """
+        Trace to log file
+        """
+        self.parent.trace(msg)
+
+    def callback(self, filename, lines, offset=None):
+        """
+        Callback function
+        """
+        for line in lines:
+            lineOffset = offset
+            if offset is not None:
+                offset += len(line)
+
+            content = {'filename': filename, 'content': line}
+            if self.filter is not None:
+                pattern = self.filter.match(line)
+                if pattern is None:
+                    continue
+                # only the matching lines are decoded
+                if sys.version_info > (3,):
+                    content['content'] = unicode(line, 'utf8', 'replace') # to support python3
+                content['pattern'] = pattern
+
+            if self.batched:
+                content['offset'] = lineOffset
+                self.addBatch(content, len(line))
+            else:
+                self.sendNotify(content=content)
+
+    def addBatch(self, content, size):
+        """
+        Add the line to the batch and send it if full
+        """
+        self.mutex.acquire()
+        try:
+            if not self.batch:
+                self.batchTime = time.time()
+            self.batch.append( content )
+            self.batchSize += size
+            if len(self.batch) >= self.batchLines or self.batchSize >= self.batchBytes:
+                self.flush()
+        finally:
+            self.mutex.release()
+
+    def flush(self, expired=False):
+        """
+        Send the pending batch, only if the max latency is reached when expired is True
+        """
+        self.mutex.acquire()
+        try:
+            if not self.batch:
+                return
+            if expired and (time.time() - self.batchTime) < self.batchLatency:
+                return
+            logs = self.batch
+            self.batch = []
+            self.batchSize = 0
+            self.batchTime = None
+            self.sendBatch(logs)
+        finally:
+            self.mutex.release()
+
+    def newRequest(self):
+        """
+        Return a copy of the request to notify, the request is never changed
+        because notifies can be queued before sending
+        """
+        req = dict(self.request)
+        req['data'] = dict(self.request['data'])
+        return req
+
+    def sendError(self, data):
+        """
+        Send error to the server
+        """
+        self.error( "send error: %s"  % str(data) )
+        req =  self.newRequest()
+        req['event'] = "agent-error"
+        req['data'] = data
+        self.parent.notify( data=req )
+
+    def sendNotify(self, content):
+        """
+        Send error to the server
+        """
+        req =  self.newRequest()
+        req['data']['cmd'] = 'Log File'
+        req['event'] = "agent-notify"
+        req['data']['log'] = content
+        self.parent.notify( data=req )
+
+    def sendBatch(self, logs):
+        """
+        Send a batch of lines to the server
+        """
+        req =  self.newRequest()
+        req['data']['cmd'] = 'Log File'
+        req['event'] = "agent-notify"
+        req['data']['logs'] = logs
+        self.parent.notify( data=req )
+
+    def log(self, content):
+        """
+        Log
+        """
+        self.sendFollow(content)
+
+    def sendFollow(self, content):
+        """
+        Send error to the server
+        """
+        req =  self.newRequest()
+        req['event'] = "agent-notify"
+        req['data'] = content
+        self.parent.notify( data=req )
+
+class WatchThread(threading.Thread):
+    """
+    Watch thread, one per followed path and extensions,
+    new lines are read once and dispatched to all follow contexts
+    """
+    def __init__(self, parent, path, extensions, service=None, key=None):
+        """
+        Constructor
+        """
+        threading.Thread.__init__(self)
+        self.stopEvent = threading.Event()
+        self.mutex = threading.RLock()
+        self.parent = parent
+        self.service = service
+        self.key = key
+        self.path = path
+        self.extensions = extensions
+        self.following = False
+        self.contexts = {}
+        self.files = []
+        # follow contexts waiting for the tail of the files, added to the
+        # contexts by the thread once the tail is sent
+        self.tails = {}
+        self.watcher = None
+
+    def error(self, msg):
+        """
+        Trace to log file
+        """
+        self.parent.error(msg)
+
+    def trace(self, msg):
+        """
+        Trace to log file
+        """
+        self.parent.trace(msg)
+
+    def getContexts(self):
+        """
+        Return the follow contexts subscribed
+        """
+        self.mutex.acquire()
+        try:
+            return list(self.contexts.values())
+        finally:
+            self.mutex.release()
+
+    def addContext(self, followId, context):
+        """
+        Subscribe a follow context, files already watched are notified to it
+        """
+        self.mutex.acquire()
+        try:
+            if context.tailLines or context.tailBytes:
+                # the lines are dispatched to it after its tail
+                self.tails[followId] = context
+            else:
+                self.contexts[followId] = context
+            files = list(self.files)
+        finally:
+            self.mutex.release()
+        for filename in files:
+            context.log( {"cmd": 'Watching', 'filename': filename} )
+
+    def removeContext(self, followId):
+        """
+        Unsubscribe the follow context, return the number of contexts remaining
+        """
+        self.mutex.acquire()
+        try:
+            context = self.contexts.pop(followId, None)
+            if context is None:
+                context = self.tails.pop(followId, None)
+            remaining = len(self.contexts) + len(self.tails)
+        finally:
+            self.mutex.release()
+        if context is not None:
+            context.flush()
+        return remaining
+
+    def startFollow(self):
+        """
+        Start to follow the path
+        """
+        self.following = True
+        self.trace("To inspect Path=%s" % self.path)
+        self.watcher = LogWatcher.get_watcher(self.path, self.callback, parent=self,
+                                              extensions=self.extensions,
+                                              offsets=True)
+        return self.following
+
+    def callback(self, filename, lines, offset):
+        """
+        Callback function, lines are dispatched to all follow contexts
+        """
+        for context in self.getContexts():
+            context.callback(filename, lines, offset)
+
+    def sendTails(self):
+        """
+        Send the last lines of the files to the follow contexts waiting for them,
+        then add them to the contexts; called by the thread between two reads,
+        the tail ends where the next dispatch starts
+        """
+        self.mutex.acquire()
+        try:
+            pending = list(self.tails.items())
+        finally:
+            self.mutex.release()
+        for followId, context in pending:
+            tails = self.watcher.get_tails(context.tailLines, context.tailBytes)
+            for filename, lines, offset in tails:
+                context.callback(filename, lines, offset)
+            self.mutex.acquire()
+            try:
+                # not added if unsubscribed meanwhile
+                if self.tails.pop(followId, None) is context:
+                    self.contexts[followId] = context
+            finally:
+                self.mutex.release()
+
+    def flush(self, expired=False):
+        """
+        Send the batches of all follow contexts
+        """
+        for context in self.getContexts():
+            context.flush(expired=expired)
+
+    def sendError(self, data):
+        """
+        Send error to all follow contexts, waiting for their tail or not
+        """
+        self.mutex.acquire()
+        try:
+            contexts = list(self.contexts.values()) + list(self.tails.values())
+        finally:
+            self.mutex.release()
+        for context in contexts:
+            context.sendError(data)
+
+    def log(self, content):
+        """
+        Log
+        """
+        filename = content['filename']
+        name = getattr(filename, 'name', filename)
+        self.mutex.acquire()
+        try:
+            if content['cmd'] == 'Watching':
+                self.files.append(name)
+            elif name in self.files:
+                self.files.remove(name)
+            contexts = list(self.contexts.values()) + list(self.tails.values())
+        finally:
+            self.mutex.release()
+        for context in contexts:
+            context.log( dict(content) )
+
+    def run(self):
+        """
+        On run function
+        """
+        try:
+            while not self.stopEvent.isSet():
+                if self.following:
+                    if self.tails:
+                        self.sendTails()
+                    # inotify watcher waits itself for the next changes
+                    self.watcher.loop(interval=0.1, blocking=False)
+                    self.flush(expired=True)
+                    if not self.watcher.event_driven:
+                        time.sleep(0.1)
+        except Exception as e:
+            self.flush()
+            self.sendError("generic exception on thread: %s" % e)
+            # the next follows of the path get a new watch
+            if self.service is not None:
+                self.service.onWatchStopped(self)
+
+    def stop(self):
+        """
+        Stop the thread
+        """
+        self.following = False
+        self.stopEvent.set()
+        self.flush()
+        if self.watcher is not None:
+            self.watcher.close()
+
+class FollowService(object):
+    """
+    Follow service, watches are shared between the follow contexts
+    with the same real path and extensions
+    """
+    def __init__(self, parent):
+        """
+        Constructor
+        """
+        self.parent = parent
+        self.mutex = threading.RLock()
+        # follow id -> watch thread
+        self.follows = {}
+        # watch key -> watch thread
+        self.watches = {}
+
+    def getKey(self, path, extensions):
+        """
+        Return the key identifying a watch
+        """
+        if extensions:
+            extensions = tuple( sorted(extensions) )
+        else:
+            extensions = ()
+        return ( os.path.realpath(path), extensions )
+
+    def isFollowing(self, followId):
+        """
+        Return True if the follow id is already subscribed
+        """
+        return followId in self.follows
+
+    def getFollowIds(self):
+        """
+        Return all follow ids
+        """
+        self.mutex.acquire()
+        try:
+            return list(self.follows.keys())
+        finally:
+            self.mutex.release()
+
+    def subscribe(self, followId, request):
+        """
+        Start to follow the path of the request,
+        the watch is created for the first follow context only
+        """
+        path = request['data']['path']
+        extensions = request['data']['extensions']
+        key = self.getKey(path, extensions)
+        context = FollowContext(parent=self.parent, request=request)
+
+        self.mutex.acquire()
+        try:
+            watch = self.watches.get(key)
+            if watch is None or not watch.is_alive():
+                watch = WatchThread(parent=self.parent, path=path,
+                                    extensions=extensions, service=self, key=key)
+                # subscribed before the start, the first events are not lost
+                watch.addContext(followId, context)
+                watch.startFollow()
+                watch.start()
+                self.watches[key] = watch
+            else:
+                self.parent.trace("Sharing the watch of Path=%s" % key[0])
+                watch.addContext(followId, context)
+            self.follows[followId] = watch
+        finally:
+            self.mutex.release()
+
+    def unsubscribe(self, followId):
+        """
+        Stop to follow, the watch is stopped with its last follow context
+        """
+        self.mutex.acquire()
+        try:
+            watch = self.follows.pop(followId, None)
+            if watch is None:
+                return False
+            remaining = watch.removeContext(followId)
+            if not remaining and self.watches.get(watch.key) is watch:
+                del self.watches[watch.key]
+        finally:
+            self.mutex.release()
+
+        if not remaining:
+            watch.stop()
+            watch.join()
+        return True
+
+    def onWatchStopped(self, watch):
+        """
+        Called by a watch thread stopped on error, it is no more shared;
+        its follow contexts are kept until they are unsubscribed
+        """
+        self.mutex.acquire()
+        try:
+            if self.watches.get(watch.key) is watch:
+                del self.watches[watch.key]
+        finally:
+            self.mutex.release()
+
+    def stop(self):
+        """
+        Stop all watches
+        """
+        self.mutex.acquire()
+        try:
+            watches = set(self.watches.values())
+            watches.update( self.follows.values() )
+            self.watches = {}
+            self.follows = {}
+        finally:
+            self.mutex.release()
+
+        for watch in watches:
+            watch.stop()
+            watch.join()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2019 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+"""
+Minimal inotify binding with ctypes (linux only)
+"""
+
+import os
+import sys
+import errno
+import select
+import struct
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+# from sys/inotify.h
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+EVENT_HEADER = struct.Struct("iIII")
+
+READ_SIZE = 65536
+
+_libc = None
+
+def getLibc():
+    """
+    Return the c library with the inotify functions, None if not available
+    """
+    global _libc
+    if _libc is None:
+        if ctypes is None or not sys.platform.startswith("linux"):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            libc.inotify_init1
+        except (OSError, AttributeError):
+            return None
+        libc.inotify_init1.argtypes = [ ctypes.c_int ]
+        libc.inotify_add_watch.argtypes = [ ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32 ]
+        libc.inotify_rm_watch.argtypes = [ ctypes.c_int, ctypes.c_int ]
+        _libc = libc
+    return _libc
+
+def isSupported():
+    """
+    Return True if inotify is available
+    """
+    return getLibc() is not None
+
+class Inotify(object):
+    """
+    Inotify instance, events are read without blocking
+    """
+    def __init__(self):
+        """
+        Constructor, raise OSError if the instance can not be created
+        """
+        self.libc = getLibc()
+        if self.libc is None:
+            raise OSError(errno.ENOSYS, "inotify not supported")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, "inotify_init1: %s" % os.strerror(err))
+
+    def fileno(self):
+        """
+        Return the file descriptor
+        """
+        return self.fd
+
+    def addWatch(self, path, mask):
+        """
+        Watch the path and return the watch descriptor
+        """
+        if not isinstance(path, bytes):
+            path = path.encode(sys.getfilesystemencoding() or "utf8")
+        wd = self.libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, "inotify_add_watch: %s" % os.strerror(err))
+        return wd
+
+    def removeWatch(self, wd):
+        """
+        Remove the watch, ignored if already removed by the kernel
+        """
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def readEvents(self, timeout=None):
+        """
+        Wait events until the timeout in seconds and return them
+        as a list of (wd, mask, cookie, name)
+        """
+        if self.fd < 0:
+            return []
+        r, w, e = select.select([ self.fd ], [], [], timeout)
+        # closed by another thread while waiting
+        if not r or self.fd < 0:
+            return []
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except OSError as e:
+                if e.errno in ( errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR ):
+                    break
+                raise
+            if not data:
+                break
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset+length].rstrip(b"\0")
+                offset += length
+                if sys.version_info > (3,):
+                    name = os.fsdecode(name)
+                events.append( (wd, mask, cookie, name) )
+        return events
+
+    def close(self):
+        """
+        Close the instance, all watches are removed
+        """
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
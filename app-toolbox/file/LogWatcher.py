@@ -8,12 +8,21 @@ Author: Giampaolo Rodola' <g.rodola [AT] gmail [DOT] com>
 License: MIT
 """
 
+import io
 import os
 import time
 import errno
 import stat
 import sys
 
+try:
+    import Inotify
+except ImportError:
+    from . import Inotify
+
+# size of the blocks read backward by tail()
+TAIL_BLOCK = 1048576
+
 class LogWatcher(object):
     """
     Looks for changes in all files of a directory.
@@ -28,9 +37,12 @@ class LogWatcher(object):
     >>> lw = LogWatcher("/var/log/", callback)
     >>> lw.loop()
     """
+    # True if loop() waits itself for changes when not blocking
+    event_driven = False
 
     def __init__(self, folder, callback, extensions=["log"], tail_lines=0,
-                       sizehint=1048576, parent=None):
+                       sizehint=1048576, parent=None, offsets=False,
+                       tail_bytes=0):
         """
         Arguments:
 
@@ -48,10 +60,18 @@ class LogWatcher(object):
         (int) @tail_lines:
             read last N lines from files being watched before starting
 
+        (int) @tail_bytes:
+            read at most the last N bytes (whole lines only) from files
+            being watched before starting, can be used with tail_lines
+
         (int) @sizehint: passed to file.readlines(), represents an
             approximation of the maximum number of bytes to read from
             a file on every ieration (as opposed to load the entire
             file in memory until EOF is reached). Defaults to 1MB.
+
+        (bool) @offsets:
+            callback is called with a third "offset" argument, the
+            position in the file of the first line (None if unknown).
         """
         self.parent = parent
         self.folder = os.path.realpath(folder)
@@ -59,20 +79,15 @@ class LogWatcher(object):
         self._files_map = {}
         self._callback = callback
         self._sizehint = sizehint
+        self._offsets = offsets
         assert os.path.isdir(self.folder), self.folder
         assert callable(callback), repr(callback)
         self.update_files()
         for id, file in self._files_map.items():
             file.seek(os.path.getsize(file.name))  # EOF
-            if tail_lines:
-                try:
-                    lines = self.tail(file.name, tail_lines)
-                except IOError as err:
-                    if err.errno != errno.ENOENT:
-                        raise
-                else:
-                    if lines:
-                        self._callback(file.name, lines)
+        if tail_lines or tail_bytes:
+            for fname, lines, offset in self.get_tails(tail_lines, tail_bytes):
+                self.dispatch(fname, lines, offset)
 
     def __enter__(self):
         """
@@ -146,33 +161,85 @@ class LogWatcher(object):
         """
         if window <= 0:
             raise ValueError('invalid window value %r' % window)
+        with io.open(fname, 'rb') as f:
+            offset = cls.tail_offset(f, window)
         with cls.open(fname) as f:
-            BUFSIZ = 1024
-            # True if open() was overridden and file was opened in text
-            # mode. In that case readlines() will return unicode strings
-            # instead of bytes.
-            encoded = getattr(f, 'encoding', False)
-            CR = '\n' if encoded else b'\n'
-            data = '' if encoded else b''
+            f.seek(offset)
+            data = f.read()
+        return data.splitlines()[-window:]
+
+    @staticmethod
+    def tail_offset(f, window=0, max_bytes=0, end=None):
+        """
+        Return the position of the last *window* lines before *end*
+        (EOF by default) in the file f opened in binary mode, at most
+        *max_bytes* before *end* if not 0, a truncated first line is
+        skipped.
+        The file is read backward by large blocks, only once.
+        """
+        if end is None:
             f.seek(0, os.SEEK_END)
-            fsize = f.tell()
-            block = -1
-            exit = False
-            while not exit:
-                step = (block * BUFSIZ)
-                if abs(step) >= fsize:
-                    f.seek(0)
-                    newdata = f.read(BUFSIZ - (abs(step) - fsize))
-                    exit = True
-                else:
-                    f.seek(step, os.SEEK_END)
-                    newdata = f.read(BUFSIZ)
-                data = newdata + data
-                if data.count(CR) >= window:
+            end = f.tell()
+        limit = max(0, end - max_bytes) if max_bytes else 0
+        if end <= limit:
+            return end
+
+        # the newline ending the last line does not start a new one
+        f.seek(end - 1)
+        pos = end - 1 if f.read(1) == b'\n' else end
+        found = 0
+        while window and pos > limit:
+            start = max(limit, pos - TAIL_BLOCK)
+            f.seek(start)
+            block = f.read(pos - start)
+            idx = len(block)
+            while True:
+                idx = block.rfind(b'\n', 0, idx)
+                if idx < 0:
                     break
-                else:
-                    block -= 1
-            return data.splitlines()[-window:]
+                found += 1
+                if found == window:
+                    return start + idx + 1
+            pos = start
+
+        # fewer lines than the window
+        if not limit:
+            return 0
+        f.seek(limit - 1)
+        if f.read(1) == b'\n':
+            return limit
+        pos = limit
+        while pos < end:
+            block = f.read( min(TAIL_BLOCK, end - pos) )
+            if not block:
+                break
+            idx = block.find(b'\n')
+            if idx >= 0:
+                return pos + idx + 1
+            pos += len(block)
+        return end
+
+    def get_tails(self, window=0, max_bytes=0):
+        """
+        Return the last lines before the current position of all files
+        being watched, as a list of (filename, lines, offset).
+        """
+        tails = []
+        for fid, file in list(self._files_map.items()):
+            try:
+                end = file.tell()
+                with io.open(file.name, 'rb') as f:
+                    offset = self.tail_offset(f, window, max_bytes, end)
+                    f.seek(offset)
+                    data = f.read(end - offset)
+            except (IOError, OSError, ValueError) as err:
+                # removed or closed meanwhile
+                if getattr(err, 'errno', None) not in (None, errno.ENOENT):
+                    raise
+                continue
+            if data:
+                tails.append( (file.name, data.splitlines(True), offset) )
+        return tails
 
     def update_files(self):
         """
@@ -218,10 +285,20 @@ class LogWatcher(object):
         invoke callback.
         """
         while True:
+            offset = file.tell() if self._offsets else None
             lines = file.readlines(self._sizehint)
             if not lines:
                 break
-            self._callback(file.name, lines)
+            self.dispatch(file.name, lines, offset)
+
+    def dispatch(self, filename, lines, offset):
+        """
+        Invoke callback, with the offset if requested.
+        """
+        if self._offsets:
+            self._callback(filename, lines, offset)
+        else:
+            self._callback(filename, lines)
 
     def watch(self, fname):
         """
@@ -267,4 +344,146 @@ class LogWatcher(object):
         """
         for id, file in self._files_map.items():
             file.close()
-        self._files_map.clear()
\ No newline at end of file
+        self._files_map.clear()
+
+class InotifyLogWatcher(LogWatcher):
+    """
+    Same as LogWatcher but the directory is watched with inotify:
+    loop() blocks until a file is updated, created, moved or deleted and
+    only the files reported by the kernel are read.
+    Linux only, see get_watcher() for the automatic fallback.
+    """
+    event_driven = True
+
+    DIR_MASK = Inotify.IN_MODIFY | Inotify.IN_CREATE | Inotify.IN_DELETE | \
+               Inotify.IN_MOVED_FROM | Inotify.IN_MOVED_TO | \
+               Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF | Inotify.IN_ONLYDIR
+    FILE_MASK = Inotify.IN_MODIFY | Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF
+    # events changing the list of files, a rescan is needed
+    RESCAN_MASK = Inotify.IN_CREATE | Inotify.IN_DELETE | \
+                  Inotify.IN_MOVED_FROM | Inotify.IN_MOVED_TO | \
+                  Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF | \
+                  Inotify.IN_Q_OVERFLOW
+
+    def __init__(self, folder, callback, *args, **kwargs):
+        """
+        Same arguments as LogWatcher, raise OSError if inotify
+        can not be used on the folder
+        """
+        self._files_map = {}
+        self._names_map = {}
+        # watches on files located outside the folder (symlinks)
+        self._file_watches = {}
+        self._inotify = None
+        self._inotify = Inotify.Inotify()
+        try:
+            # watch before the first scan, no update can be missed
+            self._folder_wd = self._inotify.addWatch(os.path.realpath(folder),
+                                                     self.DIR_MASK)
+        except OSError:
+            self._inotify.close()
+            raise
+        LogWatcher.__init__(self, folder, callback, *args, **kwargs)
+
+    def loop(self, interval=0.1, blocking=True):
+        """
+        Wait for file changes up to *interval* seconds and read them.
+        If *blocking* is False make one wait then return.
+        """
+        while True:
+            if self._inotify is None or self._inotify.fileno() < 0:
+                return
+            events = self._inotify.readEvents(timeout=interval)
+            if events:
+                self.process_events(events)
+            if not blocking:
+                return
+
+    def process_events(self, events):
+        """
+        Read the files updated according to the inotify events
+        """
+        rescan = False
+        updated = []
+        for wd, mask, cookie, name in events:
+            if mask & Inotify.IN_Q_OVERFLOW:
+                # events lost, read everything
+                rescan = True
+                updated = list(self._names_map)
+                continue
+            if wd == self._folder_wd:
+                if name and self.extensions and \
+                        os.path.splitext(name)[1][1:] not in self.extensions:
+                    continue
+                fname = os.path.join(self.folder, name) if name else None
+            else:
+                fname = self._file_watches.get(wd)
+                if fname is None:
+                    continue
+            if mask & self.RESCAN_MASK:
+                rescan = True
+            elif mask & Inotify.IN_MODIFY:
+                if fname not in self._names_map:
+                    fname = os.path.realpath(fname)
+                if fname not in self._names_map:
+                    # not yet watched, probably created just now
+                    rescan = True
+                elif fname not in updated:
+                    updated.append(fname)
+
+        if rescan:
+            watched = set(self._names_map)
+            self.update_files()
+            # new files are read from the beginning, as in LogWatcher.loop()
+            updated.extend( [ fname for fname in self._names_map \
+                              if fname not in watched ] )
+        for fname in updated:
+            file = self._names_map.get(fname)
+            if file is not None:
+                self.readlines(file)
+
+    def update_files(self):
+        """
+        Update files and index them by name
+        """
+        LogWatcher.update_files(self)
+        self._names_map = dict( (file.name, file) for file in \
+                                self._files_map.values() )
+        # files outside the folder are not reported by the folder watch
+        watched = dict( (fname, wd) for wd, fname in self._file_watches.items() )
+        for fname in self._names_map:
+            if os.path.dirname(fname) != self.folder and fname not in watched:
+                try:
+                    wd = self._inotify.addWatch(fname, self.FILE_MASK)
+                except OSError as err:
+                    if err.errno != errno.ENOENT:
+                        raise
+                else:
+                    self._file_watches[wd] = fname
+        for fname, wd in watched.items():
+            if fname not in self._names_map:
+                self._inotify.removeWatch(wd)
+                del self._file_watches[wd]
+
+    def close(self):
+        """
+        Close
+        """
+        LogWatcher.close(self)
+        self._names_map = {}
+        self._file_watches = {}
+        if self._inotify is not None:
+            self._inotify.close()
+
+def get_watcher(folder, callback, **kwargs):
+    """
+    Return a LogWatcher using inotify when the platform supports it,
+    polling the folder otherwise.
+    """
+    if Inotify.isSupported():
+        try:
+            return InotifyLogWatcher(folder, callback, **kwargs)
+        except OSError:
+            # no more inotify instances or watches available
+            pass
+    return LogWatcher(folder, callback, **kwargs)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2019 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+"""
+Wait for a path or for a content in a file, woken up by inotify
+"""
+
+try:
+    import Inotify
+except ImportError:
+    from . import Inotify
+import os
+import re
+import time
+
+# interval of the polling mode
+POLL_INTERVAL = 0.25
+# with inotify, the path is checked again at least every second
+RECHECK_INTERVAL = 1.0
+# max size of a line kept while waiting for its end
+MAX_LINE = 1048576
+# changes done by other hosts are not reported by inotify
+NETWORK_FILESYSTEMS = [ 'nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'ncpfs', 'afs',
+                        'ceph', 'glusterfs', 'lustre', '9p', 'fuse.sshfs' ]
+
+MASK_PATH = Inotify.IN_CREATE | Inotify.IN_MOVED_TO | Inotify.IN_ATTRIB | \
+            Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF
+MASK_CONTENT = MASK_PATH | Inotify.IN_MODIFY
+# the watched directory no longer exists at its path
+MASK_GONE = Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF | Inotify.IN_IGNORED
+
+def getExistingParent(path):
+    """
+    Return the nearest existing directory containing the path
+    """
+    parent = os.path.dirname( os.path.abspath(path) )
+    while not os.path.isdir(parent):
+        upper = os.path.dirname(parent)
+        if upper == parent:
+            break
+        parent = upper
+    return parent
+
+def isNetworkPath(path):
+    """
+    Return True if the path is on a network filesystem
+    """
+    path = os.path.realpath(path)
+    fsType = None
+    mountPoint = ''
+    try:
+        with open('/proc/mounts') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mnt = fields[1].replace('\\040', ' ')
+                if path == mnt or path.startswith( mnt.rstrip('/') + '/' ):
+                    if len(mnt) >= len(mountPoint):
+                        mountPoint = mnt
+                        fsType = fields[2]
+    except (IOError, OSError):
+        return False
+    return fsType in NETWORK_FILESYSTEMS
+
+class PathWatcher(object):
+    """
+    Wait for changes near a path which may not exist yet:
+    the nearest existing parent directory is watched
+    and the watch goes down as the directories are created.
+    The polling mode is used without inotify or on network filesystems.
+    """
+    def __init__(self, path, mask=MASK_PATH, polling=False):
+        """
+        Constructor
+        """
+        self.path = path
+        self.mask = mask
+        self.inotify = None
+        self.wd = None
+        self.watched = None
+        if polling or not Inotify.isSupported() or isNetworkPath( getExistingParent(path) ):
+            return
+        try:
+            self.inotify = Inotify.Inotify()
+        except OSError:
+            return
+        self.updateWatch()
+
+    def isPolling(self):
+        """
+        Return True in polling mode
+        """
+        return self.inotify is None
+
+    def updateWatch(self):
+        """
+        Watch the nearest existing parent
+        """
+        parent = getExistingParent(self.path)
+        if parent == self.watched:
+            return
+        if self.wd is not None:
+            self.inotify.removeWatch(self.wd)
+            self.wd = None
+            self.watched = None
+        try:
+            self.wd = self.inotify.addWatch(parent, self.mask)
+            self.watched = parent
+        except OSError:
+            # removed meanwhile, retried on the next wait
+            pass
+
+    def wait(self, timeout):
+        """
+        Wait for a change up to timeout seconds
+        """
+        if self.inotify is None or self.wd is None:
+            time.sleep( min(timeout, POLL_INTERVAL) )
+        else:
+            events = self.inotify.readEvents( timeout=min(timeout, RECHECK_INTERVAL) )
+            for wd, mask, cookie, name in events:
+                if wd == self.wd and mask & MASK_GONE:
+                    # the watched directory is gone, even if recreated at the
+                    # same path: the watch is moved to the new directory
+                    self.inotify.removeWatch(self.wd)
+                    self.wd = None
+                    self.watched = None
+                    break
+        if self.inotify is not None:
+            self.updateWatch()
+
+    def close(self):
+        """
+        Close
+        """
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+def waitForPath(path, timeout, polling=False):
+    """
+    Wait until the path exists, return False on timeout
+    """
+    deadline = time.time() + timeout
+    watcher = PathWatcher(path, MASK_PATH, polling)
+    try:
+        while True:
+            # checked after the watch is added, no creation can be missed
+            if os.path.exists(path):
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            watcher.wait(remaining)
+    finally:
+        watcher.close()
+
+def waitForContent(path, pattern, timeout, fromStart=False, polling=False):
+    """
+    Wait for a line matching the regular expression in the file,
+    only the lines appended after the call are checked if fromStart is False.
+    Return the line found, None on timeout.
+    """
+    if not isinstance(pattern, bytes):
+        pattern = pattern.encode('utf8')
+    regex = re.compile(pattern)
+
+    deadline = time.time() + timeout
+    watcher = PathWatcher(path, MASK_CONTENT, polling)
+    try:
+        offset = 0
+        fileId = None
+        if not fromStart:
+            try:
+                st = os.stat(path)
+                offset = st.st_size
+                fileId = (st.st_dev, st.st_ino)
+            except OSError:
+                pass
+        pending = b''
+        while True:
+            try:
+                with open(path, 'rb') as f:
+                    st = os.fstat(f.fileno())
+                    if fileId != (st.st_dev, st.st_ino) or st.st_size < offset:
+                        # new or truncated file, read from the start
+                        fileId = (st.st_dev, st.st_ino)
+                        offset = 0
+                        pending = b''
+                    f.seek(offset)
+                    while True:
+                        data = f.read(MAX_LINE)
+                        if not data:
+                            break
+                        offset += len(data)
+                        lines = (pending + data).split(b'\n')
+                        pending = lines.pop()
+                        if len(pending) > MAX_LINE:
+                            lines.append(pending)
+                            pending = b''
+                        for line in lines:
+                            if regex.search(line) is not None:
+                                return line
+            except (IOError, OSError):
+                pass
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            watcher.wait(remaining)
+    finally:
+        watcher.close()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2019 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+"""
+BPF filters for raw sockets (linux only)
+
+A tcpdump expression is compiled with libpcap if available,
+otherwise with the tcpdump binary. A pre-compiled program can also
+be provided, as a list of [code, jt, jf, k] or with the output of tcpdump -ddd.
+"""
+
+import socket
+import struct
+import subprocess
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+# from linux/socket.h, not exported by the socket module
+SO_ATTACH_FILTER = 26
+SO_DETACH_FILTER = 27
+
+DLT_EN10MB = 1
+PCAP_NETMASK_UNKNOWN = 0xffffffff
+BPF_MAXINSNS = 4096
+
+class BpfError(Exception):
+    """
+    Bpf error
+    """
+    pass
+
+def parseProgram(program):
+    """
+    Return the list of instructions (code, jt, jf, k)
+    from a list or from the output of tcpdump -ddd
+    """
+    if isinstance(program, (list, tuple)):
+        insns = [ tuple( int(v) for v in insn ) for insn in program ]
+    else:
+        lines = [ l.strip() for l in program.replace(",", "\n").splitlines() if l.strip() ]
+        try:
+            count = int(lines[0])
+            insns = [ tuple( int(v) for v in l.split() ) for l in lines[1:] ]
+        except (ValueError, IndexError) as e:
+            raise BpfError("invalid bpf program: %s" % e)
+        if count != len(insns):
+            raise BpfError("invalid bpf program: %s instructions expected, %s found" % (count, len(insns)))
+    if not insns or len(insns) > BPF_MAXINSNS:
+        raise BpfError("invalid bpf program: %s instructions" % len(insns))
+    for insn in insns:
+        if len(insn) != 4:
+            raise BpfError("invalid bpf instruction: %s" % str(insn))
+    return insns
+
+def compileWithLibpcap(expression, snaplen=65535):
+    """
+    Compile the expression with libpcap, return None if the library is not available
+    """
+    if ctypes is None:
+        return None
+    libname = ctypes.util.find_library("pcap") or ctypes.util.find_library("wpcap")
+    if libname is None:
+        return None
+    lib = ctypes.CDLL(libname)
+
+    class BpfInsn(ctypes.Structure):
+        _fields_ = [ ("code", ctypes.c_ushort), ("jt", ctypes.c_ubyte),
+                     ("jf", ctypes.c_ubyte), ("k", ctypes.c_uint) ]
+    class BpfProgram(ctypes.Structure):
+        _fields_ = [ ("bf_len", ctypes.c_uint), ("bf_insns", ctypes.POINTER(BpfInsn)) ]
+
+    lib.pcap_open_dead.restype = ctypes.c_void_p
+    lib.pcap_geterr.restype = ctypes.c_char_p
+    lib.pcap_geterr.argtypes = [ ctypes.c_void_p ]
+    lib.pcap_compile.argtypes = [ ctypes.c_void_p, ctypes.POINTER(BpfProgram), ctypes.c_char_p,
+                                  ctypes.c_int, ctypes.c_uint ]
+    lib.pcap_close.argtypes = [ ctypes.c_void_p ]
+
+    handle = lib.pcap_open_dead(DLT_EN10MB, snaplen)
+    if not handle:
+        raise BpfError("pcap_open_dead failed")
+    try:
+        prog = BpfProgram()
+        if lib.pcap_compile(handle, ctypes.byref(prog), expression.encode("utf8"), 1, PCAP_NETMASK_UNKNOWN) != 0:
+            raise BpfError("unable to compile the filter: %s" % lib.pcap_geterr(handle).decode("utf8", "replace"))
+        insns = [ (prog.bf_insns[i].code, prog.bf_insns[i].jt, prog.bf_insns[i].jf, prog.bf_insns[i].k)
+                    for i in range(prog.bf_len) ]
+        lib.pcap_freecode(ctypes.byref(prog))
+    finally:
+        lib.pcap_close(handle)
+    return insns
+
+def compileWithTcpdump(expression, interface):
+    """
+    Compile the expression with the tcpdump binary
+    """
+    try:
+        p = subprocess.Popen( [ "tcpdump", "-i", interface, "-ddd", expression ],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+        out, err = p.communicate()
+    except OSError as e:
+        raise BpfError("libpcap and tcpdump not available to compile the filter: %s" % e)
+    if p.returncode != 0:
+        raise BpfError("unable to compile the filter: %s" % err.decode("utf8", "replace").strip())
+    return parseProgram( out.decode("utf8") )
+
+def compileFilter(expression, interface):
+    """
+    Compile a tcpdump expression and return the list of instructions
+    """
+    insns = compileWithLibpcap(expression)
+    if insns is None:
+        insns = compileWithTcpdump(expression, interface)
+    return insns
+
+def attachFilter(sock, insns):
+    """
+    Attach the filter to the socket, frames not matching are dropped by the kernel
+    """
+    if ctypes is None:
+        raise BpfError("ctypes not available")
+    filters = b"".join( [ struct.pack("HBBI", code, jt, jf, k) for (code, jt, jf, k) in insns ] )
+    buf = ctypes.create_string_buffer(filters, len(filters))
+    # struct sock_fprog { unsigned short len; struct sock_filter *filter; }
+    fprog = struct.pack("HL", len(insns), ctypes.addressof(buf))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+def detachFilter(sock):
+    """
+    Detach the filter of the socket
+    """
+    sock.setsockopt(socket.SOL_SOCKET, SO_DETACH_FILTER, 0)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2019 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+"""
+Incremental framers for the socket agent
+
+Received bytes are appended to a bytearray, a scan cursor remembers
+the position already inspected, so each byte is only scanned once
+whatever the number of reads needed to complete a frame.
+"""
+
+import re
+import struct
+import sys
+
+FRAMING_SEPARATOR = "separator"
+FRAMING_FIXED = "fixed"
+FRAMING_LENGTH_PREFIX = "length-prefix"
+FRAMING_REGEX = "regex"
+
+# default number of bytes rescanned by the regex framer,
+# must be greater than the longest delimiter
+REGEX_LOOKBACK = 256
+
+def toBytes(value):
+    """
+    Return the value as bytes, strings are encoded in utf8
+    """
+    if sys.version_info > (3,):
+        if isinstance(value, str):
+            return value.encode("utf8")
+    elif isinstance(value, unicode):
+        return value.encode("utf8")
+    return bytes(value)
+
+class Framer(object):
+    """
+    Base framer
+    """
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.buf = bytearray()
+        # start of the pending frame
+        self.start = 0
+        # position already scanned for the end of the pending frame
+        self.cursor = 0
+
+    def feed(self, data):
+        """
+        Append received bytes and return the list of complete frames
+        Data can be a memoryview, it is copied in the buffer of the framer.
+        """
+        self.buf += data
+        frames = []
+        while True:
+            end = self.findEnd()
+            if end is None:
+                break
+            frames.append( bytes(self.buf[self.start:end]) )
+            self.start = end
+            self.cursor = end
+        self.compact()
+        return frames
+
+    def findEnd(self):
+        """
+        Return the end position of the pending frame, or None
+        if the frame is not complete. To reimplement.
+        """
+        raise NotImplementedError()
+
+    def compact(self):
+        """
+        Drop bytes of frames already emitted
+        The copy is done only when more than half of the buffer is consumed
+        """
+        if self.start and self.start * 2 >= len(self.buf):
+            del self.buf[:self.start]
+            self.cursor -= self.start
+            self.start = 0
+
+    def pending(self):
+        """
+        Return the number of bytes of the incomplete frame
+        """
+        return len(self.buf) - self.start
+
+    def flush(self):
+        """
+        Return the incomplete frame and reset the framer
+        """
+        data = bytes(self.buf[self.start:])
+        self.buf = bytearray()
+        self.start = 0
+        self.cursor = 0
+        return data
+
+class SeparatorFramer(Framer):
+    """
+    Frames ended by a separator, the separator is kept in the frame
+    """
+    def __init__(self, separator):
+        """
+        Constructor
+        """
+        Framer.__init__(self)
+        self.separator = toBytes(separator)
+        if not self.separator:
+            raise ValueError("empty separator")
+
+    def findEnd(self):
+        """
+        Search the separator from the scan cursor
+        """
+        # the separator can be split between two reads
+        pos = max(self.start, self.cursor - len(self.separator) + 1)
+        idx = self.buf.find(self.separator, pos)
+        if idx < 0:
+            self.cursor = len(self.buf)
+            return None
+        return idx + len(self.separator)
+
+class FixedLengthFramer(Framer):
+    """
+    Frames with a fixed length
+    """
+    def __init__(self, length):
+        """
+        Constructor
+        """
+        Framer.__init__(self)
+        self.length = int(length)
+        if self.length <= 0:
+            raise ValueError("invalid frame length: %s" % length)
+
+    def findEnd(self):
+        """
+        Return the end of the frame if enough bytes are received
+        """
+        if len(self.buf) - self.start >= self.length:
+            return self.start + self.length
+        return None
+
+class LengthPrefixFramer(Framer):
+    """
+    Frames prefixed by their length on 1, 2 or 4 bytes,
+    the prefix is kept in the frame
+    """
+    FORMATS = { 1: "B", 2: "H", 4: "I" }
+
+    def __init__(self, size=2, endian="big", includesHeader=False, offset=0):
+        """
+        Constructor
+
+        @param size: size of the length field in bytes (1, 2 or 4)
+        @param endian: big or little
+        @param includesHeader: True if the length counts the prefix itself
+        @param offset: position of the length field in the frame
+        """
+        Framer.__init__(self)
+        size = int(size)
+        if size not in self.FORMATS:
+            raise ValueError("invalid length size: %s" % size)
+        if endian not in ("big", "little"):
+            raise ValueError("invalid endianness: %s" % endian)
+        self.size = size
+        self.offset = int(offset)
+        self.headerSize = self.offset + size
+        self.includesHeader = includesHeader
+        self.fmt = "%s%s" % (">" if endian == "big" else "<", self.FORMATS[size])
+
+    def findEnd(self):
+        """
+        Decode the length field when available
+        """
+        if len(self.buf) - self.start < self.headerSize:
+            return None
+        (length,) = struct.unpack_from(self.fmt, self.buf, self.start + self.offset)
+        if not self.includesHeader:
+            length += self.headerSize
+        elif length < self.headerSize:
+            raise ValueError("invalid frame length: %s" % length)
+        if len(self.buf) - self.start >= length:
+            return self.start + length
+        return None
+
+class RegexFramer(Framer):
+    """
+    Frames ended by a delimiter matching a regular expression,
+    the delimiter is kept in the frame
+    """
+    def __init__(self, pattern, lookback=REGEX_LOOKBACK):
+        """
+        Constructor
+
+        @param lookback: bytes rescanned at the end of the previous read,
+                         must be greater than the longest delimiter
+        """
+        Framer.__init__(self)
+        self.regex = re.compile( toBytes(pattern) )
+        self.lookback = int(lookback)
+
+    def findEnd(self):
+        """
+        Search the delimiter from the scan cursor
+        """
+        pos = max(self.start, self.cursor - self.lookback)
+        while True:
+            match = self.regex.search(self.buf, pos)
+            if match is None:
+                self.cursor = len(self.buf)
+                return None
+            if match.end() > match.start():
+                return match.end()
+            # empty match, ignore it
+            pos = match.end() + 1
+            if pos > len(self.buf):
+                self.cursor = len(self.buf)
+                return None
+
+def createFramer(cfg):
+    """
+    Return the framer according to the configuration of the socket
+    or None if the framing is disabled
+
+    Keys supported:
+        * framing: separator|fixed|length-prefix|regex
+        * sep-in: separator, also used when sep-disabled is False
+        * frame-length: length of fixed frames
+        * length-size, length-endian, length-offset, length-includes-header
+        * frame-regex, frame-regex-lookback
+    """
+    framing = cfg.get('framing')
+    if framing is None:
+        if cfg.get('sep-disabled', True):
+            return None
+        framing = FRAMING_SEPARATOR
+
+    if framing == FRAMING_SEPARATOR:
+        return SeparatorFramer( cfg['sep-in'] )
+    elif framing == FRAMING_FIXED:
+        return FixedLengthFramer( cfg['frame-length'] )
+    elif framing == FRAMING_LENGTH_PREFIX:
+        return LengthPrefixFramer( size=cfg.get('length-size', 2),
+                                   endian=cfg.get('length-endian', 'big'),
+                                   includesHeader=cfg.get('length-includes-header', False),
+                                   offset=cfg.get('length-offset', 0) )
+    elif framing == FRAMING_REGEX:
+        return RegexFramer( cfg['frame-regex'],
+                            lookback=cfg.get('frame-regex-lookback', REGEX_LOOKBACK) )
+    else:
+        raise ValueError("framing unknown: %s" % framing)
@@ -0,0 +1,639 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2019 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+"""
+Load generator of the socket agent
+
+N tcp or udp flows are opened from one event loop, a templated payload
+is sent at the target rate with an open-loop pacing: messages are sent
+at their scheduled time whatever the replies, and the round trip time
+is measured from the scheduled time, so a slow server is not hidden
+by a slower sending.
+
+Replies are matched with the framing when configured, otherwise by the
+size of the request (echo) for tcp, and one datagram for udp.
+"""
+
+import collections
+import threading
+import socket
+import errno
+import math
+import time
+
+try:
+    import Reactor
+except ImportError: # python3 support
+    from . import Reactor
+try:
+    import Framer
+except ImportError: # python3 support
+    from . import Framer
+
+# period of the pacing timer, in seconds
+LOAD_TICK = 0.001
+# period of the timeouts check, in seconds
+CHECK_PERIOD = 0.1
+
+CONNECT_TIMEOUT = 5.0
+REPLY_TIMEOUT = 5.0
+
+RECV_BUFFER_SIZE = 256*1024
+
+# buckets by unit of natural log, about 5% of precision
+BUCKETS_BY_LOG = 20
+
+CONNECT_IN_PROGRESS = ( 0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, 10035 )
+RESET_ERRNOS = ( errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED )
+
+class Histogram(object):
+    """
+    Latency histogram with logarithmic buckets
+    """
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """
+        Add one value, in seconds
+        """
+        us = max(value * 1000000, 1.0)
+        idx = int( math.log(us) * BUCKETS_BY_LOG )
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def upperBound(self, idx):
+        """
+        Return the upper bound of the bucket in milliseconds
+        """
+        return math.exp( float(idx + 1) / BUCKETS_BY_LOG ) / 1000
+
+    def percentile(self, p):
+        """
+        Return the percentile in milliseconds, as the upper bound of its bucket
+        """
+        if not self.count:
+            return None
+        rank = p * self.count / 100.0
+        seen = 0
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            if seen >= rank:
+                return min( self.upperBound(idx), self.max * 1000 )
+        return self.max * 1000
+
+    def summary(self):
+        """
+        Return the summary of the histogram, all values in milliseconds
+        """
+        if not self.count:
+            return { 'count': 0 }
+        return { 'count': self.count,
+                 'min': self.min * 1000, 'max': self.max * 1000,
+                 'mean': self.total / self.count * 1000,
+                 'p50': self.percentile(50), 'p90': self.percentile(90),
+                 'p99': self.percentile(99), 'p99.9': self.percentile(99.9),
+                 'buckets': [ [ self.upperBound(idx), self.buckets[idx] ] for idx in sorted(self.buckets) ] }
+
+class Flow(object):
+    """
+    Base flow
+    """
+    def __init__(self, generator, id):
+        """
+        Constructor
+        """
+        self.generator = generator
+        self.id = id
+        self.socket = None
+        self.connected = False
+        self.closed = False
+        self.connectStart = None
+        # scheduled time and size of the requests waiting a reply
+        self.pending = collections.deque()
+        self.received = 0
+        self.framer = Framer.createFramer(generator.cfg) if 'framing' in generator.cfg else None
+
+    def getFamily(self):
+        """
+        Return the address family
+        """
+        if self.generator.cfg.get('sock-family', 4) == 6:
+            return socket.AF_INET6
+        return socket.AF_INET
+
+    def close(self):
+        """
+        Close the flow
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.connected = False
+        if self.socket is not None:
+            self.generator.reactor.unregister(self.socket)
+            self.socket.close()
+
+    def onError(self, e):
+        """
+        On socket error, the flow is closed
+        """
+        self.generator.onFlowError(self, e)
+        self.close()
+
+    def onReply(self, now, count=1):
+        """
+        On replies received
+        """
+        for i in range(count):
+            if not self.pending:
+                break
+            scheduled, size = self.pending.popleft()
+            self.generator.onReply(now - scheduled)
+
+    def onData(self, data):
+        """
+        On data received, match the replies
+        """
+        now = time.time()
+        self.received += len(data)
+        self.generator.counters['bytes-received'] += len(data)
+        if not self.generator.waitReply:
+            return
+        if self.framer is not None:
+            self.onReply( now, len(self.framer.feed(data)) )
+        else:
+            self.matchBySize( now, len(data) )
+
+    def matchBySize(self, now, size):
+        """
+        Without framing, a reply is complete when as many bytes as the request are received
+        """
+        self.onReply(now, 1)
+
+    def checkTimeouts(self, now):
+        """
+        Drop the requests without reply after the timeout
+        """
+        limit = now - self.generator.replyTimeout
+        while self.pending and self.pending[0][0] < limit:
+            self.pending.popleft()
+            self.generator.counters['timeouts'] += 1
+
+class TcpFlow(Flow):
+    """
+    Tcp flow
+    """
+    def __init__(self, generator, id):
+        """
+        Constructor
+        """
+        Flow.__init__(self, generator, id)
+        self.outBuffer = bytearray()
+        self.replyRemaining = 0
+
+    def open(self):
+        """
+        Start the connection, without blocking
+        """
+        self.socket = socket.socket(self.getFamily(), socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket.setblocking(0)
+        self.connectStart = time.time()
+        err = self.socket.connect_ex( (self.generator.cfg['dst-ip'], self.generator.cfg['dst-port']) )
+        if err not in CONNECT_IN_PROGRESS:
+            self.onError( socket.error(err, "connect failed") )
+            return
+        self.generator.reactor.register(self.socket, self)
+        self.generator.reactor.wantWrite(self.socket, True)
+
+    def send(self, payload, scheduled):
+        """
+        Send the payload or buffer it if the socket would block
+        Return False if the flow is closed on error
+        """
+        if self.generator.waitReply:
+            self.pending.append( (scheduled, len(payload)) )
+        if self.outBuffer:
+            self.outBuffer += payload
+            return True
+        try:
+            sent = self.socket.send(payload)
+        except socket.error as e:
+            if not Reactor.wouldBlock(e):
+                self.onError(e)
+                return False
+            sent = 0
+        if sent < len(payload):
+            self.outBuffer += payload[sent:]
+            self.generator.reactor.wantWrite(self.socket, True)
+        return True
+
+    def matchBySize(self, now, size):
+        """
+        Without framing, a reply is complete when as many bytes as the request are received
+        """
+        while size and self.pending:
+            if not self.replyRemaining:
+                self.replyRemaining = self.pending[0][1]
+            used = min(size, self.replyRemaining)
+            self.replyRemaining -= used
+            size -= used
+            if not self.replyRemaining:
+                self.onReply(now, 1)
+
+    def onReactorRead(self):
+        """
+        On readable event, read until the socket would block
+        """
+        buf, view = self.generator.reactor.getRecvBuffer(RECV_BUFFER_SIZE)
+        while not self.closed:
+            try:
+                nbytes = self.socket.recv_into(buf)
+            except socket.error as e:
+                if not Reactor.wouldBlock(e):
+                    self.onError(e)
+                return
+            if not nbytes:
+                self.generator.counters['closed-by-peer'] += 1
+                self.close()
+                return
+            self.onData( view[:nbytes] )
+
+    def onReactorWrite(self):
+        """
+        On writable event, end the connection or send the buffered data
+        """
+        if self.closed:
+            return
+        if not self.connected:
+            err = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                self.onError( socket.error(err, "connect failed") )
+                return
+            self.connected = True
+            self.generator.onConnected(self, time.time() - self.connectStart)
+        while self.outBuffer:
+            try:
+                sent = self.socket.send(self.outBuffer)
+            except socket.error as e:
+                if not Reactor.wouldBlock(e):
+                    self.onError(e)
+                return
+            del self.outBuffer[:sent]
+        self.generator.reactor.wantWrite(self.socket, False)
+
+class UdpFlow(Flow):
+    """
+    Udp flow, one datagram by message
+    """
+    def open(self):
+        """
+        Create the connected udp socket
+        """
+        self.socket = socket.socket(self.getFamily(), socket.SOCK_DGRAM)
+        self.socket.setblocking(0)
+        self.socket.connect( (self.generator.cfg['dst-ip'], self.generator.cfg['dst-port']) )
+        self.generator.reactor.register(self.socket, self)
+        self.connected = True
+        self.generator.onConnected(self, None)
+
+    def send(self, payload, scheduled):
+        """
+        Send one datagram, dropped if the socket would block
+        Return False if not sent
+        """
+        try:
+            self.socket.send(payload)
+        except socket.error as e:
+            if Reactor.wouldBlock(e):
+                self.generator.counters['dropped'] += 1
+                return False
+            # icmp error of a previous datagram, the flow is kept
+            self.generator.onFlowError(self, e)
+            return False
+        if self.generator.waitReply:
+            self.pending.append( (scheduled, len(payload)) )
+        return True
+
+    def onReactorRead(self):
+        """
+        On readable event, read all datagrams
+        """
+        buf, view = self.generator.reactor.getRecvBuffer(RECV_BUFFER_SIZE)
+        while not self.closed:
+            try:
+                nbytes = self.socket.recv_into(buf)
+            except socket.error as e:
+                if not Reactor.wouldBlock(e):
+                    self.generator.onFlowError(self, e)
+                    continue
+                return
+            self.onData( view[:nbytes] )
+
+    def onReactorWrite(self):
+        """
+        Nothing to do
+        """
+        pass
+
+class LoadGenerator(object):
+    """
+    Load generator, driven by its own reactor
+
+    Keys supported:
+        * sock-type: tcp|udp
+        * sock-family: 4|6, dst-ip, dst-port
+        * flows: number of concurrent flows
+        * rate: messages by second, for all flows, 0 to only open the flows
+        * duration: in seconds
+        * payload: template of the message, with {flow}, {seq} and {time}
+        * wait-reply: measure the round trip time of each message
+        * reply-timeout, connect-timeout: in seconds
+        * framing: see Framer.createFramer, to match the replies
+    """
+    def __init__(self, parent, request):
+        """
+        Constructor
+        """
+        self.parent = parent
+        self.request = request
+        self.cfg = request['data']
+        self.flows = []
+        self.nextFlow = 0
+        self.reactor = Reactor.Reactor(parent)
+        self.started = False
+        self.finishedEvent = threading.Event()
+        self.finishing = False
+        self.startTime = None
+        self.lastCheck = 0
+        self.scheduled = 0
+        self.seq = 0
+        self.finishTimer = None
+        self.tickTimer = None
+        self.counters = collections.defaultdict(int)
+        self.connectLatency = Histogram()
+        self.rtt = Histogram()
+        self.lastError = None
+
+        self.sockType = self.cfg.get('sock-type', 'tcp')
+        self.nbFlows = int( self.cfg.get('flows', 1) )
+        self.rate = float( self.cfg.get('rate', 0) )
+        self.duration = float( self.cfg.get('duration', 10) )
+        self.waitReply = self.cfg.get('wait-reply', False)
+        self.replyTimeout = float( self.cfg.get('reply-timeout', REPLY_TIMEOUT) )
+        self.connectTimeout = float( self.cfg.get('connect-timeout', CONNECT_TIMEOUT) )
+        self.template = self.cfg.get('payload', '')
+        self.payload = None
+        if '{' not in self.template:
+            self.payload = Framer.toBytes(self.template)
+
+    def trace(self, txt):
+        """
+        Trace
+        """
+        self.parent.trace( str(txt) )
+
+    def error(self, err):
+        """
+        Log error
+        """
+        self.parent.error( str(err) )
+
+    def sendError(self, data):
+        """
+        Send error to the server
+        """
+        self.error( "send error: %s"  % str(data) )
+        req =  self.request
+        req['event'] = "agent-error"
+        req['data'] = data
+        self.parent.notify( data=req )
+
+    def sendNotify(self, data):
+        """
+        Send notify to the server
+        """
+        self.trace( "send notify: %s"  % str(data) )
+        req =  self.request
+        req['event'] = "agent-notify"
+        req['data'] = data
+        self.parent.notify( data=req )
+
+    def start(self):
+        """
+        Start the load
+        """
+        if self.sockType not in ( 'tcp', 'udp' ):
+            self.sendError( data={ 'load-event': 'sock-type-unknown', 'more': str(self.sockType) } )
+            self.finishedEvent.set()
+            return
+        Reactor.raiseFdLimit()
+        self.started = True
+        self.reactor.start()
+        self.reactor.callSoon(self.onStart)
+
+    def stop(self):
+        """
+        Stop the load before the end, the result is sent
+        """
+        if self.started and not self.finishedEvent.isSet():
+            self.reactor.callSoon(self.finish)
+
+    def join(self, timeout=None):
+        """
+        Wait the end of the load
+        """
+        self.finishedEvent.wait(timeout)
+
+    def onReset(self):
+        """
+        On reset
+        """
+        self.stop()
+
+    def onNotify(self, client, tid, request):
+        """
+        Nothing to send to a load
+        """
+        self.trace( "load running, notify ignored" )
+
+    def getPayload(self, flow):
+        """
+        Return the payload of the next message
+        """
+        self.seq += 1
+        if self.payload is not None:
+            return self.payload
+        data = self.template.replace("{flow}", str(flow.id)).replace("{seq}", str(self.seq))
+        data = data.replace("{time}", "%.6f" % time.time())
+        return Framer.toBytes(data)
+
+    def onStart(self):
+        """
+        Called in the reactor, open all flows and start the pacing
+        """
+        self.startTime = time.time()
+        self.lastCheck = self.startTime
+        self.sendNotify( data={ 'load-event': 'started', 'flows': self.nbFlows, 'rate': self.rate,
+                                'duration': self.duration } )
+        for i in range(self.nbFlows):
+            if self.sockType == 'tcp':
+                flow = TcpFlow(self, i)
+            else:
+                flow = UdpFlow(self, i)
+            self.flows.append(flow)
+            try:
+                flow.open()
+            except socket.error as e:
+                flow.onError(e)
+        self.finishTimer = self.reactor.callLater(self.duration, self.finish)
+        self.tickTimer = self.reactor.callLater(LOAD_TICK, self.onTick)
+
+    def getReadyFlow(self):
+        """
+        Return the next connected flow, round robin
+        """
+        for i in range(len(self.flows)):
+            flow = self.flows[self.nextFlow]
+            self.nextFlow = (self.nextFlow + 1) % len(self.flows)
+            if flow.connected:
+                return flow
+        return None
+
+    def onTick(self):
+        """
+        Send the messages scheduled since the last tick
+        """
+        now = time.time()
+        if self.rate:
+            due = int( (now - self.startTime) * self.rate ) - self.scheduled
+            for i in range(due):
+                self.scheduled += 1
+                scheduled = self.startTime + self.scheduled / self.rate
+                flow = self.getReadyFlow()
+                if flow is None:
+                    self.counters['dropped'] += 1
+                    continue
+                payload = self.getPayload(flow)
+                if flow.send(payload, scheduled):
+                    self.counters['sent'] += 1
+                    self.counters['bytes-sent'] += len(payload)
+        if now - self.lastCheck >= CHECK_PERIOD:
+            self.lastCheck = now
+            self.checkTimeouts(now)
+        self.tickTimer = self.reactor.callLater(LOAD_TICK, self.onTick)
+
+    def checkTimeouts(self, now):
+        """
+        Check the connection and reply timeouts
+        """
+        for flow in self.flows:
+            if flow.closed:
+                continue
+            if not flow.connected:
+                if now - flow.connectStart > self.connectTimeout:
+                    self.counters['connect-timeouts'] += 1
+                    flow.close()
+            elif self.waitReply:
+                flow.checkTimeouts(now)
+
+    def onConnected(self, flow, latency):
+        """
+        On flow connected
+        """
+        self.counters['connected'] += 1
+        if latency is not None:
+            self.connectLatency.add(latency)
+
+    def onReply(self, rtt):
+        """
+        On reply received
+        """
+        self.counters['replies'] += 1
+        self.rtt.add(rtt)
+
+    def onFlowError(self, flow, e):
+        """
+        On socket error of a flow
+        """
+        if getattr(e, "errno", None) in RESET_ERRNOS:
+            self.counters['resets'] += 1
+        else:
+            self.counters['errors'] += 1
+        self.lastError = str(e)
+
+    def finish(self):
+        """
+        Called in the reactor, close all flows and send the result
+        """
+        if self.finishing:
+            return
+        self.finishing = True
+        try:
+            if self.finishTimer is not None:
+                self.finishTimer.cancel()
+            if self.tickTimer is not None:
+                self.tickTimer.cancel()
+            duration = time.time() - self.startTime
+            pending = 0
+            for flow in self.flows:
+                pending += len(flow.pending)
+                flow.close()
+            self.sendNotify( data=self.getResult(duration, pending) )
+        except Exception as e:
+            self.sendError( data={ 'load-event': 'result-error', 'more': str(e) } )
+        finally:
+            self.reactor.stop()
+            self.finishedEvent.set()
+
+    def getResult(self, duration, pending):
+        """
+        Return the aggregated result of the load
+        """
+        c = self.counters
+        duration = max(duration, 0.000001)
+        return { 'load-event': 'result', 'sock-type': self.sockType,
+                 'flows': self.nbFlows, 'connected': c['connected'], 'duration': duration,
+                 'sent': c['sent'], 'bytes-sent': c['bytes-sent'],
+                 'replies': c['replies'], 'bytes-received': c['bytes-received'],
+                 'dropped': c['dropped'], 'timeouts': c['timeouts'], 'pending': pending,
+                 'connect-timeouts': c['connect-timeouts'], 'closed-by-peer': c['closed-by-peer'],
+                 'errors': c['errors'], 'resets': c['resets'], 'last-error': self.lastError,
+                 'send-rate': c['sent'] / duration, 'reply-rate': c['replies'] / duration,
+                 'throughput-sent': c['bytes-sent'] / duration,
+                 'throughput-received': c['bytes-received'] / duration,
+                 'connect-latency': self.connectLatency.summary(),
+                 'rtt': self.rtt.summary() }
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2019 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+"""
+Pcap files support for the socket agent
+"""
+
+import os
+import socket
+import struct
+
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+PCAP_VERSION_MAJOR = 2
+PCAP_VERSION_MINOR = 4
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+
+GLOBAL_HEADER = struct.Struct("=IHHiIII")
+RECORD_HEADER = struct.Struct("=IIII")
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_VLAN = ( 0x8100, 0x88a8 )
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+class PcapError(Exception):
+    """
+    Pcap error
+    """
+    pass
+
+class Packet(object):
+    """
+    Ip packet decoded from a frame, only udp and tcp are decoded
+    """
+    __slots__ = ( 'timestamp', 'frame', 'family', 'proto', 'src', 'dst', 'sport', 'dport',
+                  'payload', 'seq', 'flags' )
+
+    def __init__(self, timestamp, frame):
+        """
+        Constructor
+        """
+        self.timestamp = timestamp
+        self.frame = frame
+        self.family = None
+        self.proto = None
+        self.src = None
+        self.dst = None
+        self.sport = None
+        self.dport = None
+        self.payload = None
+        self.seq = None
+        self.flags = 0
+
+class PcapWriter(object):
+    """
+    Pcap file writer
+    """
+    def __init__(self, filename, snaplen=65535, linktype=LINKTYPE_ETHERNET):
+        """
+        Constructor
+        """
+        self.filename = filename
+        self.snaplen = snaplen
+        self.fd = open(filename, "wb")
+        self.fd.write( GLOBAL_HEADER.pack(PCAP_MAGIC, PCAP_VERSION_MAJOR, PCAP_VERSION_MINOR,
+                                          0, 0, snaplen, linktype) )
+        self.size = GLOBAL_HEADER.size
+        self.frames = 0
+
+    def write(self, frame, timestamp):
+        """
+        Write one frame
+        """
+        sec = int(timestamp)
+        usec = int( (timestamp - sec) * 1000000 )
+        caplen = min(len(frame), self.snaplen)
+        self.fd.write( RECORD_HEADER.pack(sec, usec, caplen, len(frame)) )
+        self.fd.write( frame[:caplen] )
+        self.size += RECORD_HEADER.size + caplen
+        self.frames += 1
+
+    def close(self):
+        """
+        Close the file
+        """
+        self.fd.close()
+
+class PcapReader(object):
+    """
+    Pcap file reader, frames are read one by one
+
+    Both byte orders and the nanosecond format are supported,
+    pcapng files are not.
+    """
+    def __init__(self, filename):
+        """
+        Constructor
+        """
+        self.filename = filename
+        self.fd = open(filename, "rb")
+        header = self.fd.read(GLOBAL_HEADER.size)
+        if len(header) < GLOBAL_HEADER.size:
+            self.fd.close()
+            raise PcapError("invalid pcap file: truncated header")
+        self.nsec = False
+        for order in ( "<", ">" ):
+            magic = struct.unpack(order + "I", header[:4])[0]
+            if magic in ( PCAP_MAGIC, PCAP_MAGIC_NSEC ):
+                self.nsec = magic == PCAP_MAGIC_NSEC
+                break
+        else:
+            self.fd.close()
+            raise PcapError("invalid pcap file: bad magic number (pcapng not supported)")
+        self.globalHeader = struct.Struct(order + "IHHiIII")
+        self.recordHeader = struct.Struct(order + "IIII")
+        (magic, major, minor, zone, sigfigs, 
+            self.snaplen, self.linktype) = self.globalHeader.unpack(header)
+
+    def __iter__(self):
+        """
+        Iterate on frames
+        """
+        return self
+
+    def __next__(self):
+        """
+        Return the next frame as (timestamp, frame)
+        """
+        header = self.fd.read(self.recordHeader.size)
+        if len(header) < self.recordHeader.size:
+            raise StopIteration
+        sec, frac, caplen, length = self.recordHeader.unpack(header)
+        frame = self.fd.read(caplen)
+        if len(frame) < caplen:
+            raise StopIteration
+        if self.nsec:
+            return sec + frac / 1000000000.0, frame
+        return sec + frac / 1000000.0, frame
+
+    next = __next__ # python2 support
+
+    def close(self):
+        """
+        Close the file
+        """
+        self.fd.close()
+
+def decodeFrame(timestamp, frame, linktype=LINKTYPE_ETHERNET):
+    """
+    Decode the ip, udp and tcp headers of the frame
+    Return a Packet, or None if the frame is not an ip packet
+    """
+    pkt = Packet(timestamp, frame)
+    if linktype == LINKTYPE_ETHERNET:
+        if len(frame) < 14:
+            return None
+        offset = 12
+        ethertype = struct.unpack("!H", frame[12:14])[0]
+        while ethertype in ETHERTYPE_VLAN and len(frame) >= offset + 6:
+            offset += 4
+            ethertype = struct.unpack("!H", frame[offset:offset+2])[0]
+        offset += 2
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if len(frame) < 16:
+            return None
+        ethertype = struct.unpack("!H", frame[14:16])[0]
+        offset = 16
+    elif linktype == LINKTYPE_NULL:
+        if len(frame) < 4:
+            return None
+        ethertype = ETHERTYPE_IPV4 if frame[:4] in ( b"\x02\x00\x00\x00", b"\x00\x00\x00\x02" ) else ETHERTYPE_IPV6
+        offset = 4
+    elif linktype == LINKTYPE_RAW:
+        if not frame:
+            return None
+        ethertype = ETHERTYPE_IPV4 if ord(frame[0:1]) >> 4 == 4 else ETHERTYPE_IPV6
+        offset = 0
+    else:
+        return None
+
+    if ethertype == ETHERTYPE_IPV4:
+        if len(frame) < offset + 20:
+            return None
+        ihl = (ord(frame[offset:offset+1]) & 0x0f) * 4
+        total = struct.unpack("!H", frame[offset+2:offset+4])[0]
+        fragment = struct.unpack("!H", frame[offset+6:offset+8])[0]
+        pkt.family = 4
+        pkt.proto = ord(frame[offset+9:offset+10])
+        pkt.src = "%d.%d.%d.%d" % struct.unpack("!BBBB", frame[offset+12:offset+16])
+        pkt.dst = "%d.%d.%d.%d" % struct.unpack("!BBBB", frame[offset+16:offset+20])
+        end = offset + total if total else len(frame)
+        offset += ihl
+        # only the first fragment holds the transport header
+        if fragment & 0x1fff:
+            return pkt
+    elif ethertype == ETHERTYPE_IPV6:
+        if len(frame) < offset + 40:
+            return None
+        length = struct.unpack("!H", frame[offset+4:offset+6])[0]
+        pkt.family = 6
+        pkt.proto = ord(frame[offset+6:offset+7])
+        pkt.src = formatIpv6( frame[offset+8:offset+24] )
+        pkt.dst = formatIpv6( frame[offset+24:offset+40] )
+        offset += 40
+        end = offset + length
+    else:
+        return None
+    end = min(end, len(frame))
+
+    if pkt.proto == IPPROTO_UDP and end >= offset + 8:
+        pkt.sport, pkt.dport = struct.unpack("!HH", frame[offset:offset+4])
+        pkt.payload = frame[offset+8:end]
+    elif pkt.proto == IPPROTO_TCP and end >= offset + 20:
+        pkt.sport, pkt.dport, pkt.seq = struct.unpack("!HHI", frame[offset:offset+8])
+        dataOffset = (ord(frame[offset+12:offset+13]) >> 4) * 4
+        pkt.flags = ord(frame[offset+13:offset+14])
+        pkt.payload = frame[offset+dataOffset:end]
+    return pkt
+
+def formatIpv6(addr):
+    """
+    Return the text form of an ipv6 address
+    """
+    try:
+        return socket.inet_ntop(socket.AF_INET6, addr)
+    except (AttributeError, ValueError): # inet_ntop not available on windows with python2
+        return ":".join( [ "%x" % w for w in struct.unpack("!8H", addr) ] )
+
+class PcapRing(object):
+    """
+    Ring of pcap files, the oldest file is deleted when the ring is full
+    """
+    def __init__(self, directory, prefix="capture", maxFiles=10, maxBytes=10*1024*1024,
+                       snaplen=65535, linktype=LINKTYPE_ETHERNET):
+        """
+        Constructor
+
+        @param maxFiles: number of files kept in the ring
+        @param maxBytes: max size of one file
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.maxFiles = max(1, int(maxFiles))
+        self.maxBytes = int(maxBytes)
+        self.snaplen = snaplen
+        self.linktype = linktype
+        self.seq = 0
+        self.files = []
+        self.writer = None
+        self.frames = 0
+        self.bytes = 0
+        self.rotate()
+
+    def rotate(self):
+        """
+        Open the next file of the ring
+        """
+        if self.writer is not None:
+            self.writer.close()
+        if len(self.files) >= self.maxFiles:
+            oldest = self.files.pop(0)
+            try:
+                os.remove(oldest)
+            except OSError as e:
+                pass
+        filename = os.path.join( self.directory, "%s_%06d.pcap" % (self.prefix, self.seq) )
+        self.seq += 1
+        self.writer = PcapWriter(filename, snaplen=self.snaplen, linktype=self.linktype)
+        self.files.append(filename)
+
+    def write(self, frame, timestamp):
+        """
+        Write one frame, a new file is opened when the current one is full
+        """
+        if self.writer.frames and self.writer.size + RECORD_HEADER.size + len(frame) > self.maxBytes:
+            self.rotate()
+        self.writer.write(frame, timestamp)
+        self.frames += 1
+        self.bytes += len(frame)
+
+    def close(self):
+        """
+        Close the current file
+        """
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
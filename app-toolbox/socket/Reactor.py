@@ -0,0 +1,549 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2019 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+"""
+Event loop shared by all sockets of the socket agent
+
+One thread owns every registered socket. On linux, epoll is used in
+edge-triggered mode, otherwise the best selector available is used in
+level-triggered mode. In both cases, handlers must read (and write) until
+the operation would block.
+
+A handler is any object with the following functions:
+    * onReactorRead()
+    * onReactorWrite()
+"""
+
+import threading
+import socket
+import select
+import errno
+import heapq
+import math
+import time
+import sys
+
+try:
+    import selectors
+except ImportError: # python2 support
+    selectors = None
+
+try:
+    import resource
+except ImportError: # not available on windows
+    resource = None
+
+# SSL support
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+# maximum time to wait in the poller, in seconds
+MAX_POLL_TIMEOUT = 1.0
+
+# default tick (seconds) and number of slots of the timer wheels
+WHEEL_TICK = 0.1
+WHEEL_SLOTS = 512
+
+WOULD_BLOCK_ERRNOS = ( errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR )
+
+def isSupported():
+    """
+    Return True if a poller is available on this platform
+    """
+    return hasattr(select, "epoll") or selectors is not None
+
+def wouldBlock(err):
+    """
+    Return True if the socket error means that the operation would block
+    """
+    if ssl is not None and isinstance(err, ssl.SSLError):
+        return err.args[0] in ( ssl.SSL_ERROR_WANT_READ, ssl.SSL_ERROR_WANT_WRITE )
+    return getattr(err, "errno", None) in WOULD_BLOCK_ERRNOS
+
+def raiseFdLimit():
+    """
+    Raise the soft limit of open files to the hard limit,
+    needed to serve thousands of sockets
+    """
+    if resource is None:
+        return
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard != resource.RLIM_INFINITY and soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError) as e:
+        pass
+
+def socketPair():
+    """
+    Return a pair of connected sockets
+    Fallback on a loopback tcp connection when socketpair is not available
+    """
+    try:
+        return socket.socketpair()
+    except (AttributeError, OSError, socket.error):
+        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            srv.bind( ("127.0.0.1", 0) )
+            srv.listen(1)
+            a = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            a.connect( srv.getsockname() )
+            b, addr = srv.accept()
+        finally:
+            srv.close()
+        return (a, b)
+
+class Timer(object):
+    """
+    Timer scheduled in the reactor
+    """
+    def __init__(self, when, callback, args):
+        """
+        Constructor
+        """
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Cancel the timer
+        """
+        self.cancelled = True
+
+class TimerWheel(object):
+    """
+    Hashed timer wheel, driven by a reactor
+
+    Deadlines are hashed in a fixed number of slots, one slot is expired
+    on each tick: adding, removing and expiring a deadline cost O(1)
+    whatever the number of sockets. Deadlines are rounded to the tick.
+    Thread safe, callbacks are called in the reactor thread with the current time.
+    """
+    def __init__(self, reactor, tick=WHEEL_TICK, slots=WHEEL_SLOTS):
+        """
+        Constructor
+
+        @param tick: duration of one slot in seconds
+        @param slots: number of slots, a round of the wheel lasts tick*slots
+        """
+        self.reactor = reactor
+        self.tick = tick
+        self.slots = [ {} for i in range(slots) ]
+        self.where = {}
+        self.cursor = 0
+        self.nextTick = time.time() + tick
+        self.mutex = threading.Lock()
+        self.timer = None
+        self.closed = False
+        reactor.callSoon(self.onTick)
+
+    def add(self, key, delay, callback):
+        """
+        Add the deadline of the key, replace the previous one
+        """
+        ticks = max(1, int( math.ceil(delay / self.tick) ))
+        self.mutex.acquire()
+        try:
+            self.removeKey(key)
+            slot = (self.cursor + ticks) % len(self.slots)
+            self.slots[slot][key] = [ (ticks - 1) // len(self.slots), callback ]
+            self.where[key] = slot
+        finally:
+            self.mutex.release()
+
+    def remove(self, key):
+        """
+        Remove the deadline of the key
+        """
+        self.mutex.acquire()
+        try:
+            self.removeKey(key)
+        finally:
+            self.mutex.release()
+
+    def removeKey(self, key):
+        """
+        Remove the key, the mutex must be acquired
+        """
+        slot = self.where.pop(key, None)
+        if slot is not None:
+            del self.slots[slot][key]
+
+    def __len__(self):
+        """
+        Return the number of deadlines
+        """
+        return len(self.where)
+
+    def onTick(self):
+        """
+        Called by the reactor, expire the slots of the elapsed ticks
+        """
+        if self.closed:
+            return
+        now = time.time()
+        expired = []
+        self.mutex.acquire()
+        try:
+            while self.nextTick <= now:
+                self.nextTick += self.tick
+                self.cursor = (self.cursor + 1) % len(self.slots)
+                slot = self.slots[self.cursor]
+                for key, entry in list(slot.items()):
+                    if entry[0]:
+                        entry[0] -= 1
+                    else:
+                        del slot[key]
+                        del self.where[key]
+                        expired.append( entry[1] )
+        finally:
+            self.mutex.release()
+        for callback in expired:
+            try:
+                callback(now)
+            except Exception as e:
+                self.reactor.error( "timer wheel - callback error: %s" % e )
+        self.timer = self.reactor.callLater( max(0.0, self.nextTick - time.time()), self.onTick )
+
+    def close(self):
+        """
+        Stop the wheel, thread safe
+        """
+        self.closed = True
+        self.reactor.callSoon(self.cancel)
+
+    def cancel(self):
+        """
+        Cancel the tick timer, called in the reactor
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+
+class EpollPoller(object):
+    """
+    Edge-triggered poller based on epoll (linux only)
+    """
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.epoll = select.epoll()
+        self.readMask = select.EPOLLIN | select.EPOLLPRI | select.EPOLLERR | select.EPOLLHUP
+
+    def register(self, fd):
+        """
+        Register the file descriptor for read and write events
+        """
+        self.epoll.register(fd, self.readMask | select.EPOLLOUT | select.EPOLLET)
+
+    def unregister(self, fd):
+        """
+        Unregister the file descriptor
+        """
+        self.epoll.unregister(fd)
+
+    def wantWrite(self, fd, enabled):
+        """
+        Nothing to do in edge-triggered mode,
+        the write event is raised on each transition
+        """
+        pass
+
+    def poll(self, timeout):
+        """
+        Wait for events, return a list of (fd, readable, writable)
+        """
+        ret = []
+        for fd, ev in self.epoll.poll(timeout):
+            ret.append( (fd, bool(ev & self.readMask), bool(ev & select.EPOLLOUT)) )
+        return ret
+
+    def close(self):
+        """
+        Close the poller
+        """
+        self.epoll.close()
+
+class SelectorPoller(object):
+    """
+    Level-triggered poller based on the selectors module
+    """
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.selector = selectors.DefaultSelector()
+
+    def register(self, fd):
+        """
+        Register the file descriptor for read events
+        """
+        self.selector.register(fd, selectors.EVENT_READ)
+
+    def unregister(self, fd):
+        """
+        Unregister the file descriptor
+        """
+        self.selector.unregister(fd)
+
+    def wantWrite(self, fd, enabled):
+        """
+        Enable or disable the write event
+        """
+        if enabled:
+            self.selector.modify(fd, selectors.EVENT_READ | selectors.EVENT_WRITE)
+        else:
+            self.selector.modify(fd, selectors.EVENT_READ)
+
+    def poll(self, timeout):
+        """
+        Wait for events, return a list of (fd, readable, writable)
+        """
+        ret = []
+        if not self.selector.get_map():
+            # nothing registered, select can fail on windows with an empty list
+            time.sleep(timeout)
+            return ret
+        for key, ev in self.selector.select(timeout):
+            ret.append( (key.fd, bool(ev & selectors.EVENT_READ), bool(ev & selectors.EVENT_WRITE)) )
+        return ret
+
+    def close(self):
+        """
+        Close the poller
+        """
+        self.selector.close()
+
+class Reactor(threading.Thread):
+    """
+    Reactor thread
+    """
+    def __init__(self, parent):
+        """
+        Constructor
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.stopEvent = threading.Event()
+        self.parent = parent
+        self.handlers = {}
+        self.timers = []
+        self.timerSeq = 0
+        self.callbacks = []
+        self.callbacksMutex = threading.Lock()
+        # receive buffer shared by all sockets, only one is read at a time
+        self.recvBuffer = None
+        self.recvView = None
+        if hasattr(select, "epoll"):
+            self.poller = EpollPoller()
+        else:
+            self.poller = SelectorPoller()
+        self.wakeupR, self.wakeupW = socketPair()
+        self.wakeupR.setblocking(0)
+        self.wakeupW.setblocking(0)
+        self.poller.register( self.wakeupR.fileno() )
+        self.handlers[ self.wakeupR.fileno() ] = self
+
+    def trace(self, txt):
+        """
+        Trace
+        """
+        self.parent.trace( str(txt) )
+
+    def error(self, err):
+        """
+        Log error
+        """
+        self.parent.error( str(err) )
+
+    def isReactorThread(self):
+        """
+        Return True if the caller runs in the reactor thread
+        """
+        return threading.current_thread() is self
+
+    def register(self, sock, handler):
+        """
+        Register the socket, must be called from the reactor thread
+        """
+        fd = sock.fileno()
+        self.handlers[fd] = handler
+        self.poller.register(fd)
+
+    def unregister(self, sock):
+        """
+        Unregister the socket, must be called from the reactor thread
+        """
+        try:
+            fd = sock.fileno()
+        except Exception as e:
+            return
+        if self.handlers.pop(fd, None) is not None:
+            try:
+                self.poller.unregister(fd)
+            except Exception as e:
+                self.trace( "reactor - unable to unregister fd %s: %s" % (fd, e) )
+
+    def wantWrite(self, sock, enabled):
+        """
+        Enable or disable the write event for the socket,
+        must be called from the reactor thread
+        """
+        fd = sock.fileno()
+        if fd in self.handlers:
+            self.poller.wantWrite(fd, enabled)
+
+    def getRecvBuffer(self, size):
+        """
+        Return the receive buffer shared by the sockets of the reactor
+        and its memoryview, must be called from the reactor thread.
+        Data read in the buffer must be copied before the next read.
+        """
+        if self.recvBuffer is None or len(self.recvBuffer) < size:
+            self.recvBuffer = bytearray(size)
+            self.recvView = memoryview(self.recvBuffer)
+        return (self.recvBuffer, self.recvView)
+
+    def callSoon(self, callback, *args):
+        """
+        Schedule the callback in the reactor thread, thread safe
+        """
+        self.callbacksMutex.acquire()
+        self.callbacks.append( (callback, args) )
+        self.callbacksMutex.release()
+        self.wakeup()
+
+    def callLater(self, delay, callback, *args):
+        """
+        Schedule the callback after the delay in seconds,
+        must be called from the reactor thread
+
+        @return: timer, can be cancelled
+        @rtype: Timer
+        """
+        timer = Timer( time.time() + delay, callback, args )
+        self.timerSeq += 1
+        heapq.heappush(self.timers, (timer.when, self.timerSeq, timer) )
+        return timer
+
+    def wakeup(self):
+        """
+        Wake up the poller
+        """
+        try:
+            self.wakeupW.send(b"x")
+        except Exception as e:
+            pass # pipe full, the reactor is already awake
+
+    def onReactorRead(self):
+        """
+        Drain the wakeup socket
+        """
+        try:
+            while self.wakeupR.recv(4096):
+                pass
+        except Exception as e:
+            pass
+
+    def onReactorWrite(self):
+        """
+        Nothing to do for the wakeup socket
+        """
+        pass
+
+    def runCallbacks(self):
+        """
+        Run all pending callbacks
+        """
+        self.callbacksMutex.acquire()
+        callbacks = self.callbacks
+        self.callbacks = []
+        self.callbacksMutex.release()
+        for callback, args in callbacks:
+            try:
+                callback(*args)
+            except Exception as e:
+                self.error( "reactor - callback error: %s" % e )
+
+    def runTimers(self):
+        """
+        Run all expired timers and return the delay before the next one
+        """
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            when, seq, timer = heapq.heappop(self.timers)
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                self.error( "reactor - timer error: %s" % e )
+        while self.timers and self.timers[0][2].cancelled:
+            heapq.heappop(self.timers)
+        if self.timers:
+            return max(0.0, min(MAX_POLL_TIMEOUT, self.timers[0][0] - time.time()))
+        return MAX_POLL_TIMEOUT
+
+    def stop(self):
+        """
+        Stop the reactor
+        """
+        self.stopEvent.set()
+        self.wakeup()
+
+    def run(self):
+        """
+        On run function
+        """
+        self.trace( "reactor started" )
+        while not self.stopEvent.isSet():
+            timeout = self.runTimers()
+            if self.callbacks:
+                timeout = 0
+            try:
+                events = self.poller.poll(timeout)
+            except (IOError, OSError, select.error) as e:
+                if wouldBlock(e) or getattr(e, "args", [None])[0] == errno.EINTR:
+                    continue
+                self.error( "reactor - poll error: %s" % e )
+                continue
+            for fd, readable, writable in events:
+                handler = self.handlers.get(fd)
+                if handler is None:
+                    continue
+                try:
+                    if readable:
+                        handler.onReactorRead()
+                    if writable and fd in self.handlers:
+                        handler.onReactorWrite()
+                except Exception as e:
+                    self.error( "reactor - handler error: %s" % e )
+            self.runCallbacks()
+        self.poller.close()
+        self.wakeupR.close()
+        self.wakeupW.close()
+        self.trace( "reactor stopped" )
@@ -0,0 +1,659 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2019 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+"""
+Replay of pcap files by the socket agent
+
+Packets are read from the file and sent from one event loop at their
+original time divided by the speed, or as fast as possible. The drift
+is the delay between the scheduled time of a packet and its sending.
+
+Modes:
+    * udp: the payload of each datagram is sent to its destination,
+      from one socket by original source address
+    * tcp: one connection is opened by captured stream and the payloads
+      of the client are sent in order, retransmissions are skipped
+    * raw: frames are sent unchanged on the interface (linux only)
+"""
+
+import collections
+import threading
+import socket
+import time
+import os
+
+try:
+    import Reactor
+except ImportError: # python3 support
+    from . import Reactor
+try:
+    import Pcap
+except ImportError: # python3 support
+    from . import Pcap
+try:
+    import LoadGenerator
+except ImportError: # python3 support
+    from . import LoadGenerator
+
+# max packets sent in one turn of the event loop
+REPLAY_BATCH = 256
+# delay before to close the sockets after the last packet, in seconds
+REPLAY_LINGER = 1.0
+
+RECV_BUFFER_SIZE = 256*1024
+
+CONNECT_IN_PROGRESS = LoadGenerator.CONNECT_IN_PROGRESS
+
+def parseAddress(text):
+    """
+    Return (ip, port) from ip, ip:port, [ipv6]:port or :port,
+    ip or port is None when not provided
+    """
+    text = str(text).strip()
+    if text.startswith("["):
+        ip, sep, port = text[1:].partition("]")
+        port = port.lstrip(":")
+    elif text.count(":") == 1:
+        ip, port = text.split(":")
+    else:
+        ip, port = text, ""
+    return ( ip or None, int(port) if port else None )
+
+def formatAddress(ip, port):
+    """
+    Return the text form of the address, as used in the rewrite keys
+    """
+    if ":" in ip:
+        return "[%s]:%s" % (ip, port)
+    return "%s:%s" % (ip, port)
+
+class UdpSource(object):
+    """
+    Udp socket sending the datagrams of one original source address
+    """
+    def __init__(self, engine, family):
+        """
+        Constructor
+        """
+        self.engine = engine
+        self.socket = socket.socket(family, socket.SOCK_DGRAM)
+        self.socket.setblocking(0)
+        engine.reactor.register(self.socket, self)
+
+    def send(self, payload, addr):
+        """
+        Send one datagram, return False on error
+        """
+        try:
+            self.socket.sendto(payload, addr)
+        except socket.error as e:
+            self.engine.onSendError(e)
+            return False
+        return True
+
+    def close(self):
+        """
+        Close the socket
+        """
+        self.engine.reactor.unregister(self.socket)
+        self.socket.close()
+
+    def onReactorRead(self):
+        """
+        Read and count the replies
+        """
+        buf, view = self.engine.reactor.getRecvBuffer(RECV_BUFFER_SIZE)
+        while True:
+            try:
+                nbytes = self.socket.recv_into(buf)
+            except socket.error as e:
+                if Reactor.wouldBlock(e):
+                    return
+                # icmp error of a previous datagram
+                self.engine.onSendError(e)
+                continue
+            self.engine.counters['bytes-received'] += nbytes
+
+    def onReactorWrite(self):
+        """
+        Nothing to do
+        """
+        pass
+
+class TcpStream(object):
+    """
+    Tcp connection replaying the client side of one captured stream
+    """
+    def __init__(self, engine, addr, family):
+        """
+        Constructor
+        """
+        self.engine = engine
+        self.nextSeq = None
+        self.connected = False
+        self.closed = False
+        self.finished = False
+        self.outBuffer = bytearray()
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket.setblocking(0)
+        err = self.socket.connect_ex(addr)
+        if err not in CONNECT_IN_PROGRESS:
+            self.socket.close()
+            self.closed = True
+            raise socket.error(err, os.strerror(err))
+        engine.reactor.register(self.socket, self)
+        engine.reactor.wantWrite(self.socket, True)
+
+    def getPayload(self, pkt):
+        """
+        Return the new bytes of the segment, retransmitted bytes are removed
+        """
+        payload = pkt.payload
+        if self.nextSeq is not None:
+            # sequence numbers are compared modulo 2^32
+            late = (self.nextSeq - pkt.seq) & 0xffffffff
+            if late and late < 0x80000000:
+                if late >= len(payload):
+                    return b""
+                payload = payload[late:]
+        self.nextSeq = (pkt.seq + len(pkt.payload)) & 0xffffffff
+        return payload
+
+    def send(self, payload):
+        """
+        Send the payload or buffer it until the socket is writable
+        """
+        if self.closed:
+            return False
+        if self.outBuffer or not self.connected:
+            self.outBuffer += payload
+            return True
+        try:
+            sent = self.socket.send(payload)
+        except socket.error as e:
+            if not Reactor.wouldBlock(e):
+                self.onError(e)
+                return False
+            sent = 0
+        if sent < len(payload):
+            self.outBuffer += payload[sent:]
+            self.engine.reactor.wantWrite(self.socket, True)
+        return True
+
+    def finish(self):
+        """
+        End of the captured stream, the write side is closed once the buffer is sent
+        """
+        self.finished = True
+        if self.connected and not self.outBuffer:
+            self.shutdown()
+
+    def shutdown(self):
+        """
+        Close the write side of the connection
+        """
+        try:
+            self.socket.shutdown(socket.SHUT_WR)
+        except socket.error as e:
+            pass
+
+    def close(self):
+        """
+        Close the connection
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.engine.reactor.unregister(self.socket)
+        self.socket.close()
+
+    def onError(self, e):
+        """
+        On socket error, the connection is closed
+        """
+        self.engine.onSendError(e)
+        self.close()
+
+    def onReactorRead(self):
+        """
+        Read and count the replies
+        """
+        buf, view = self.engine.reactor.getRecvBuffer(RECV_BUFFER_SIZE)
+        while not self.closed:
+            try:
+                nbytes = self.socket.recv_into(buf)
+            except socket.error as e:
+                if not Reactor.wouldBlock(e):
+                    self.onError(e)
+                return
+            if not nbytes:
+                self.close()
+                return
+            self.engine.counters['bytes-received'] += nbytes
+
+    def onReactorWrite(self):
+        """
+        On writable event, end the connection or send the buffered data
+        """
+        if self.closed:
+            return
+        if not self.connected:
+            err = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                self.onError( socket.error(err, os.strerror(err)) )
+                return
+            self.connected = True
+            self.engine.counters['connected'] += 1
+        while self.outBuffer:
+            try:
+                sent = self.socket.send(self.outBuffer)
+            except socket.error as e:
+                if not Reactor.wouldBlock(e):
+                    self.onError(e)
+                return
+            del self.outBuffer[:sent]
+        self.engine.reactor.wantWrite(self.socket, False)
+        if self.finished:
+            self.shutdown()
+
+class ReplayEngine(object):
+    """
+    Replay of a pcap file, driven by its own reactor
+
+    Keys supported:
+        * pcap-file: path of the file on the agent, or pcap-data with the content of the file
+        * mode: udp|tcp|raw
+        * speed: 1 for the original timing, 2, 10..., 0 or max to send as fast as possible
+        * rewrite: { "ip:port" or "ip": "ip:port", "ip" or ":port" }, destinations replaced
+        * dst-ip, dst-port: destination of all packets not rewritten
+        * match-dst: list of ip, ip:port or port, only the packets to these destinations
+          are replayed, by default all datagrams and the client side of the tcp streams
+          with a captured syn
+        * interface: interface of the raw mode, frames are not rewritten
+        * linger: delay before to close the sockets after the last packet, in seconds
+    """
+    def __init__(self, parent, request):
+        """
+        Constructor
+        """
+        self.parent = parent
+        self.request = request
+        self.cfg = request['data']
+        self.reactor = Reactor.Reactor(parent)
+        self.started = False
+        self.finishedEvent = threading.Event()
+        self.finishing = False
+        self.reader = None
+        self.tmpId = None
+        self.rawSocket = None
+        self.udpSources = {}
+        self.tcpStreams = {}
+        self.nextPacket = None
+        self.firstTime = None
+        self.lastTime = None
+        self.startTime = None
+        self.sendDuration = None
+        self.tickTimer = None
+        self.finishTimer = None
+        self.counters = collections.defaultdict(int)
+        self.drift = LoadGenerator.Histogram()
+        self.lastError = None
+
+        self.mode = self.cfg.get('mode', 'udp')
+        speed = self.cfg.get('speed', 1)
+        self.speed = 0.0 if speed in ( 'max', None ) else float(speed)
+        self.linger = float( self.cfg.get('linger', REPLAY_LINGER) )
+        self.rewrite = {}
+        for orig, new in self.cfg.get('rewrite', {}).items():
+            self.rewrite[str(orig).strip()] = parseAddress(new)
+        self.dstIp = self.cfg.get('dst-ip')
+        self.dstPort = self.cfg.get('dst-port')
+        self.matchDst = None
+        if self.cfg.get('match-dst'):
+            self.matchDst = set( [ str(dst).strip() for dst in self.cfg['match-dst'] ] )
+
+    def trace(self, txt):
+        """
+        Trace
+        """
+        self.parent.trace( str(txt) )
+
+    def error(self, err):
+        """
+        Log error
+        """
+        self.parent.error( str(err) )
+
+    def sendError(self, data):
+        """
+        Send error to the server
+        """
+        self.error( "send error: %s"  % str(data) )
+        req =  self.request
+        req['event'] = "agent-error"
+        req['data'] = data
+        self.parent.notify( data=req )
+
+    def sendNotify(self, data):
+        """
+        Send notify to the server
+        """
+        self.trace( "send notify: %s"  % str(data) )
+        req =  self.request
+        req['event'] = "agent-notify"
+        req['data'] = data
+        self.parent.notify( data=req )
+
+    def openFile(self):
+        """
+        Open the pcap file, the content provided with the request
+        is first written in the temp area of the agent
+        """
+        filename = self.cfg.get('pcap-file')
+        if self.cfg.get('pcap-data') is not None:
+            self.tmpId = self.parent.getCallId()
+            self.parent.addCallIdTmpDir("%s" % self.tmpId)
+            filename = "%s/%s/replay.pcap" % (self.parent.getTemp(), self.tmpId)
+            with open(filename, "wb") as fd:
+                fd.write( self.cfg['pcap-data'] )
+        if not filename:
+            raise Pcap.PcapError("pcap-file or pcap-data missing")
+        self.reader = Pcap.PcapReader(filename)
+        if self.mode == 'raw' and self.reader.linktype != Pcap.LINKTYPE_ETHERNET:
+            raise Pcap.PcapError("linktype %s not supported in raw mode" % self.reader.linktype)
+
+    def start(self):
+        """
+        Start the replay
+        """
+        if self.mode not in ( 'udp', 'tcp', 'raw' ):
+            self.sendError( data={ 'replay-event': 'mode-unknown', 'more': str(self.mode) } )
+            self.finishedEvent.set()
+            return
+        try:
+            self.openFile()
+            if self.mode == 'raw':
+                self.rawSocket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+                self.rawSocket.bind( (self.cfg['interface'], 0) )
+        except Exception as e:
+            self.sendError( data={ 'replay-event': 'file-error', 'more': str(e) } )
+            self.cleanup()
+            self.finishedEvent.set()
+            return
+        Reactor.raiseFdLimit()
+        self.started = True
+        self.reactor.start()
+        self.reactor.callSoon(self.onStart)
+
+    def stop(self):
+        """
+        Stop the replay before the end, the result is sent
+        """
+        if self.started and not self.finishedEvent.isSet():
+            self.reactor.callSoon(self.finish)
+
+    def join(self, timeout=None):
+        """
+        Wait the end of the replay
+        """
+        self.finishedEvent.wait(timeout)
+
+    def onReset(self):
+        """
+        On reset
+        """
+        self.stop()
+
+    def onNotify(self, client, tid, request):
+        """
+        Nothing to send to a replay
+        """
+        self.trace( "replay running, notify ignored" )
+
+    def readPacket(self):
+        """
+        Return the next packet to replay, or None at the end of the file
+        """
+        for timestamp, frame in self.reader:
+            self.counters['packets'] += 1
+            if self.firstTime is None:
+                self.firstTime = timestamp
+            self.lastTime = max(self.lastTime or timestamp, timestamp)
+            if self.mode == 'raw':
+                return Pcap.Packet(timestamp, frame)
+            pkt = Pcap.decodeFrame(timestamp, frame, self.reader.linktype)
+            if pkt is None or pkt.payload is None:
+                self.counters['skipped'] += 1
+                continue
+            if self.mode == 'udp' and pkt.proto != Pcap.IPPROTO_UDP:
+                self.counters['skipped'] += 1
+                continue
+            if self.mode == 'tcp' and pkt.proto != Pcap.IPPROTO_TCP:
+                self.counters['skipped'] += 1
+                continue
+            if self.matchDst is not None and not self.isMatching(pkt):
+                self.counters['skipped'] += 1
+                continue
+            return pkt
+        return None
+
+    def isMatching(self, pkt):
+        """
+        Return True if the destination of the packet is in match-dst
+        """
+        for key in ( formatAddress(pkt.dst, pkt.dport), pkt.dst, str(pkt.dport) ):
+            if key in self.matchDst:
+                return True
+        return False
+
+    def getDestination(self, pkt):
+        """
+        Return the destination of the packet after rewriting
+        """
+        new = self.rewrite.get( formatAddress(pkt.dst, pkt.dport) )
+        if new is None:
+            new = self.rewrite.get( pkt.dst, (None, None) )
+        ip, port = new
+        if ip is None:
+            ip = self.dstIp or pkt.dst
+        if port is None:
+            port = self.dstPort or pkt.dport
+        return ( ip, int(port) )
+
+    def getFamily(self, ip):
+        """
+        Return the address family of the ip
+        """
+        if ":" in ip:
+            return socket.AF_INET6
+        return socket.AF_INET
+
+    def onStart(self):
+        """
+        Called in the reactor, start to send the packets
+        """
+        self.startTime = time.time()
+        self.sendNotify( data={ 'replay-event': 'started', 'mode': self.mode,
+                                'speed': self.speed or 'max', 'linktype': self.reader.linktype } )
+        self.nextPacket = self.readPacket()
+        self.onTick()
+
+    def onTick(self):
+        """
+        Send the packets scheduled until now, then wait the next one
+        """
+        self.tickTimer = None
+        count = 0
+        while self.nextPacket is not None and not self.finishing:
+            now = time.time()
+            pkt = self.nextPacket
+            if self.speed:
+                scheduled = self.startTime + (pkt.timestamp - self.firstTime) / self.speed
+                if scheduled > now:
+                    self.tickTimer = self.reactor.callLater(scheduled - now, self.onTick)
+                    return
+            if count >= REPLAY_BATCH:
+                # let the reactor serve the sockets and the stop
+                self.reactor.callSoon(self.onTick)
+                return
+            if self.speed:
+                self.drift.add(now - scheduled)
+            count += 1
+            self.replayPacket(pkt)
+            self.nextPacket = self.readPacket()
+        if not self.finishing:
+            self.sendDuration = time.time() - self.startTime
+            self.finishTimer = self.reactor.callLater(self.linger, self.finish)
+
+    def replayPacket(self, pkt):
+        """
+        Send one packet according to the mode
+        """
+        if self.mode == 'raw':
+            try:
+                self.rawSocket.send(pkt.frame)
+            except socket.error as e:
+                self.onSendError(e)
+                return
+            self.onSent(len(pkt.frame))
+        elif self.mode == 'udp':
+            addr = self.getDestination(pkt)
+            family = self.getFamily(addr[0])
+            key = (pkt.src, pkt.sport, family)
+            source = self.udpSources.get(key)
+            if source is None:
+                source = UdpSource(self, family)
+                self.udpSources[key] = source
+            if source.send(pkt.payload, addr):
+                self.onSent(len(pkt.payload))
+        else:
+            self.replaySegment(pkt)
+
+    def replaySegment(self, pkt):
+        """
+        Send the payload of the segment on the connection of its stream
+        """
+        key = (pkt.src, pkt.sport, pkt.dst, pkt.dport)
+        stream = self.tcpStreams.get(key)
+        if stream is None:
+            isSyn = pkt.flags & Pcap.TCP_SYN and not pkt.flags & Pcap.TCP_ACK
+            if not isSyn and (self.matchDst is None or not pkt.payload):
+                # server side or stream captured without its syn
+                self.counters['skipped'] += 1
+                return
+            addr = self.getDestination(pkt)
+            try:
+                stream = TcpStream(self, addr, self.getFamily(addr[0]))
+            except socket.error as e:
+                self.onSendError(e)
+                return
+            self.tcpStreams[key] = stream
+            if isSyn:
+                stream.nextSeq = (pkt.seq + 1) & 0xffffffff
+        if pkt.flags & Pcap.TCP_RST:
+            stream.close()
+            return
+        payload = stream.getPayload(pkt)
+        if pkt.payload and not payload:
+            self.counters['retransmissions'] += 1
+        elif payload and stream.send(payload):
+            self.onSent(len(payload))
+        if pkt.flags & Pcap.TCP_FIN:
+            stream.finish()
+
+    def onSent(self, size):
+        """
+        On packet sent
+        """
+        self.counters['sent'] += 1
+        self.counters['bytes-sent'] += size
+
+    def onSendError(self, e):
+        """
+        On send error
+        """
+        self.counters['errors'] += 1
+        self.lastError = str(e)
+
+    def cleanup(self):
+        """
+        Close the file and all sockets
+        """
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        if self.rawSocket is not None:
+            self.rawSocket.close()
+            self.rawSocket = None
+        for source in self.udpSources.values():
+            source.close()
+        self.udpSources = {}
+        for stream in self.tcpStreams.values():
+            stream.close()
+
+    def finish(self):
+        """
+        Called in the reactor, close all sockets and send the result
+        """
+        if self.finishing:
+            return
+        self.finishing = True
+        try:
+            if self.finishTimer is not None:
+                self.finishTimer.cancel()
+            if self.tickTimer is not None:
+                self.tickTimer.cancel()
+            duration = self.sendDuration
+            if duration is None:
+                duration = time.time() - self.startTime
+            interrupted = self.nextPacket is not None
+            self.cleanup()
+            self.sendNotify( data=self.getResult(duration, interrupted) )
+        except Exception as e:
+            self.sendError( data={ 'replay-event': 'result-error', 'more': str(e) } )
+        finally:
+            self.reactor.stop()
+            self.finishedEvent.set()
+
+    def getResult(self, duration, interrupted):
+        """
+        Return the summary of the replay
+        """
+        c = self.counters
+        duration = max(duration, 0.000001)
+        captureDuration = 0.0
+        if self.firstTime is not None:
+            captureDuration = self.lastTime - self.firstTime
+        drift = self.drift.summary()
+        drift.pop('buckets', None)
+        return { 'replay-event': 'result', 'mode': self.mode, 'speed': self.speed or 'max',
+                 'interrupted': interrupted, 'packets': c['packets'], 'sent': c['sent'],
+                 'bytes-sent': c['bytes-sent'], 'bytes-received': c['bytes-received'],
+                 'skipped': c['skipped'], 'retransmissions': c['retransmissions'],
+                 'connections': len(self.tcpStreams), 'connected': c['connected'],
+                 'errors': c['errors'], 'last-error': self.lastError,
+                 'duration': duration, 'capture-duration': captureDuration,
+                 'send-rate': c['sent'] / duration,
+                 'throughput-sent': c['bytes-sent'] / duration,
+                 'drift': drift }
@@ -29,16 +29,40 @@ import Core.GenericTool as GenericTool
 import Libs.Settings as Settings
 # import Libs.FifoQueue as FifoQueue
 
+try:
+    import Reactor
+except ImportError: # python3 support
+    from . import Reactor
+try:
+    import Framer
+except ImportError: # python3 support
+    from . import Framer
+try:
+    import Bpf
+except ImportError: # python3 support
+    from . import Bpf
+try:
+    import Pcap
+except ImportError: # python3 support
+    from . import Pcap
+try:
+    import LoadGenerator
+except ImportError: # python3 support
+    from . import LoadGenerator
+try:
+    import Replay
+except ImportError: # python3 support
+    from . import Replay
+
 import os
+import stat
 import socket
 import select
 import time
 import threading
-try:
-    import Queue
-except ImportError: # support python 3
-    import queue as Queue
 import sys
+import collections
+import bisect
 
 
 try:
@@ -86,24 +110,69 @@ Types of sockets supported : tcp, udp and raw (linux only).
 Events messages:
     Agent->Server
         * Error( ... )
-        * Notify( socket-raw-event=initialized|listen-error|sniffing-failed|sniffing|stopped|socket-error|on-run )
-        * Notify( udp-event=socket-family-unknown|connect-error|listening-failed|listening|initialized|stopped|on-run|socket-error )
+        * Notify( socket-raw-event=initialized|listen-error|sniffing-failed|sniffing|stopped|socket-error|on-run|
+                  filter-attached|capture-started|capture-uploaded|capture-failed|stats )
+        * Notify( udp-event=socket-family-unknown|connect-error|listening-failed|listening|initialized|stopped|on-run|socket-error|
+                  new-peer|peer-expired|client-data|sending-error|stats )
         * Notify( ssl-event=version-unknown|check-certificate-unknown|init-failed|handshake|handshake-accepted|handshake-failed
+        * Notify( load-event=started|result|sock-type-unknown|result-error )
+        * Notify( replay-event=started|result|mode-unknown|file-error|result-error )
         * Notify( tcp-event=socket-family-unknown|connect-error|initialized|connected|connection-refused|connection-failed|
-                  connection-timeout|disconnected-by-peer|socket-error|no-more-data|sending-error|on-run|closed )
+                  connection-timeout|disconnected-by-peer|socket-error|no-more-data|sending-error|on-run|closed|
+                  send-buffer-full|send-buffer-drained|stats )
         * Data( sock-data )
 
     Server->Agent
         * Init( sock-type=tcp|udp|raw )
+        * Load( sock-type=tcp|udp, flows, rate, duration, payload, wait-reply ): concurrent flows
+          opened from one event loop, one aggregated result is notified at the end
+          (see LoadGenerator.LoadGenerator for parameters)
+        * Replay( mode=udp|tcp|raw, pcap-file|pcap-data, speed, rewrite ): packets of a pcap file
+          sent from one event loop with their original timing, one summary is notified at the end
+          (see Replay.ReplayEngine for parameters)
+        * Stats( interval ): counters of the socket notified with the event stats
+          (bytes, packets, recv and send calls, queue high water, receive to notify latency),
+          pushed every interval seconds if set, 0 to stop
         * Notify( ... )
         * Reset( ... )
 
+Options:
+    * sock-family=4|6|unix: unix domain sockets use bind-path and dst-path instead
+      of the ip and port, a path starting with @ is in the abstract namespace (linux),
+      the path is reported as ip (the port is the client id on a tcp server)
+    * reactor=True: the socket is driven by the event loop shared by all sockets
+      of the agent instead of its own thread
+    * listen-backlog: size of the accept queue of the tcp server
+    * server-workers: number of event loops serving the clients of a tcp server in reactor mode
+    * sock-rcvbuf: size of the kernel receive buffer of the udp server
+    * max-peers, peer-idle-timeout: size of the table of the peers of the udp sockets
+      (server, or framing by source address) and seconds before an idle peer is removed
+    * notify-peers=True: the udp server notifies new-peer and peer-expired
+    * ssl-cert, ssl-key, ssl-ciphers: client certificate and ciphers of the ssl context,
+      contexts are shared by the tcp sockets with the same parameters
+    * ssl-session-reuse=True: tls sessions are saved by destination and resumed
+      on the next connection, handshake-accepted reports resumed and duration (seconds)
+    * send-high-water, send-low-water: size in bytes of data queued on a tcp socket
+      when send-buffer-full then send-buffer-drained are notified, to pace the sender
+    * framing=separator|fixed|length-prefix|regex: received bytes are split in pdus
+      before to be sent to the server (see Framer.createFramer for parameters),
+      the tcp server also uses the separator when sep-disabled is False
+    * coalesce=True: received data are sent to the server by batch in one
+      Data( coalesced=[ {time, data} ] ), flushed on coalesce-max-count,
+      coalesce-max-bytes or coalesce-max-delay (milliseconds)
+    * bpf-filter: tcpdump expression attached to the raw socket, or bpf-program
+      with a pre-compiled filter (output of tcpdump -ddd or list of [code, jt, jf, k])
+    * capture-file=True: frames of the raw socket are written in a ring of pcap files
+      (capture-ring-files, capture-ring-size) uploaded on stop instead of being sent
+    * stats-interval: the counters of the socket are pushed every stats-interval seconds
+
 Targetted operating system: Windows and linux"""
 
 MAX_INACTIVITY = 3600
 
 IPv4    = 4
 IPv6    = 6
+UNIX    = 'unix'
 
 COOKED_PACKET_SOCKET    = 0     # AF_PACKET,SOCK_DGRAM, Ethernet protocol, cooked Linux packet socket
 RAW_PACKET_SOCKET       = 1     # AF_PACKET, SOCK_RAW, Ethernet protocol, raw Linux packet socket
@@ -122,6 +191,35 @@ INIT_TCP_SOCKET         = 11    # AF_INET, SOCK_RAW, 0x06
 
 SOCKET_BUFFER = 65535
 
+# size of the receive buffer of stream sockets
+RECV_BUFFER_SIZE = 256*1024
+
+# max number of clients accepted on one readable event of a tcp server
+ACCEPT_BATCH = 64
+
+# default size of the ring of pcap files of a raw socket
+CAPTURE_RING_FILES = 10
+CAPTURE_RING_SIZE = 10*1024*1024 # in bytes
+
+# default water marks of the send queue of tcp sockets, in bytes
+SEND_HIGH_WATER = 4*1024*1024
+SEND_LOW_WATER = 1024*1024
+# max number of buffers written in one call
+SEND_IOV_MAX = 1024
+
+# default limits of a batch of received data
+COALESCE_MAX_COUNT = 100
+COALESCE_MAX_BYTES = 65536
+COALESCE_MAX_DELAY = 10 # in milliseconds
+
+# peers of the udp sockets, evicted when idle or when the table is full
+UDP_MAX_PEERS = 10000
+UDP_PEER_IDLE = 300 # in seconds
+PEER_SWEEP_INTERVAL = 1.0 # in seconds
+
+# upper bounds of the buckets of the receive to notify latency, in seconds
+STATS_LATENCY_BUCKETS = ( 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0 )
+
 def getSocket(sockType):
     """
     Get socket 
@@ -137,9 +235,9 @@ def getSocket(sockType):
     elif sockType == RAW_PACKET_SOCKET: # raw Linux packet socket
         sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.SOCK_RAW)
     elif sockType == UNIX_DGRAM_SOCKET: # Unix-domain datagram socket
-        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM, socket.SOCK_RAW)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM, 0)
     elif sockType == UNIX_STREAM_SOCKET: # Unix-domain stream socket
-        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM, socket.SOCK_RAW)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM, 0)
     elif sockType == INET6_RAW_SOCKET: # IPv6 raw socket
         sock = socket.socket(socket.AF_INET6, socket.SOCK_RAW, socket.IPPROTO_IP)
     elif sockType == INIT6_DGRAM_SOCKET: # UDP over IPv6
@@ -160,6 +258,48 @@ def getSocket(sockType):
         sock = None
     return sock
 
+def getUnixAddress(path):
+    """
+    Return the address of a unix socket from its path,
+    a path starting with @ is in the abstract namespace (linux only)
+    """
+    if path.startswith("@"):
+        return "\0" + path[1:]
+    return path
+
+def formatUnixAddress(addr):
+    """
+    Return the path of a unix socket address, @ for the abstract namespace,
+    empty for an unbound socket
+    """
+    if not addr:
+        return ""
+    if not isinstance(addr, str):
+        addr = addr.decode("utf8", "replace")
+    if addr.startswith("\0"):
+        return "@" + addr[1:]
+    return addr
+
+def removeUnixPath(address):
+    """
+    Remove the file of a unix socket, left by a previous run
+    """
+    if not address or address.startswith("\0"):
+        return
+    try:
+        if stat.S_ISSOCK( os.stat(address).st_mode ):
+            os.remove(address)
+    except OSError as e:
+        pass
+
+def getSourceAddress(sock, family):
+    """
+    Return the local address of the socket as (ip, port),
+    (path, 0) for a unix socket
+    """
+    if family == UNIX:
+        return ( formatUnixAddress(sock.getsockname()), 0 )
+    return sock.getsockname()[:2]
 
 #CERT_NONE - no certificates from the other side are required (or will
 #be looked at if provided)
@@ -191,11 +331,753 @@ class HandshakeFailed(Exception):
     Handshake failed exception
     """
     pass
+
+class Coalescer(object):
+    """
+    Batch of received data sent to the server in one notification
+    """
+    def __init__(self, callback, maxCount=COALESCE_MAX_COUNT, 
+                 maxBytes=COALESCE_MAX_BYTES, maxDelay=COALESCE_MAX_DELAY):
+        """
+        Constructor
+
+        @param callback: function called with the list of entries to send
+        @param maxDelay: max delay in milliseconds
+        """
+        self.callback = callback
+        self.maxCount = int(maxCount)
+        self.maxBytes = int(maxBytes)
+        self.maxDelay = float(maxDelay) / 1000
+        self.entries = []
+        self.size = 0
+        self.firstTime = 0
+
+    def add(self, data, size):
+        """
+        Add data to the batch, flushed if a limit is reached
+        """
+        now = time.time()
+        if not self.entries:
+            self.firstTime = now
+        # the timestamp of each chunk is kept
+        self.entries.append( {'time': now, 'data': data} )
+        self.size += size
+        if len(self.entries) >= self.maxCount or self.size >= self.maxBytes:
+            self.flush()
+
+    def getDelay(self):
+        """
+        Return the remaining delay before the flush of the current batch,
+        None if the batch is empty
+        """
+        if not self.entries:
+            return None
+        return max(0, self.firstTime + self.maxDelay - time.time())
+
+    def flushIfDue(self):
+        """
+        Flush the batch if the max delay is reached
+        """
+        if self.entries and time.time() - self.firstTime >= self.maxDelay:
+            self.flush()
+
+    def flush(self):
+        """
+        Send the batch
+        """
+        if self.entries:
+            entries = self.entries
+            self.entries = []
+            self.size = 0
+            self.callback(entries)
+
+class PeerTable(object):
+    """
+    Peers of an udp socket by address, kept in the order of their last datagram:
+    the peers idle since idleTimeout seconds are removed by expire() and the
+    least recently seen one is removed when maxPeers is reached
+    """
+    def __init__(self, maxPeers=UDP_MAX_PEERS, idleTimeout=UDP_PEER_IDLE):
+        """
+        Constructor
+        """
+        self.maxPeers = int(maxPeers)
+        self.idleTimeout = float(idleTimeout)
+        self.peers = collections.OrderedDict()
+
+    def __len__(self):
+        """
+        Return the number of peers
+        """
+        return len(self.peers)
+
+    def get(self, address):
+        """
+        Return the peer by address, None if unknown
+        """
+        return self.peers.get(address)
+
+    def touch(self, address, now):
+        """
+        Return the peer seen now, moved at the end of the table, None if unknown
+        """
+        peer = self.peers.pop(address, None)
+        if peer is not None:
+            peer['last-seen'] = now
+            self.peers[address] = peer
+        return peer
+
+    def add(self, address, peer, now):
+        """
+        Add the peer seen now, return the list of (address, peer) removed
+        to respect the max number of peers
+        """
+        removed = []
+        while self.peers and len(self.peers) >= self.maxPeers:
+            removed.append( self.peers.popitem(last=False) )
+        peer['last-seen'] = now
+        self.peers[address] = peer
+        return removed
+
+    def expire(self, now):
+        """
+        Remove the idle peers, return the list of (address, peer) removed
+        """
+        removed = []
+        for address, peer in self.peers.items():
+            if now - peer['last-seen'] < self.idleTimeout:
+                break
+            removed.append( (address, peer) )
+        for address, peer in removed:
+            del self.peers[address]
+        return removed
+
+class SocketStats(object):
+    """
+    Counters of one socket, updated without lock by the thread serving the socket.
+    The queued counters are updated under the mutex of the send queue.
+    """
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.startTime = time.time()
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.packetsIn = 0
+        self.packetsOut = 0
+        self.recvCalls = 0
+        self.sendCalls = 0
+        self.queueHighWater = 0
+        self.recvTime = 0
+        # receive to notify latency, the last bucket is above the last bound
+        self.latency = [ 0 ] * ( len(STATS_LATENCY_BUCKETS) + 1 )
+        self.latencyCount = 0
+        self.latencyTotal = 0.0
+        self.latencyMax = 0.0
+
+    def onRecv(self, nbytes):
+        """
+        On recv call
+        """
+        self.recvCalls += 1
+        self.bytesIn += nbytes
+        self.recvTime = time.time()
+
+    def onPacketIn(self):
+        """
+        On pdu, datagram or frame received
+        """
+        self.packetsIn += 1
+
+    def onNotified(self, recvTime):
+        """
+        On data sent to the server, received at recvTime
+        """
+        latency = max(0.0, time.time() - recvTime)
+        self.latency[ bisect.bisect_left(STATS_LATENCY_BUCKETS, latency) ] += 1
+        self.latencyCount += 1
+        self.latencyTotal += latency
+        if latency > self.latencyMax:
+            self.latencyMax = latency
+
+    def onSend(self, nbytes, packets=0):
+        """
+        On send call
+        """
+        self.sendCalls += 1
+        self.bytesOut += nbytes
+        self.packetsOut += packets
+
+    def onQueued(self, queued):
+        """
+        On message added to the send queue
+        """
+        self.packetsOut += 1
+        if queued > self.queueHighWater:
+            self.queueHighWater = queued
+
+    def add(self, other):
+        """
+        Add the counters of another socket
+        """
+        self.bytesIn += other.bytesIn
+        self.bytesOut += other.bytesOut
+        self.packetsIn += other.packetsIn
+        self.packetsOut += other.packetsOut
+        self.recvCalls += other.recvCalls
+        self.sendCalls += other.sendCalls
+        self.queueHighWater = max(self.queueHighWater, other.queueHighWater)
+        for i in xrange(len(self.latency)):
+            self.latency[i] += other.latency[i]
+        self.latencyCount += other.latencyCount
+        self.latencyTotal += other.latencyTotal
+        self.latencyMax = max(self.latencyMax, other.latencyMax)
+
+    def toDict(self):
+        """
+        Return the counters, latencies in milliseconds
+        """
+        bounds = [ bound * 1000 for bound in STATS_LATENCY_BUCKETS ] + [ None ]
+        latency = { 'count': self.latencyCount, 'max': self.latencyMax * 1000,
+                    'mean': self.latencyTotal / self.latencyCount * 1000 if self.latencyCount else None,
+                    'buckets': [ [ bounds[i], self.latency[i] ] for i in xrange(len(bounds)) ] }
+        return { 'duration': time.time() - self.startTime,
+                 'bytes-in': self.bytesIn, 'bytes-out': self.bytesOut,
+                 'packets-in': self.packetsIn, 'packets-out': self.packetsOut,
+                 'recv-calls': self.recvCalls, 'send-calls': self.sendCalls,
+                 'queue-high-water': self.queueHighWater, 'notify-latency': latency }
+
+class SendQueue(object):
+    """
+    Queue of buffers to send on a stream socket, all queued buffers are written
+    in one sendmsg call (writev), partial writes are tracked.
+    The full callback is called when the queued size reaches the high water mark,
+    then the drained callback when it goes down to the low water mark.
+    """
+    def __init__(self, onFull, onDrained, highWater=SEND_HIGH_WATER, lowWater=SEND_LOW_WATER,
+                       stats=None):
+        """
+        Constructor
+        """
+        self.stats = stats
+        self.onFull = onFull
+        self.onDrained = onDrained
+        self.highWater = highWater
+        self.lowWater = min(lowWater, highWater)
+        self.buffers = collections.deque()
+        self.size = 0
+        self.full = False
+        self.mutex = threading.Lock()
+
+    def put(self, data):
+        """
+        Add bytes to send, thread safe
+        Return True if the queue was empty, the writer must be woken up
+        """
+        if not data:
+            return False
+        self.mutex.acquire()
+        wasEmpty = not self.buffers
+        self.buffers.append(data)
+        self.size += len(data)
+        if self.stats is not None:
+            self.stats.onQueued(self.size)
+        full = not self.full and self.size >= self.highWater
+        if full:
+            self.full = True
+        size = self.size
+        self.mutex.release()
+        if full:
+            self.onFull(size)
+        return wasEmpty
+
+    def empty(self):
+        """
+        Return True if nothing to send
+        """
+        return not self.buffers
+
+    def clear(self):
+        """
+        Drop all queued buffers
+        """
+        self.mutex.acquire()
+        self.buffers.clear()
+        self.mutex.release()
+        self.consume(0)
+
+    def send(self, sock):
+        """
+        Write queued buffers, in one call, and return the number of bytes sent
+        Socket errors are raised to the caller, queued data are kept.
+        """
+        self.mutex.acquire()
+        if len(self.buffers) > SEND_IOV_MAX:
+            buffers = [ self.buffers[i] for i in xrange(SEND_IOV_MAX) ]
+        else:
+            buffers = list(self.buffers)
+        self.mutex.release()
+        if not buffers:
+            return 0
+        if len(buffers) == 1 or isinstance(sock, ssl.SSLSocket) or not hasattr(sock, "sendmsg"):
+            # no gather write with ssl, and the same buffer must be retried when blocked
+            sent = sock.send(buffers[0])
+        else:
+            sent = sock.sendmsg(buffers)
+        if self.stats is not None:
+            self.stats.onSend(sent)
+        self.consume(sent)
+        return sent
+
+    def consume(self, sent):
+        """
+        Remove bytes sent from the queue
+        """
+        self.mutex.acquire()
+        remaining = sent
+        while remaining and self.buffers:
+            head = self.buffers[0]
+            if len(head) <= remaining:
+                self.buffers.popleft()
+                remaining -= len(head)
+            else:
+                self.buffers[0] = memoryview(head)[remaining:]
+                remaining = 0
+        if self.buffers:
+            self.size -= sent
+        else:
+            self.size = 0
+        drained = self.full and self.size <= self.lowWater
+        if drained:
+            self.full = False
+        size = self.size
+        self.mutex.release()
+        if drained:
+            self.onDrained(size)
+
+class ReactorContext(object):
+    """
+    Socket context driven by the shared reactor of the agent (reactor mode)
+    instead of its own thread. Without reactor, the thread is used as before.
+    """
+    def initReactor(self, reactor):
+        """
+        Initialize the reactor mode, reactor is None for the thread mode
+        """
+        self.reactor = reactor
+        self.reactorStarted = False
+        self.reactorClosing = False
+        self.closedEvent = threading.Event()
+        self.timerWheel = None
+        self.writeWanted = False
+        # deadlines checked by the loop of the thread in thread mode
+        self.inactivityTimeout = None
+        self.nextStats = 0
+
+    def start(self):
+        """
+        Start the thread or register the socket in the reactor
+        """
+        if self.statsInterval:
+            self.startStatsTimer(self.statsInterval)
+        if self.reactor is None:
+            threading.Thread.start(self)
+        else:
+            self.reactorStarted = True
+            self.reactor.callSoon(self.onReactorStart)
+
+    def join(self, timeout=None):
+        """
+        Wait the end of the thread or the socket closure in the reactor
+        """
+        if self.reactor is None:
+            threading.Thread.join(self, timeout)
+        elif self.reactorStarted and not self.reactor.isReactorThread():
+            self.closedEvent.wait(timeout)
+
+    def bindUnixSocket(self, path):
+        """
+        Bind the unix socket on the path, the file of a previous run is removed
+        """
+        self.unixAddress = getUnixAddress(path)
+        removeUnixPath(self.unixAddress)
+        self.trace( 'bind socket on %s' % path )
+        self.socket.bind( self.unixAddress )
+
+    def cleanUnixSocket(self):
+        """
+        Remove the file of the bound unix socket
+        """
+        if getattr(self, "unixAddress", None):
+            removeUnixPath(self.unixAddress)
+            self.unixAddress = None
+
+    def initRecvBuffer(self, size):
+        """
+        Initialize the receive buffer, allocated on the first read.
+        In reactor mode, the buffer of the reactor is shared by all its sockets.
+        """
+        self.recvSize = size
+        self.recvBuffer = None
+        self.recvView = None
+
+    def getRecvBuffer(self):
+        """
+        Return the receive buffer and its memoryview
+        """
+        if self.reactor is not None:
+            return self.reactor.getRecvBuffer(self.recvSize)
+        if self.recvBuffer is None:
+            self.recvBuffer = bytearray(self.recvSize)
+            self.recvView = memoryview(self.recvBuffer)
+        return (self.recvBuffer, self.recvView)
+
+    def recvData(self):
+        """
+        Read from the socket in the receive buffer, without allocation.
+        The view returned is only valid until the next read,
+        the data must be copied to be kept.
+        """
+        buf, view = self.getRecvBuffer()
+        nbytes = self.socket.recv_into(buf)
+        self.stats.onRecv(nbytes)
+        return view[:nbytes]
+
+    def recvDatagram(self):
+        """
+        Read one datagram in the receive buffer, return the view and the source address
+        The view returned is only valid until the next read.
+        """
+        buf, view = self.getRecvBuffer()
+        nbytes, addr = self.socket.recvfrom_into(buf)
+        self.stats.onRecv(nbytes)
+        return (view[:nbytes], addr)
+
+    def initSendQueue(self, cfg):
+        """
+        Initialize the send queue with the water marks of the configuration
+        """
+        self.sendQueue = SendQueue( onFull=self.onSendBufferFull, onDrained=self.onSendBufferDrained,
+                                    highWater=cfg.get('send-high-water', SEND_HIGH_WATER),
+                                    lowWater=cfg.get('send-low-water', SEND_LOW_WATER),
+                                    stats=self.stats )
+
+    def sendQueued(self):
+        """
+        Send queued data until the queue is empty or the socket would block,
+        the write event is enabled in the reactor when blocked
+        """
+        while not self.sendQueue.empty():
+            try:
+                self.sendQueue.send(self.socket)
+            except socket.error as e:
+                if Reactor.wouldBlock(e):
+                    self.setWantWrite(True)
+                    return
+                self.sendQueue.clear()
+                raise
+        self.setWantWrite(False)
+
+    def onSendBufferFull(self, size):
+        """
+        On high water mark reached in the send queue, to reimplement
+        """
+        pass
+
+    def onSendBufferDrained(self, size):
+        """
+        On low water mark reached in the send queue, to reimplement
+        """
+        pass
+
+    def stopReactor(self):
+        """
+        Schedule the socket closure in the reactor
+        """
+        if self.reactor is not None and not self.reactorClosing:
+            self.reactorClosing = True
+            self.reactor.callSoon(self.onReactorStop)
+
+    def onReactorStart(self):
+        """
+        Called in the reactor thread, register the socket
+        """
+        if self.stopEvent.isSet() or self.socket is None:
+            return
+        self.socket.setblocking(0)
+        self.reactor.register(self.socket, self)
+        self.startInactivityTimer()
+        # data can be already buffered (ssl), read it now
+        self.onReactorRead()
+
+    def onReactorStop(self):
+        """
+        Called in the reactor thread, unregister and clean the socket
+        """
+        if self.closedEvent.isSet():
+            return
+        self.stopInactivityTimer()
+        if self.socket is not None:
+            self.reactor.unregister(self.socket)
+        try:
+            self.cleanSocket()
+        finally:
+            self.closedEvent.set()
+
+    def setWantWrite(self, enabled):
+        """
+        Enable or disable the write event in the reactor
+        """
+        if enabled != self.writeWanted:
+            self.writeWanted = enabled
+            self.reactor.wantWrite(self.socket, enabled)
+
+    def getInactivityTimeout(self):
+        """
+        Return the inactivity timeout in seconds, None to disable it
+        """
+        return None
+
+    def getTimerWheel(self):
+        """
+        Return the timer wheel of the inactivity deadline, reactor mode only
+        """
+        return self.parent.getTimerWheel()
+
+    def startInactivityTimer(self):
+        """
+        Add the inactivity deadline in the timer wheel, the activity only updates
+        lastActivity, the deadline is checked when the wheel expires it.
+        In thread mode, the deadline is checked by the loop of the thread.
+        """
+        timeout = self.getInactivityTimeout()
+        if not timeout:
+            return
+        if self.reactor is None:
+            self.inactivityTimeout = timeout
+            return
+        self.timerWheel = self.getTimerWheel()
+        self.timerWheel.add(self, timeout, self.onInactivityDeadline)
+
+    def stopInactivityTimer(self):
+        """
+        Remove the inactivity deadline
+        """
+        self.inactivityTimeout = None
+        if self.timerWheel is not None:
+            self.timerWheel.remove(self)
+            self.timerWheel = None
+
+    def checkTimers(self):
+        """
+        Check the inactivity deadline and push the counters if it is time,
+        called on each turn of the loop in thread mode
+        """
+        if not self.inactivityTimeout and not self.statsInterval:
+            return
+        now = time.time()
+        if self.inactivityTimeout and now - self.lastActivity > self.inactivityTimeout:
+            self.inactivityTimeout = None
+            self.onInactivityTimeout()
+        if self.statsInterval and now >= self.nextStats:
+            self.nextStats = now + self.statsInterval
+            self.sendStats()
+
+    def onInactivityDeadline(self, now):
+        """
+        Called by the timer wheel when the inactivity deadline expires
+        """
+        if self.timerWheel is None:
+            return
+        timeout = self.getInactivityTimeout()
+        elapsed = now - self.lastActivity
+        if elapsed < timeout:
+            self.timerWheel.add(self, timeout - elapsed, self.onInactivityDeadline)
+        elif self.reactor is not None and not self.reactor.isReactorThread():
+            # the socket is served by another reactor
+            self.reactor.callSoon(self.onInactivityTimeout)
+        else:
+            self.onInactivityTimeout()
+
+    def onInactivityTimeout(self):
+        """
+        On inactivity timeout
+        """
+        self.trace( "nothing happens since a long time ago, force to stop me" )
+        self.stop()
+
+    def initStats(self, cfg=None):
+        """
+        Initialize the counters, pushed periodically if stats-interval
+        is set in the configuration (seconds)
+        """
+        self.stats = SocketStats()
+        self.statsInterval = float( cfg.get('stats-interval', 0) ) if cfg is not None else 0
+
+    def getStats(self):
+        """
+        Return the counters of the socket
+        """
+        stats = self.stats.toDict()
+        if getattr(self, "sendQueue", None) is not None:
+            stats['queued'] = self.sendQueue.size
+        return stats
+
+    def sendStats(self):
+        """
+        Send the counters to the server
+        """
+        self.sendNotify(data={ self.STATS_EVENT: 'stats', 'stats': self.getStats() } )
+
+    def onStats(self, request):
+        """
+        On stats command, send the counters,
+        the periodic push is started with interval in seconds, stopped with 0
+        """
+        if request['data'].get('interval') is not None:
+            self.startStatsTimer( float(request['data']['interval']) )
+        self.sendStats()
+
+    def startStatsTimer(self, interval):
+        """
+        Push the counters every interval seconds, from the timer wheel
+        in reactor mode, from the loop of the thread otherwise
+        """
+        self.statsInterval = interval
+        if self.reactor is None:
+            self.nextStats = time.time() + interval
+            return
+        wheel = self.getTimerWheel()
+        if interval:
+            wheel.add( (self, 'stats'), interval, self.onStatsTimer )
+        else:
+            wheel.remove( (self, 'stats') )
+
+    def onStatsTimer(self, now):
+        """
+        Called by the timer wheel, push the counters until the socket is stopped
+        """
+        if not self.statsInterval or self.stopEvent.isSet():
+            return
+        self.getTimerWheel().add( (self, 'stats'), self.statsInterval, self.onStatsTimer )
+        self.sendStats()
+
+    def initCoalescer(self):
+        """
+        Initialize the batch of received data if enabled in the configuration
+        """
+        self.coalescer = None
+        self.coalesceTimer = None
+        if self.cfg.get('coalesce', False):
+            self.coalescer = Coalescer( callback=self.onCoalescedData,
+                                        maxCount=self.cfg.get('coalesce-max-count', COALESCE_MAX_COUNT),
+                                        maxBytes=self.cfg.get('coalesce-max-bytes', COALESCE_MAX_BYTES),
+                                        maxDelay=self.cfg.get('coalesce-max-delay', COALESCE_MAX_DELAY) )
+
+    def pushData(self, data, size):
+        """
+        Send data to the server, or add it to the batch if enabled
+        """
+        self.stats.onPacketIn()
+        if self.coalescer is None:
+            self.sendData(data=data)
+            self.stats.onNotified(self.stats.recvTime)
+            return
+        self.coalescer.add(data, size)
+        if self.reactor is not None and self.coalesceTimer is None:
+            delay = self.coalescer.getDelay()
+            if delay is not None:
+                self.coalesceTimer = self.reactor.callLater(delay, self.onCoalesceTimer)
+
+    def onCoalesceTimer(self):
+        """
+        Called by the reactor when the max delay of the batch is reached
+        """
+        self.coalesceTimer = None
+        self.coalescer.flushIfDue()
+        delay = self.coalescer.getDelay()
+        if delay is not None:
+            self.coalesceTimer = self.reactor.callLater(delay, self.onCoalesceTimer)
+
+    def checkCoalescer(self):
+        """
+        Flush the batch if the max delay is reached, used in thread mode
+        """
+        if self.coalescer is not None:
+            self.coalescer.flushIfDue()
+
+    def flushCoalescer(self):
+        """
+        Send the pending batch
+        """
+        if self.coalescer is not None:
+            self.coalescer.flush()
+
+    def onCoalescedData(self, entries):
+        """
+        Send a batch of received data to the server
+        """
+        self.sendData(data={'coalesced': entries})
+        for entry in entries:
+            self.stats.onNotified(entry['time'])
+
+    def initPeers(self):
+        """
+        Initialize the table of the peers, limited by max-peers and
+        peer-idle-timeout (seconds) in the configuration
+        """
+        self.peers = PeerTable( maxPeers=self.cfg.get('max-peers', UDP_MAX_PEERS),
+                                idleTimeout=self.cfg.get('peer-idle-timeout', UDP_PEER_IDLE) )
+        self.peerTimer = None
+        self.nextPeerSweep = 0
+
+    def addPeer(self, address, peer, now):
+        """
+        Add a new peer in the table, the sweep of the idle peers is scheduled
+        in reactor mode
+        """
+        for removed in self.peers.add(address, peer, now):
+            self.onPeerExpired(*removed)
+        if self.reactor is not None and self.peerTimer is None:
+            self.peerTimer = self.reactor.callLater(PEER_SWEEP_INTERVAL, self.onPeerTimer)
+
+    def checkPeers(self):
+        """
+        Remove the idle peers, at most every PEER_SWEEP_INTERVAL seconds,
+        used in thread mode
+        """
+        if not self.peers:
+            return
+        now = time.time()
+        if now >= self.nextPeerSweep:
+            self.nextPeerSweep = now + PEER_SWEEP_INTERVAL
+            for removed in self.peers.expire(now):
+                self.onPeerExpired(*removed)
+
+    def onPeerTimer(self):
+        """
+        Called by the reactor, remove the idle peers while there are some
+        """
+        self.peerTimer = None
+        if self.stopEvent.isSet():
+            return
+        self.checkPeers()
+        if self.peers:
+            self.peerTimer = self.reactor.callLater(PEER_SWEEP_INTERVAL, self.onPeerTimer)
+
+    def onPeerExpired(self, address, peer):
+        """
+        On peer removed from the table, to reimplement
+        """
+        pass
     
-class SockRawThread(threading.Thread):
+class SockRawThread(ReactorContext, threading.Thread):
     """
     Raw socket thread
     """
+    STATS_EVENT = 'socket-raw-event'
+
     def __init__(self, parent, request):
         """
         Individual raw socket
@@ -208,7 +1090,14 @@ class SockRawThread(threading.Thread):
         self.socket = None
         self.cfg = request['data']
         self.sniffing = False   
+        self.capture = None
+        self.captureId = None
+        self.uploadThread = None
         self.__checkConfig()
+        self.initStats( self.cfg )
+        self.initReactor( parent.getReactor() if self.cfg.get('reactor', False) else None )
+        self.initRecvBuffer( SOCKET_BUFFER )
+        self.initCoalescer()
 
     def onReset(self):
         """
@@ -277,12 +1166,17 @@ class SockRawThread(threading.Thread):
         try:
             # Create the socket for windows
             self.socket = getSocket(sockType=RAW_PACKET_SOCKET)
+            # the filter is attached before the bind, unwanted frames are never queued
+            self.attachFilter()
             self.socket.bind( ( self.cfg['src-eth'], socket.SOCK_RAW ) )
 
             # extract reel source mac addr
-            src_mac = ':'.join( ["%02X" % (ord(ch),) for ch in self.socket.getsockname()[-1]] )
+            src_mac = ':'.join( ["%02X" % ch for ch in bytearray(self.socket.getsockname()[-1])] )
             self.sendNotify(data={'socket-raw-event': 'initialized', 'src-mac': src_mac  } )
 
+            if self.cfg.get('capture-file', False):
+                self.startCapture()
+
             self.sniffing = True
             self.onStartSniffing()
         except socket.error as e:
@@ -291,6 +1185,74 @@ class SockRawThread(threading.Thread):
             self.sendError( data= { 'socket-raw-event': "listen-error", 'more': "%s" % str(e) } )
             self.stop()
     
+    def attachFilter(self):
+        """
+        Attach the bpf filter to the socket if configured
+        """
+        if self.cfg.get('bpf-filter'):
+            insns = Bpf.compileFilter(self.cfg['bpf-filter'], self.cfg['src-eth'])
+        elif self.cfg.get('bpf-program'):
+            insns = Bpf.parseProgram(self.cfg['bpf-program'])
+        else:
+            return
+        Bpf.attachFilter(self.socket, insns)
+        self.sendNotify(data={'socket-raw-event': 'filter-attached', 'instructions': len(insns) } )
+
+    def startCapture(self):
+        """
+        Start to write frames in the ring of pcap files, in the temp area of the agent
+        """
+        self.captureId = self.parent.getCallId()
+        self.parent.addCallIdTmpDir("%s" % self.captureId)
+        directory = "%s/%s" % (self.parent.getTemp(), self.captureId)
+        self.capture = Pcap.PcapRing( directory, prefix="capture_%s" % self.cfg['src-eth'],
+                                      maxFiles=self.cfg.get('capture-ring-files', CAPTURE_RING_FILES),
+                                      maxBytes=self.cfg.get('capture-ring-size', CAPTURE_RING_SIZE) )
+        self.sendNotify(data={'socket-raw-event': 'capture-started' } )
+
+    def stopCapture(self):
+        """
+        Close the ring of pcap files and upload it; in reactor mode, the zip
+        and the upload are done in a thread to not block the other sockets
+        """
+        if self.capture is None:
+            return
+        capture = self.capture
+        self.capture = None
+        capture.close()
+        if self.reactor is None:
+            self.uploadCapture(capture)
+        else:
+            self.uploadThread = threading.Thread(target=self.uploadCapture, args=(capture,))
+            self.uploadThread.daemon = True
+            self.uploadThread.start()
+
+    def uploadCapture(self, capture):
+        """
+        Zip and upload the pcap files of the capture
+        """
+        try:
+            self.sendCapture(capture)
+        except Exception as e:
+            self.sendNotify(data={'socket-raw-event': 'capture-failed', 'more': str(e) } )
+
+    def sendCapture(self, capture):
+        """
+        Zip the pcap files and upload them
+        """
+        ret, pathZip, filenameZip = self.parent.createZip(callId=self.captureId, 
+                                                          zipReplayId=self.request['test-replay-id'],
+                                                          zipPrefix="agent") 
+        if not ret:
+            self.error('unable to create zip file')
+            self.sendNotify(data={'socket-raw-event': 'capture-failed', 'more': 'unable to create zip file' } )
+        else:
+            self.parent.uploadZip(callId=self.captureId, fileName=filenameZip, pathZip=pathZip, 
+                                  resultPath=self.request['result-path'])
+            self.sendNotify(data={'socket-raw-event': 'capture-uploaded', 'filename': filenameZip,
+                                  'frames': capture.frames, 'bytes': capture.bytes,
+                                  'files': len(capture.files) } )
+
     def onNotify(self, client, tid, request):
         """
         Called from remote peer to send data to the socket
@@ -304,7 +1266,8 @@ class SockRawThread(threading.Thread):
         if not self.sniffing:
             self.trace( "not sniffing" )
             return
-        self.socket.send( data )
+        sent = self.socket.send( data )
+        self.stats.onSend(sent, packets=1)
         self.trace( "raw data sent" )
 
     def onStartSniffingFailed(self, e):
@@ -324,9 +1287,23 @@ class SockRawThread(threading.Thread):
         """
         Clean socket
         """
+        self.flushCoalescer()
         if self.socket is not None: 
             self.socket.close()
+            # stopped is sent first, the upload can run in another thread
             self.sendNotify(data={'socket-raw-event': 'stopped' } )
+            try:
+                self.stopCapture()
+            except Exception as e:
+                self.sendNotify(data={'socket-raw-event': 'capture-failed', 'more': str(e) } )
+
+    def join(self, timeout=None):
+        """
+        Wait the end of the socket and of the upload of the capture
+        """
+        ReactorContext.join(self, timeout)
+        if self.uploadThread is not None:
+            self.uploadThread.join(timeout)
 
     def stop(self):
         """
@@ -334,6 +1311,42 @@ class SockRawThread(threading.Thread):
         """
         self.sniffing = False
         self.stopEvent.set()
+        self.stopReactor()
+
+    def onSocketData(self, read):
+        """
+        On data received on the raw socket
+        """
+        self.trace('data received (bytes %d)...' % len(read))
+        if self.capture is not None:
+            self.stats.onPacketIn()
+            self.capture.write(read, time.time())
+        else:
+            self.pushData(read.tobytes(), len(read))
+
+    def onReactorRead(self):
+        """
+        On readable event from the reactor, read until the socket would block
+        """
+        try:
+            while self.sniffing and not self.stopEvent.isSet():
+                try:
+                    read = self.recvData()
+                except socket.error as e:
+                    if Reactor.wouldBlock(e):
+                        break
+                    raise
+                self.onSocketData(read)
+        except socket.error as e:
+            self.onSocketError(e)
+        except Exception as e:    
+            self.sendError( data={ 'socket-raw-event': "on-run", "more": "%s" % str(e) } )
+
+    def onReactorWrite(self):
+        """
+        On writable event from the reactor
+        """
+        pass
 
     def run(self):
         """
@@ -349,9 +1362,10 @@ class SockRawThread(threading.Thread):
                         if self.socket in e:
                             raise EOFError("raw socket select error")
                         elif self.socket in r:  
-                            read = self.socket.recv( SOCKET_BUFFER )
-                            self.trace('data received (bytes %d)...' % len(read))
-                            self.sendData(data=read)
+                            read = self.recvData()
+                            self.onSocketData(read)
+                        self.checkCoalescer()
+                        self.checkTimers()
             except socket.error as e:
                 self.onSocketError(e)
             except Exception as e:    
@@ -366,10 +1380,12 @@ class SockRawThread(threading.Thread):
         self.sendError( data={ 'socket-raw-event': "socket-error", "more": "%s" % str(e) } )
         self.stop()
 
-class SockUdpThread(threading.Thread):
+class SockUdpThread(ReactorContext, threading.Thread):
     """
     UDP socket thread
     """
+    STATS_EVENT = 'udp-event'
+
     def __init__(self, parent, request):
         """
         Individual udp socket
@@ -382,7 +1398,15 @@ class SockUdpThread(threading.Thread):
         self.socket = None
         self.cfg = request['data']
         self.islistening = False    
+        self.lastActivity = time.time()
         self.__checkConfig()
+        self.initStats( self.cfg )
+        self.initReactor( parent.getReactor() if self.cfg.get('reactor', False) else None )
+        self.initRecvBuffer( SOCKET_BUFFER )
+        self.initCoalescer()
+        # one framer by source address
+        self.framing = 'framing' in self.cfg
+        self.initPeers()
 
     def onReset(self):
         """
@@ -458,7 +1482,10 @@ class SockUdpThread(threading.Thread):
         if not self.islistening:
             self.trace( "not connected" )
             return
-        self.socket.sendto(data, addr)
+        if self.cfg['sock-family'] == UNIX:
+            addr = getUnixAddress(addr)
+        sent = self.socket.sendto(data, addr)
+        self.stats.onSend(sent, packets=1)
         self.trace( "pdu sent" )
 
     def createUdpSocket(self):
@@ -473,15 +1500,22 @@ class SockUdpThread(threading.Thread):
                 sockType = INIT_DGRAM_SOCKET
             elif  self.cfg['sock-family'] == IPv6:
                 sockType = INIT6_DGRAM_SOCKET
+            elif self.cfg['sock-family'] == UNIX:
+                sockType = UNIX_DGRAM_SOCKET
             else:
-                self.sendError( { 'udp-event':'socket-family-unknown', 'more': '%s' % str(self.cfg['socket-family'])} )
+                self.sendError( { 'udp-event':'socket-family-unknown', 'more': '%s' % str(self.cfg['sock-family'])} )
                 self.stop()
+                return
 
             # Create the socket
             self.socket = getSocket(sockType=sockType)
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.trace( 'bind socket on %s:%s' % (self.cfg['bind-ip'], self.cfg['bind-port']) )
-            self.socket.bind( (self.cfg['bind-ip'], self.cfg['bind-port']) )
+            if self.cfg['sock-family'] == UNIX:
+                # without path, an address is generated in the abstract namespace (linux)
+                self.bindUnixSocket( self.cfg.get('bind-path', '') )
+            else:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self.trace( 'bind socket on %s:%s' % (self.cfg['bind-ip'], self.cfg['bind-port']) )
+                self.socket.bind( (self.cfg['bind-ip'], self.cfg['bind-port']) )
             
             # listening successful
             self.__setSource()  
@@ -513,49 +1547,97 @@ class SockUdpThread(threading.Thread):
         """
         Set the source ip and port
         """
-        srcIp, srcPort = self.socket.getsockname()
+        srcIp, srcPort = getSourceAddress(self.socket, self.cfg['sock-family'])
         self.sendNotify(data={'udp-event': 'initialized', 'src-ip': srcIp, 'src-port': srcPort} )
 
     def cleanSocket(self):
         """
         Clean the socket
         """
+        self.flushCoalescer()
         if self.socket is not None: 
             self.socket.close()
+            self.cleanUnixSocket()
             self.sendNotify(data={'udp-event': 'stopped' } )
 
-    def stop(self):
+    def stop(self):
+        """
+        Stop the thread
+        """
+        self.stopEvent.set()
+        self.stopReactor()
+
+    def getInactivityTimeout(self):
+        """
+        Return the inactivity timeout in seconds
+        """
+        return MAX_INACTIVITY
+
+    def onDatagram(self, data, addr):
+        """
+        On datagram received
+        """
+        self.lastActivity = time.time()
+        if self.cfg['sock-family'] == UNIX:
+            addr = formatUnixAddress(addr)
+        if not self.framing:
+            self.pushData({'pdu': data.tobytes(), 'from-addr': addr }, len(data))
+        else:
+            peer = self.peers.touch(addr, self.lastActivity)
+            if peer is None:
+                peer = { 'framer': Framer.createFramer(self.cfg) }
+                self.addPeer(addr, peer, self.lastActivity)
+            for pdu in peer['framer'].feed(data):
+                self.pushData({'pdu': pdu, 'from-addr': addr }, len(pdu))
+
+    def onReactorRead(self):
+        """
+        On readable event from the reactor, read until the socket would block
+        """
+        try:
+            while self.islistening and not self.stopEvent.isSet():
+                try:
+                    (data, addr) = self.recvDatagram()
+                except socket.error as e:
+                    if Reactor.wouldBlock(e):
+                        break
+                    raise
+                self.onDatagram(data, addr)
+        except socket.error as e:
+            self.onSocketError(e)
+        except Exception as e:
+            self.sendError( data={ 'udp-event': "on-run", "more": "%s" % str(e) } )
+
+    def onReactorWrite(self):
         """
-        Stop the thread
+        On writable event from the reactor
         """
-        self.stopEvent.set()
+        pass
 
     def run(self):
         """
         On run function
         """
+        # inactivity timeout, global protection
+        self.startInactivityTimer()
         while not self.stopEvent.isSet():
             self.__mutex__.acquire()
             try:
                 if self.socket is not None:  
                     if self.islistening:
                         r, w, e = select.select([ self.socket ], [], [], 0.01)
-                        for s in r:
-                            if s is not None:
-                                (data, addr) = s.recvfrom(65535)
-                                self.lastActivity = time.time()
-                                self.sendData(data={'pdu': data, 'from-addr': addr } )
-                        
-                        # Check inactivity timeout, global protection
-                        if time.time() - self.lastActivity > MAX_INACTIVITY:
-                            self.trace( "nothing happens since a long time ago, force to stop me" )
-                            # self.closeSocket()
-                            self.stop()
+                        if self.socket in r:
+                            (data, addr) = self.recvDatagram()
+                            self.onDatagram(data, addr)
+                        self.checkCoalescer()
+                        self.checkPeers()
+                        self.checkTimers()
             except socket.error as e:
                 self.onSocketError(e)
             except Exception as e:
                 self.sendError( data={ 'udp-event': "on-run", "more": "%s" % str(e) } )
             self.__mutex__.release()
+        self.stopInactivityTimer()
         self.cleanSocket()
 
     def onSocketError(self, e):
@@ -565,10 +1647,12 @@ class SockUdpThread(threading.Thread):
         self.sendError( data={ 'udp-event': "socket-error", "more": "%s" % str(e) } )
         self.stop()
 
-class SockTcpThread(threading.Thread):
+class SockTcpThread(ReactorContext, threading.Thread):
     """
     TCP socket thread
     """
+    STATS_EVENT = 'tcp-event'
+
     def __init__(self, parent, request):
         """
         Individual socket
@@ -581,10 +1665,18 @@ class SockTcpThread(threading.Thread):
         self.socket = None
         self.cfg = request['data']
         self.tcpConnected = False   
+        self.lastActivity = time.time()
         self.__checkConfig()
         self.sslCipher = ''
         self.sslVersion = ''
         self.sslBits = ''
+        self.sslKey = None
+        self.initStats( self.cfg )
+        self.initReactor( parent.getReactor() if self.cfg.get('reactor', False) else None )
+        self.initRecvBuffer( RECV_BUFFER_SIZE )
+        self.initSendQueue( self.cfg )
+        self.framer = Framer.createFramer(self.cfg) if 'framing' in self.cfg else None
+        self.initCoalescer()
    
     def onReset(self):
         """
@@ -657,7 +1749,9 @@ class SockTcpThread(threading.Thread):
         if not self.tcpConnected:
             self.trace( "not connected" )
             return
-        self.queueTcp.put( data )
+        wasEmpty = self.sendQueue.put( self.encodeMessage(data) )
+        if self.reactor is not None and wasEmpty:
+            self.reactor.callSoon(self.onReactorWrite)
 
     def initSocketSsl(self, sock):
         """
@@ -697,12 +1791,60 @@ class SockTcpThread(threading.Thread):
                 raise Exception("certificate required from the other side of the connection - no CA certificates")
 
             if sock is not None:
-                sock = ssl.wrap_socket(sock, cert_reqs=check, do_handshake_on_connect=False, 
-                                        ssl_version=ver, ca_certs=self.cfg['ca-certs'] )
+                if not hasattr(ssl, "SSLContext"): # python < 2.7.9
+                    return ssl.wrap_socket(sock, cert_reqs=check, do_handshake_on_connect=False, 
+                                            ssl_version=ver, ca_certs=self.cfg['ca-certs'] )
+
+                # the context is shared by all sockets of the agent with the same parameters
+                self.sslKey = ( ver, check, self.cfg['ca-certs'], self.cfg.get('ssl-cert'), 
+                                self.cfg.get('ssl-key'), self.cfg.get('ssl-ciphers') )
+                ctx = self.parent.getSslContext(self.sslKey, self.createSslContext)
+                session = None
+                if self.cfg.get('ssl-session-reuse', False):
+                    session = self.parent.getSslSession( self.getSslSessionKey() )
+                if session is not None:
+                    sock = ctx.wrap_socket(sock, do_handshake_on_connect=False, session=session)
+                else:
+                    sock = ctx.wrap_socket(sock, do_handshake_on_connect=False)
         except Exception as e:
             raise Exception('SSL init failed: %s' % str(e)) 
         return sock
     
+    def createSslContext(self):
+        """
+        Create the ssl context according to the key of the socket
+        """
+        ver, check, caCerts, certFile, keyFile, ciphers = self.sslKey
+        ctx = ssl.SSLContext(ver)
+        if hasattr(ctx, "check_hostname"):
+            ctx.check_hostname = False
+        ctx.verify_mode = check
+        if caCerts is not None:
+            ctx.load_verify_locations(cafile=caCerts)
+        if certFile is not None:
+            ctx.load_cert_chain(certfile=certFile, keyfile=keyFile)
+        if ciphers is not None:
+            ctx.set_ciphers(ciphers)
+        return ctx
+
+    def getSslSessionKey(self):
+        """
+        Return the key of the tls session, by context and destination
+        """
+        return ( self.sslKey, self.cfg.get('dst-ip'), self.cfg.get('dst-port'), self.cfg.get('dst-path') )
+
+    def saveSslSession(self):
+        """
+        Save the tls session of the socket to resume it on the next connection
+        With tls 1.3, the ticket is received after the handshake, 
+        so the session is saved again before to close the socket.
+        """
+        if not self.cfg.get('ssl-session-reuse', False):
+            return
+        session = getattr(self.socket, "session", None)
+        if session is not None and getattr(session, "has_ticket", True):
+            self.parent.setSslSession( self.getSslSessionKey(), session )
+
     def getPEMcert(self, DERcert):
         """
         Return the DER cert to PEM
@@ -743,16 +1885,21 @@ class SockTcpThread(threading.Thread):
             self.trace( 'starting handshake ')
             
             # do handshake ssl
+            start = time.time()
             sock.do_handshake()
+            duration = time.time() - start
             
             self.trace( 'handshake done')
             # extract ssl informations
             self.sslCipher, self.sslVersion, self.sslBits = sock.cipher()
             dercert = sock.getpeercert(True)
-            certPEM = self.getPEMcert( dercert )
+            certPEM = self.getPEMcert( dercert ) if dercert is not None else ''
+            resumed = getattr(sock, "session_reused", False) or False
+            self.saveSslSession()
 
             self.sendNotify(data={'ssl-event': 'handshake-accepted', 'cipher': self.sslCipher, 
-                                    'version': self.sslVersion,  'bits': self.sslBits, 'cert-pem': certPEM} )
+                                    'version': self.sslVersion,  'bits': self.sslBits, 'cert-pem': certPEM,
+                                    'resumed': resumed, 'duration': duration } )
         except ssl.SSLError as x: 
             self.sendNotify(data={'ssl-event': 'handshake-failed', 'error': self.getSslError(str(x)) } )
             # raise failure to parent
@@ -764,18 +1911,23 @@ class SockTcpThread(threading.Thread):
         """
         try:
             # set the socket version
+            isUnix = self.cfg['sock-family'] == UNIX
             if self.cfg['sock-family'] == IPv4:
                 sockType = INIT_STREAM_SOCKET
             elif  self.cfg['sock-family'] == IPv6:
                 sockType = INIT6_STREAM_SOCKET
+            elif isUnix:
+                sockType = UNIX_STREAM_SOCKET
             else:
-                self.sendError( { 'tcp-event':'socket-family-unknown', 'more': '%s' % str(self.cfg['socket-family'])} )
+                self.sendError( { 'tcp-event':'socket-family-unknown', 'more': '%s' % str(self.cfg['sock-family'])} )
                 self.stop()
+                return
                 
             # Create the socket
             self.socket = getSocket(sockType=sockType)
-            self.socket.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
-            if self.cfg['tcp-keepalive']:
+            if not isUnix:
+                self.socket.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+            if self.cfg['tcp-keepalive'] and not isUnix:
                 # active tcp keep alive
                 self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
                 if sys.platform == "win32":
@@ -795,8 +1947,11 @@ class SockTcpThread(threading.Thread):
                     self.socket.setsockopt(socket.SOL_TCP, socket.TCP_KEEPCNT, 5) 
 
             self.socket.settimeout( self.cfg['sock-timeout'] )
-            self.trace( 'bind socket on %s:%s' % (self.cfg['bind-ip'], self.cfg['bind-port']) )
-            self.socket.bind( (self.cfg['bind-ip'], self.cfg['bind-port']) )
+            if not isUnix:
+                self.trace( 'bind socket on %s:%s' % (self.cfg['bind-ip'], self.cfg['bind-port']) )
+                self.socket.bind( (self.cfg['bind-ip'], self.cfg['bind-port']) )
+            elif self.cfg.get('bind-path'):
+                self.bindUnixSocket( self.cfg['bind-path'] )
             self.__setSource()  
 
             # Optional: initialize the ssl
@@ -804,18 +1959,22 @@ class SockTcpThread(threading.Thread):
                 self.socket = self.initSocketSsl(sock=self.socket)
             
             # Connect the socket
-            self.socket.connect( (self.cfg['dst-ip'], self.cfg['dst-port']) )
+            if isUnix:
+                self.socket.connect( getUnixAddress(self.cfg['dst-path']) )
+            else:
+                self.socket.connect( (self.cfg['dst-ip'], self.cfg['dst-port']) )
 
             # Connection successful
             self.tcpConnected = True
             self.lastActivity = time.time()
-            self.queueTcp = Queue.Queue(0)
             self.onConnectionTcp()      
             
             # Optional: do ssl handshake
             if self.cfg['ssl-support']:
                 try:
                     self.doSslHandshake(sock=self.socket)
+                    # tls records without data (session tickets) must not block the read
+                    self.socket.setblocking(0)
                 except HandshakeFailed:
                     self.onSslHandshakeFailed()
         except socket.timeout as e:
@@ -849,7 +2008,7 @@ class SockTcpThread(threading.Thread):
         """
         Set the source ip and port
         """
-        srcIp, srcPort = self.socket.getsockname()
+        srcIp, srcPort = getSourceAddress(self.socket, self.cfg['sock-family'])
         self.sendNotify(data={'tcp-event': 'initialized', 'src-ip': srcIp, 'src-port': srcPort} )
 
     def onSslHandshakeFailed(self):
@@ -899,59 +2058,119 @@ class SockTcpThread(threading.Thread):
         self.sendError( data={ 'tcp-event': "socket-error", "more": "%s" % str(e) } )
         self.stop()
 
+    def getInactivityTimeout(self):
+        """
+        Return the inactivity timeout in seconds
+        """
+        return MAX_INACTIVITY
+
+    def onSocketData(self, read):
+        """
+        On data received on the tcp socket
+        """
+        if not read:
+            self.sendNotify(data={'tcp-event': 'no-more-data' } )
+            raise EOFError("nothing to read: disconnecting")
+        self.trace( '%d bytes received' % len(read) )
+        self.lastActivity = time.time()
+        if self.framer is None:
+            self.pushData(read.tobytes(), len(read))
+        else:
+            for pdu in self.framer.feed(read):
+                self.pushData(pdu, len(pdu))
+
+    def encodeMessage(self, message):
+        """
+        Return the message to send as bytes
+        """
+        if sys.version_info > (3,):
+            if not isinstance(message, bytes):
+                message = bytes(message, "utf8")
+        elif isinstance(message, unicode):
+            message = message.encode('utf-8')
+        return message
+
+    def onReactorRead(self):
+        """
+        On readable event from the reactor, read until the socket would block
+        """
+        try:
+            while self.tcpConnected and not self.stopEvent.isSet():
+                try:
+                    read = self.recvData()
+                except socket.error as e:
+                    if Reactor.wouldBlock(e):
+                        break
+                    raise
+                self.onSocketData(read)
+        except EOFError as e:
+            self.onDisconnectionByPeer(e)
+        except socket.error as e:
+            self.onSocketError(e)
+        except Exception as e:
+            self.sendError( data={ 'tcp-event': "on-run", "more": "%s" % str(e) } )
+
+    def onReactorWrite(self):
+        """
+        On writable event from the reactor, send queued messages
+        until the socket would block
+        """
+        if not self.tcpConnected or self.stopEvent.isSet():
+            return
+        try:
+            self.sendQueued()
+        except Exception as e:
+            self.sendError(data= { 'tcp-event': "sending-error", 
+                                    "more": "unable to send message: %s" % str(e) } )
+
+    def onSendBufferFull(self, size):
+        """
+        On high water mark reached in the send queue
+        """
+        self.sendNotify(data={'tcp-event': 'send-buffer-full', 'queued': size } )
+
+    def onSendBufferDrained(self, size):
+        """
+        On low water mark reached in the send queue
+        """
+        self.sendNotify(data={'tcp-event': 'send-buffer-drained', 'queued': size } )
+
     def run(self):
         """
         On run function
         """
+        # inactivity timeout, global protection
+        self.startInactivityTimer()
         while not self.stopEvent.isSet():
             self.__mutex__.acquire()
             try:
                 if self.socket is not None: 
                     if self.tcpConnected:
-                        r, w, e = select.select([ self.socket ], [], [ self.socket ], 0.01)
+                        # wait for write only when messages are queued
+                        w = [ self.socket ] if not self.sendQueue.empty() else []
+                        r, w, e = select.select([ self.socket ], w, [ self.socket ], 0.01)
                         if self.socket in e:
                             raise EOFError("socket select error: disconnecting")
                         elif self.socket in r:
-                            read = self.socket.recv(1024*1024)
-                            if not read:
-                                self.sendNotify(data={'tcp-event': 'no-more-data' } )
-                                raise EOFError("nothing to read: disconnecting")
-                            self.trace( '%d bytes received' % len(read) )
-                            self.lastActivity = time.time()
-                            self.sendData(data=read)
-
-                        # Check inactivity timeout, global protection
-                        elif time.time() - self.lastActivity > MAX_INACTIVITY:
-                            self.trace( "nothing happens since a long time ago, force to stop me" )
-                            # self.closeSocket()
-                            self.stop()
-
-                        # send queued messages
-                        while not self.queueTcp.empty():
-                            r, w, e = select.select([ ], [ self.socket ], [ self.socket ], 0.001)
-                            if self.socket in e:
-                                raise EOFError("socket select error when sending a message: disconnecting")
-                            elif self.socket in w: 
-                                try:
-                                    message = self.queueTcp.get(False)
-                                    if sys.version_info > (3,):
-                                        if isinstance(message, bytes):
-                                            self.socket.sendall(message)
-                                        else:
-                                            self.socket.sendall( bytes(message, "utf8") )
-                                    else:
-                                        try:
-                                            self.socket.sendall(message)
-                                        except UnicodeError:
-                                            self.socket.sendall(message.encode('utf-8'))
-                                    self.trace( "packet sent" )
-                                except Queue.Empty:
-                                    pass
-                                except Exception as e:
+                            try:
+                                read = self.recvData()
+                            except ssl.SSLError as e:
+                                if not Reactor.wouldBlock(e):
+                                    raise
+                            else:
+                                self.onSocketData(read)
+                        self.checkCoalescer()
+                        self.checkTimers()
+
+                        # send queued messages, gathered in one call
+                        if self.socket in w: 
+                            try:
+                                self.sendQueue.send(self.socket)
+                            except Exception as e:
+                                if not Reactor.wouldBlock(e):
+                                    self.sendQueue.clear()
                                     self.sendError(data= { 'tcp-event': "sending-error", 
                                                             "more": "unable to send message: %s" % str(e) } )
-                            else:
-                                break
             except EOFError as e:
                 self.onDisconnectionByPeer(e)
             except socket.error as e:
@@ -959,6 +2178,7 @@ class SockTcpThread(threading.Thread):
             except Exception as e:
                 self.sendError( data={ 'tcp-event': "on-run", "more": "%s" % str(e) } )
             self.__mutex__.release()
+        self.stopInactivityTimer()
         self.cleanSocket()
 
     def cleanSocket(self):
@@ -966,11 +2186,15 @@ class SockTcpThread(threading.Thread):
         Clean the socket
         """
         self.trace( 'cleaning socket connected=%s...' % self.tcpConnected )    
+        self.flushCoalescer()
         if self.socket is not None: 
             if self.tcpConnected:
+                if self.sslKey is not None:
+                    self.saveSslSession()
                 self.trace( 'closing socket...' )    
                 self.socket.close()
                 self.sendNotify(data={'tcp-event': 'closed' } )
+            self.cleanUnixSocket()
         self.tcpConnected = False
     
     def stop(self):
@@ -978,11 +2202,14 @@ class SockTcpThread(threading.Thread):
         Stop the thread
         """
         self.stopEvent.set()
+        self.stopReactor()
 
-class SockUdpServerThread(threading.Thread):
+class SockUdpServerThread(ReactorContext, threading.Thread):
     """
     UDP Socket server thread
     """
+    STATS_EVENT = 'udp-event'
+
     def __init__(self, parent, request):
         """
         Constructor
@@ -995,7 +2222,12 @@ class SockUdpServerThread(threading.Thread):
         self.socket = None
         self.islistening = False
         self.cfg = request['data']
+        self.peerId = 0
         self.__checkConfig()
+        self.initPeers()
+        self.initStats( self.cfg )
+        self.initReactor( parent.getReactor() if self.cfg.get('reactor', False) else None )
+        self.initRecvBuffer( SOCKET_BUFFER )
         
     def __checkConfig(self):
         """
@@ -1011,20 +2243,177 @@ class SockUdpServerThread(threading.Thread):
         """
         Create the UDP server socket
         """
-        pass
+        try:
+            # set the socket version
+            if self.cfg['sock-family'] == IPv4:
+                sockType = INIT_DGRAM_SOCKET
+            elif  self.cfg['sock-family'] == IPv6:
+                sockType = INIT6_DGRAM_SOCKET
+            elif self.cfg['sock-family'] == UNIX:
+                sockType = UNIX_DGRAM_SOCKET
+            else:
+                raise Exception('socket family unknown: %s' % str(self.cfg['sock-family']) )  
+
+            # Create the socket
+            self.socket = getSocket(sockType=sockType)
+            if self.cfg.get('sock-rcvbuf'):
+                # bigger kernel buffer to absorb bursts without packet loss
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, int(self.cfg['sock-rcvbuf']) )
+            self.socket.setblocking(0)
+            if self.cfg['sock-family'] == UNIX:
+                self.bindUnixSocket( self.cfg['bind-path'] )
+            else:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self.trace( 'bind socket on %s:%s' % (self.cfg['bind-ip'], self.cfg['bind-port']) )
+                self.socket.bind( (self.cfg['bind-ip'], self.cfg['bind-port']) )
+
+            # Listening successful
+            self.__setSource()  
+            self.islistening = True
+            self.sendNotify(data={'udp-event': 'listening', 
+                                  'rcvbuf': self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) } )
+        except socket.error as e:
+            self.sendNotify(data={'udp-event': 'listening-failed', 'more': str(e) } )
+            self.stop()
+        except Exception as e:
+            self.error( "listening error: %s" % str(e) )
+            self.sendError( data= { 'udp-event': "listening-error", 'more': "%s" % str(e) } )
+            self.stop()
         
     def __setSource(self):
         """
         Set the source ip and port
         """
-        srcIp, srcPort = self.socket.getsockname()
-        self.sendNotify(data={'tcp-event': 'initialized', 'src-ip': srcIp, 'src-port': srcPort} )
+        srcIp, srcPort = getSourceAddress(self.socket, self.cfg['sock-family'])
+        self.sendNotify(data={'udp-event': 'initialized', 'src-ip': srcIp, 'src-port': srcPort} )
 
     def onNotify(self, client, tid, request):
         """
-        On notify
+        On notify, reply to the peer by address
+        """
+        ip = request['data']['to-ip']
+        port = request['data']['to-port']
+        
+        self.sendUdpData(peerAddress=(ip,port), pdu=request['data']['payload'])
+
+    def sendUdpData(self, peerAddress, pdu):
+        """
+        Send data to the peer
+        """
+        if not self.islistening:
+            self.trace( "not listening" )
+            return
+        if sys.version_info[0] == 3 and not isinstance(pdu, bytes): # python 3 support
+            pdu = bytes(pdu, "UTF-8")
+        try:
+            if self.cfg['sock-family'] == UNIX:
+                sent = self.socket.sendto(pdu, getUnixAddress(peerAddress[0]))
+            else:
+                sent = self.socket.sendto(pdu, peerAddress)
+        except socket.error as e:
+            self.sendError( data= { 'udp-event': "sending-error", 'more': "%s" % str(e), 
+                                    'ip': peerAddress[0], 'port': peerAddress[1] } )
+            return
+        self.stats.onSend(sent, packets=1)
+        peer = self.peers.get(peerAddress)
+        if peer is not None:
+            peer['packets-out'] += 1
+            peer['bytes-out'] += len(pdu)
+        self.trace( "pdu sent" )
+
+    def getPeer(self, peerAddress, now):
+        """
+        Return the peer by address, a new one is created on the first datagram,
+        new-peer is notified only if notify-peers is enabled
+        """
+        peer = self.peers.touch(peerAddress, now)
+        if peer is None:
+            self.peerId += 1
+            peer = { 'id': self.peerId, 'first-seen': now, 
+                     'packets-in': 0, 'bytes-in': 0, 'packets-out': 0, 'bytes-out': 0,
+                     'framer': Framer.createFramer(self.cfg) if 'framing' in self.cfg else None }
+            self.addPeer(peerAddress, peer, now)
+            if self.cfg.get('notify-peers', False):
+                (ip, port) = peerAddress
+                self.sendNotify(data={'udp-event': 'new-peer', 'ip': ip, 'port': port, 'peer-id': peer['id'] } )
+        return peer
+
+    def onPeerExpired(self, peerAddress, peer):
+        """
+        On peer removed from the table, idle or too many peers
+        """
+        if self.cfg.get('notify-peers', False):
+            (ip, port) = peerAddress
+            self.sendNotify(data={'udp-event': 'peer-expired', 'ip': ip, 'port': port, 'peer-id': peer['id'],
+                                  'packets-in': peer['packets-in'], 'packets-out': peer['packets-out'] } )
+
+    def drainDatagrams(self):
+        """
+        Read all queued datagrams until the socket would block
+        """
+        try:
+            while self.islistening and not self.stopEvent.isSet():
+                try:
+                    (data, addr) = self.recvDatagram()
+                except socket.error as e:
+                    if Reactor.wouldBlock(e):
+                        break
+                    raise
+                nbytes = len(data)
+                if self.cfg['sock-family'] == UNIX:
+                    # path of the peer as ip, the peer must be bound to get replies
+                    peerAddress = ( formatUnixAddress(addr), 0 )
+                else:
+                    peerAddress = addr[:2]
+                peer = self.getPeer(peerAddress, time.time())
+                peer['packets-in'] += 1
+                peer['bytes-in'] += nbytes
+
+                (ip, port) = peerAddress
+                if peer['framer'] is None:
+                    pdus = [ data.tobytes() ]
+                else:
+                    pdus = peer['framer'].feed(data)
+                for pdu in pdus:
+                    self.stats.onPacketIn()
+                    self.sendNotify(data={'udp-event': 'client-data', 'ip': ip, 'port': port, 
+                                          'peer-id': peer['id'], 'payload': pdu } )
+                    self.stats.onNotified(self.stats.recvTime)
+        except socket.error as e:
+            self.sendError( data={ 'udp-event': "socket-error", "more": "%s" % str(e) } )
+            self.stop()
+        except Exception as e:
+            self.sendError( data={ 'udp-event': "on-run", "more": "%s" % str(e) } )
+
+    def onReactorRead(self):
+        """
+        On readable event from the reactor
+        """
+        self.drainDatagrams()
+
+    def onReactorWrite(self):
+        """
+        On writable event from the reactor
         """
         pass
+
+    def getStats(self):
+        """
+        Return the counters of the socket and the number of peers
+        """
+        stats = self.stats.toDict()
+        stats['peers'] = len(self.peers)
+        return stats
+
+    def cleanSocket(self):
+        """
+        Clean the socket
+        """
+        if self.socket is not None: 
+            self.islistening = False
+            self.socket.close()
+            self.cleanUnixSocket()
+            self.sendNotify(data={'udp-event': 'stopped', 'peers': len(self.peers) } )
    
     def onReset(self):
         """
@@ -1049,6 +2438,7 @@ class SockUdpServerThread(threading.Thread):
         Stop the thread
         """
         self.stopEvent.set()
+        self.stopReactor()
 
     def sendError(self, data):
         """
@@ -1085,15 +2475,26 @@ class SockUdpServerThread(threading.Thread):
         On run function
         """
         while not self.stopEvent.isSet():
-            self.__mutex__.acquire()
-            self.__mutex__.release()
+            if self.socket is None or not self.islistening:
+                self.stopEvent.wait(0.1)
+                continue
+            try:
+                # wait for datagrams, the timeout is only used to check the stop event
+                r, w, e = select.select([ self.socket ], [], [], 0.1)
+            except (socket.error, select.error, ValueError) as e:
+                break
+            if r:
+                self.drainDatagrams()
+            self.checkPeers()
+            self.checkTimers()
+        self.cleanSocket()
 
 # NEW in v12.1.0
-class ClientThread(threading.Thread):
+class ClientThread(ReactorContext, threading.Thread):
     """
     Client thread
     """
-    def __init__(self, sock, ip, port, parent, id):
+    def __init__(self, sock, ip, port, parent, id, reactor=None):
         """
         Constructor
         """
@@ -1103,10 +2504,13 @@ class ClientThread(threading.Thread):
         self.clientAddress = (ip,port)
         self.ID = id
         self.socket = sock
-        self.buf = ''
-        self.queueTcp = Queue.Queue(0)
+        self.framer = Framer.createFramer(parent.cfg)
         self.__mutex__ = threading.RLock()
         self.lastActivity = time.time()
+        self.initStats()
+        self.initReactor(reactor)
+        self.initRecvBuffer( RECV_BUFFER_SIZE )
+        self.initSendQueue( parent.cfg )
         
     def getId(self):
         """
@@ -1131,54 +2535,125 @@ class ClientThread(threading.Thread):
         Return the parent object
         """
         return self.__parent
+
+    def trace(self, txt):
+        """
+        Trace
+        """
+        self.parent().trace(txt)
+
+    def getInactivityTimeout(self):
+        """
+        Return the inactivity timeout in seconds
+        """
+        return self.parent().cfg['inactivity-timeout']
+
+    def getTimerWheel(self):
+        """
+        Return the timer wheel shared by all clients of the server
+        """
+        return self.parent().getTimerWheel()
+
+    def onInactivityTimeout(self):
+        """
+        On inactivity timeout
+        """
+        self.parent().trace( "Inactivity detected: disconnecting client #%s" % self.getId() )
+        self.onDisconnection( EOFError("inactivity timeout: disconnecting") )
+
+    def onSocketData(self, read):
+        """
+        On data received from the client
+        """
+        if not read:
+            self.onIncomingData(noMoreData=True)
+            raise EOFError("nothing to read: disconnecting")
+        self.parent().trace( '%d bytes received' % len(read) )
+        self.lastActivity = time.time()
+        if self.framer is None:
+            self.onIncomingData(data=read.tobytes())
+        else:
+            for pdu in self.framer.feed(read):
+                self.onIncomingData(data=pdu)
+
+    def onReactorRead(self):
+        """
+        On readable event from the reactor, read until the socket would block
+        """
+        try:
+            while not self.stopEvent.isSet():
+                try:
+                    read = self.recvData()
+                except socket.error as e:
+                    if Reactor.wouldBlock(e):
+                        break
+                    raise
+                self.onSocketData(read)
+        except EOFError as e:
+            self.onDisconnection(e)
+        except socket.error as e:
+            self.parent().onClientSocketError(self.clientAddress, e )
+            self.stop()
+        except Exception as e:
+            self.parent().error( "on run %s" % str(e) )
+            self.stop()
+
+    def onReactorWrite(self):
+        """
+        On writable event from the reactor, send queued messages
+        until the socket would block
+        """
+        if self.stopEvent.isSet():
+            return
+        try:
+            self.sendQueued()
+        except Exception as e:
+            self.parent().error("unable to send message: " + str(e))
+
+    def onSendBufferFull(self, size):
+        """
+        On high water mark reached in the send queue
+        """
+        self.parent().onClientSendBuffer(self.clientAddress, 'send-buffer-full', size)
+
+    def onSendBufferDrained(self, size):
+        """
+        On low water mark reached in the send queue
+        """
+        self.parent().onClientSendBuffer(self.clientAddress, 'send-buffer-drained', size)
+
+    def cleanSocket(self):
+        """
+        Close the socket
+        """
+        self.socket.close()
         
     def run(self):
         """
         On run thread
         """
+        self.startInactivityTimer()
         while not self.stopEvent.isSet():
             try:
                 # check if we have incoming data
                 if self.socket is not None:         
-                    r, w, e = select.select([ self.socket ], [], [ self.socket ], 0.01)
+                    # wait for write only when messages are queued
+                    w = [ self.socket ] if not self.sendQueue.empty() else []
+                    r, w, e = select.select([ self.socket ], w, [ self.socket ], 0.01)
                     if self.socket in e:
                             raise EOFError("socket select error: disconnecting")
                     elif self.socket in r:
-                            read = self.socket.recv(1024*1024)
-                            if not read:
-                                self.onIncomingData(noMoreData=True)
-                                raise EOFError("nothing to read: disconnecting")
-                            self.parent().trace( '%d bytes received' % len(read) )
-                            self.lastActivity = time.time()
-                            if self.parent().cfg['sep-disabled']:
-                                self.onIncomingData(data=read)
-                            else:
-                                self.buf = ''.join([self.buf, read])
-                                self.onIncomingData()
-                    
-                    # Check inactivity timeout
-                    elif self.parent().cfg['inactivity-timeout']:
-                        if time.time() - self.lastActivity > self.parent().cfg['inactivity-timeout']:
-                            self.parent().trace( "Inactivity detected: disconnecting client #%s" % self.getId() )
-                            raise EOFError("inactivity timeout: disconnecting")
+                            read = self.recvData()
+                            self.onSocketData(read)
     
-                    # send queued messages
-                    while not self.queueTcp.empty():
-                            r, w, e = select.select([ ], [ self.socket ], [ self.socket ], 0.001)
-                            if self.socket in e:
-                                self.parent().error("Socket select error when sending a message: disconnecting client #%s" % self.getId() )
-                                raise EOFError("socket select error when sending a message: disconnecting")
-                            elif self.socket in w: 
-                                try:
-                                        message = self.queueTcp.get(False)
-                                        self.socket.sendall( message )
-                                        self.parent().trace( "packet sent" )
-                                except Queue.Empty:
-                                        pass
-                                except Exception as e:
-                                        self.parent().error("unable to send message: " + str(e))
-                            else:
-                                    break
+                    # send queued messages, gathered in one call
+                    if self.socket in w: 
+                        try:
+                            self.sendQueue.send(self.socket)
+                        except Exception as e:
+                            self.sendQueue.clear()
+                            self.parent().error("unable to send message: " + str(e))
+                    self.checkTimers()
             except EOFError as e:
                 self.onDisconnection(e)
             except socket.error as e:
@@ -1188,6 +2663,7 @@ class ClientThread(threading.Thread):
                 self.parent().error( "on run %s" % str(e) )
                 self.stop()
         
+        self.stopInactivityTimer()
         self.socket.close()
         self.stop()
         
@@ -1196,6 +2672,7 @@ class ClientThread(threading.Thread):
         Stop the thread
         """
         self.stopEvent.set()
+        self.stopReactor()
         
     def onDisconnection(self, e):
         """
@@ -1214,23 +2691,19 @@ class ClientThread(threading.Thread):
             if noMoreData:
                 self.parent().onClientNoMoreData(clientAddress=self.clientAddress)
             else:
-                if data is not None: # separator feature is disabled
-                    self.parent().onClientIncomingData( clientAddress=self.clientAddress, pdu=data )
-                
-                else: # separator feature is enabled, split the buffer by the separator
-                    datas = self.buf.split(self.parent().cfg['sep-in'])
-                    for data in datas[:-1]:
-                        pdu = data+self.parent().cfg['sep-in']
-                        self.parent().onClientIncomingData( clientAddress=self.clientAddress, pdu=pdu)
-                    
-                    self.buf = datas[-1]
+                # whole pdu when the framing is enabled
+                self.stats.onPacketIn()
+                self.parent().onClientIncomingData( clientAddress=self.clientAddress, pdu=data )
+                self.stats.onNotified(self.stats.recvTime)
         except Exception as e:
             self.parent().error( str(e) )
 
-class SockTcpServerThread(threading.Thread):
+class SockTcpServerThread(ReactorContext, threading.Thread):
     """
     TCP Socket server thread
     """
+    STATS_EVENT = 'tcp-event'
+
     def __init__(self, parent, request):
         """
         Constructor
@@ -1245,10 +2718,17 @@ class SockTcpServerThread(threading.Thread):
         self.cfg = request['data'] # save the init request
         
         self.clientsThreads = {}
+        self.clientsById = {}
         self.clientId = 0
         self.idMutex = threading.RLock()
+        self.clientsWheel = None
+        # counters of the disconnected clients
+        self.closedStats = SocketStats()
         
         self.__checkConfig()
+        self.initStats( self.cfg )
+        self.initReactor( parent.getReactor() if self.cfg.get('reactor', False) else None )
+        self.workers = max(1, int(self.cfg.get('server-workers', 1)))
         
     def __checkConfig(self):
         """
@@ -1267,17 +2747,21 @@ class SockTcpServerThread(threading.Thread):
         """
         try:
             # set the socket version
+            isUnix = self.cfg['sock-family'] == UNIX
             if self.cfg['sock-family'] == IPv4:
                 sockType = INIT_STREAM_SOCKET
             elif  self.cfg['sock-family'] == IPv6:
                 sockType = INIT6_STREAM_SOCKET
+            elif isUnix:
+                sockType = UNIX_STREAM_SOCKET
             else:
-                raise Exception('socket family unknown: %s' % str(self.cfg['socket-family']) )  
+                raise Exception('socket family unknown: %s' % str(self.cfg['sock-family']) )  
             
             # Create the socket
             self.socket = getSocket(sockType=sockType)
-            self.socket.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
-            if self.cfg['tcp-keepalive']:
+            if not isUnix:
+                self.socket.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+            if self.cfg['tcp-keepalive'] and not isUnix:
                 # active tcp keep alive
                 self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
                 # seconds before sending keepalive probes
@@ -1288,10 +2772,17 @@ class SockTcpServerThread(threading.Thread):
                 self.socket.setsockopt(socket.SOL_TCP, socket.TCP_KEEPCNT, 5) 
 
             self.socket.settimeout( self.cfg['sock-timeout'] )
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.trace( 'bind socket on %s:%s' % (self.cfg['bind-ip'], self.cfg['bind-port']) )
-            self.socket.bind( (self.cfg['bind-ip'], self.cfg['bind-port']) )
-            self.socket.listen(0)
+            if isUnix:
+                self.bindUnixSocket( self.cfg['bind-path'] )
+            else:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self.trace( 'bind socket on %s:%s' % (self.cfg['bind-ip'], self.cfg['bind-port']) )
+                self.socket.bind( (self.cfg['bind-ip'], self.cfg['bind-port']) )
+            if self.reactor is not None:
+                backlog = self.cfg.get('listen-backlog', socket.SOMAXCONN)
+            else:
+                backlog = self.cfg.get('listen-backlog', 0)
+            self.socket.listen( backlog )
 
             # Listening successful
             self.__setSource()  
@@ -1299,8 +2790,7 @@ class SockTcpServerThread(threading.Thread):
             self.sendNotify(data={'tcp-event': 'listening' } )
                 
         except socket.error as e:
-            (errno, errstr) = e
-            self.sendNotify(data={'tcp-event': 'listening-failed', 'err-no': errno, 'err-str': errstr} )
+            self.sendNotify(data={'tcp-event': 'listening-failed', 'err-no': e.errno, 'err-str': e.strerror} )
             self.stop()
         except Exception as e:
             self.error( "listening error: %s" % str(e) )
@@ -1311,7 +2801,7 @@ class SockTcpServerThread(threading.Thread):
         """
         Set the source ip and port
         """
-        srcIp, srcPort = self.socket.getsockname()
+        srcIp, srcPort = getSourceAddress(self.socket, self.cfg['sock-family'])
         self.sendNotify(data={'tcp-event': 'initialized', 'src-ip': srcIp, 'src-port': srcPort} )
 
     def onNotify(self, client, tid, request):
@@ -1335,10 +2825,12 @@ class SockTcpServerThread(threading.Thread):
             return
             
         # send data
-        if sys.version_info[0] == 3: # python 3 support
-            client['thread'].queueTcp.put( bytes(pdu, "UTF-8") )
+        if sys.version_info[0] == 3 and not isinstance(pdu, bytes): # python 3 support
+            wasEmpty = client['thread'].sendQueue.put( bytes(pdu, "UTF-8") )
         else:
-            client['thread'].queueTcp.put( pdu )
+            wasEmpty = client['thread'].sendQueue.put( pdu )
+        if client['thread'].reactor is not None and wasEmpty:
+            client['thread'].reactor.callSoon(client['thread'].onReactorWrite)
         
     def onReset(self):
         """
@@ -1363,6 +2855,7 @@ class SockTcpServerThread(threading.Thread):
         Stop the thread
         """
         self.stopEvent.set()
+        self.stopReactor()
 
     def sendError(self, data):
         """
@@ -1394,6 +2887,65 @@ class SockTcpServerThread(threading.Thread):
         req['data'] = data
         self.parent.notify( data=req )
 
+    def getTimerWheel(self):
+        """
+        Return the timer wheel of the inactivity deadlines of the clients,
+        driven by the reactor of the server, reactor mode only
+        """
+        self.idMutex.acquire()
+        try:
+            if self.clientsWheel is None:
+                self.clientsWheel = Reactor.TimerWheel( self.reactor )
+        finally:
+            self.idMutex.release()
+        return self.clientsWheel
+
+    def getClientReactor(self, id):
+        """
+        Return the reactor serving the client, clients are spread
+        over the workers of the agent
+        """
+        if self.reactor is None:
+            return None
+        return self.parent.getReactor( index=id % self.workers )
+
+    def onReactorRead(self):
+        """
+        On readable event from the reactor, accept pending clients by batch
+        until the accept queue is empty
+        """
+        if not self.islistening or self.stopEvent.isSet():
+            return
+        try:
+            for i in xrange(ACCEPT_BATCH):
+                try:
+                    ( sock, addr ) = self.socket.accept()
+                except socket.error as e:
+                    if Reactor.wouldBlock(e):
+                        return
+                    raise
+                self.onClientConnected(clientAddress=addr[:2], clientSocket=sock)
+            # accept queue not yet empty, continue after the other events
+            self.reactor.callSoon(self.onReactorRead)
+        except socket.error as e:
+            # too many open files for example, retry later
+            self.error( "accept error: %s" % str(e) )
+            self.reactor.callLater(0.1, self.onReactorRead)
+        except Exception as e:
+            self.error( "on run %s" % str(e) )
+
+    def onReactorWrite(self):
+        """
+        On writable event from the reactor
+        """
+        pass
+
+    def cleanSocket(self):
+        """
+        Clean the listening socket and all clients
+        """
+        self.cleanSockets()
+
     def run(self):
         """
         On run function
@@ -1403,8 +2955,9 @@ class SockTcpServerThread(threading.Thread):
             try:
                 if self.socket is not None:  
                     if self.islistening:    
-                        ( sock, (ip, port) ) = self.socket.accept()
-                        self.onClientConnected(clientAddress=(ip, port), clientSocket=sock)
+                        self.checkTimers()
+                        ( sock, addr ) = self.socket.accept()
+                        self.onClientConnected(clientAddress=addr[:2], clientSocket=sock)
             except socket.error as e:
                 pass
             except Exception as e:
@@ -1435,19 +2988,39 @@ class SockTcpServerThread(threading.Thread):
         """
         Return the client thread by ID
         """
-        ret = None
-        for clientAddress, client in self.clientsThreads.items():
-            if client['id'] == int(id):
-                ret = client['thread']
-                break
-        return ret
+        client = self.clientsById.get( int(id) )
+        if client is None:
+            return None
+        return client['thread']
         
+    def getStats(self):
+        """
+        Return the counters of all clients, and of each connected client
+        """
+        total = SocketStats()
+        total.startTime = self.stats.startTime
+        total.add(self.closedStats)
+        clients = []
+        for clientAddress, client in list(self.clientsThreads.items()):
+            total.add(client['thread'].stats)
+            stats = client['thread'].getStats()
+            stats.update( { 'id': client['id'], 'ip': clientAddress[0], 'port': clientAddress[1] } )
+            clients.append(stats)
+        stats = total.toDict()
+        stats.update( { 'accepted': self.clientId, 'connected': len(clients), 'clients': clients } )
+        return stats
+
     def cleanSockets(self):
         """
         Clean all sockets
         """
+        for clientAddress, client in list(self.clientsThreads.items()):
+            client['thread'].stop()
+        if self.clientsWheel is not None:
+            self.clientsWheel.close()
         if self.socket is not None: 
             self.socket.close()
+            self.cleanUnixSocket()
             self.sendNotify(data={'tcp-event': 'stopped' } )
             self.islistening = False
 
@@ -1457,13 +3030,19 @@ class SockTcpServerThread(threading.Thread):
         """
         # extract the ip and port of the client
         # and generate a id for this new client
-        (ip, port) = clientAddress
         id = self.getId()
+        if self.cfg['sock-family'] == UNIX:
+            # clients of a unix socket are not bound, identified by the path of the server and the id
+            clientAddress = ( formatUnixAddress(self.socket.getsockname()), id )
+        (ip, port) = clientAddress
         
         # init a thread for this client
-        newthread = ClientThread(clientSocket, ip, port, parent=self, id=id)
+        newthread = ClientThread(clientSocket, ip, port, parent=self, id=id, 
+                                 reactor=self.getClientReactor(id))
+        client = {'thread': newthread, 'id': id }
+        self.clientsThreads[(ip, port)] = client
+        self.clientsById[id] = client
         newthread.start()
-        self.clientsThreads[(ip, port)] = {'thread': newthread, 'id': id }
         
         # notify the server
         self.sendNotify(data={'tcp-event': 'client-connected', 'ip': ip, 'port': port } )
@@ -1482,6 +3061,10 @@ class SockTcpServerThread(threading.Thread):
         On client disconnected event
         """
         (ip, port) = clientAddress
+        client = self.clientsThreads.pop(clientAddress, None)
+        if client is not None:
+            self.clientsById.pop(client['id'], None)
+            self.closedStats.add(client['thread'].stats)
         
         # notify the server
         self.sendNotify(data={'tcp-event': 'client-disconnected', 'ip': ip, 'port': port } )
@@ -1495,6 +3078,13 @@ class SockTcpServerThread(threading.Thread):
         # notify the server
         self.sendNotify(data={'tcp-event': 'client-no-more-data', 'ip': ip, 'port': port } )
         
+    def onClientSendBuffer(self, clientAddress, event, size):
+        """
+        On high or low water mark reached in the send queue of a client
+        """
+        (ip, port) = clientAddress
+        self.sendNotify(data={'tcp-event': event, 'ip': ip, 'port': port, 'queued': size } )
+
     def onClientIncomingData(self, clientAddress, pdu):
         """
         On incoming data from client event
@@ -1526,6 +3116,14 @@ class Socket(GenericTool.Tool):
                                   toolDesc, defaultTool, supportProxy=supportProxy,
                                   proxyIp=proxyIp, proxyPort=proxyPort, sslSupport=sslSupport)
         self.__type__ = __TYPE__
+        self.reactors = []
+        self.reactorMutex = threading.RLock()
+        self.callId = 0
+        self.callIdMutex = threading.RLock()
+        self.sslContexts = {}
+        self.sslSessions = {}
+        self.sslMutex = threading.RLock()
+        self.timerWheel = None
 
     def onResetAgentCalled(self):
         """
@@ -1587,11 +3185,98 @@ class Socket(GenericTool.Tool):
         """
         return self.__type__
 
+    def getCallId(self):
+        """
+        Return a new call id, used to name the files uploaded by the agent
+        """
+        self.callIdMutex.acquire()
+        self.callId += 1
+        ret = self.callId
+        self.callIdMutex.release()
+        return ret
+
+    def getSslContext(self, key, factory):
+        """
+        Return the ssl context of the key, created with the factory on the first call
+        The context is shared by all tcp sockets of the agent with the same ssl parameters.
+        """
+        self.sslMutex.acquire()
+        try:
+            ctx = self.sslContexts.get(key)
+            if ctx is None:
+                ctx = factory()
+                self.sslContexts[key] = ctx
+        finally:
+            self.sslMutex.release()
+        return ctx
+
+    def getSslSession(self, key):
+        """
+        Return the last tls session saved for the key, or None
+        """
+        self.sslMutex.acquire()
+        session = self.sslSessions.get(key)
+        self.sslMutex.release()
+        return session
+
+    def setSslSession(self, key, session):
+        """
+        Save the tls session to resume it on the next connection
+        """
+        self.sslMutex.acquire()
+        self.sslSessions[key] = session
+        self.sslMutex.release()
+
+    def getTimerWheel(self):
+        """
+        Return the timer wheel of the inactivity deadlines of the sockets,
+        driven by the main reactor, reactor mode only
+        """
+        self.reactorMutex.acquire()
+        try:
+            if self.timerWheel is None:
+                self.timerWheel = Reactor.TimerWheel( self.getReactor() )
+        finally:
+            self.reactorMutex.release()
+        return self.timerWheel
+
+    def getReactor(self, index=0):
+        """
+        Return the reactor shared by all sockets, started on the first call
+        The index selects one of the workers used by the tcp servers.
+        None is returned if the platform does not support it, 
+        the thread mode is used in this case
+        """
+        if not Reactor.isSupported():
+            return None
+        self.reactorMutex.acquire()
+        try:
+            if not self.reactors:
+                Reactor.raiseFdLimit()
+            while len(self.reactors) <= index:
+                self.trace( 'Starting reactor #%s...' % len(self.reactors) )
+                reactor = Reactor.Reactor(parent=self)
+                reactor.start()
+                self.reactors.append( reactor )
+            return self.reactors[index]
+        finally:
+            self.reactorMutex.release()
+
     def onCleanup(self):
         """
         Cleanup all sockets, all threads
         """
-        pass
+        self.reactorMutex.acquire()
+        try:
+            if self.timerWheel is not None:
+                self.timerWheel.close()
+                self.timerWheel = None
+            for reactor in self.reactors:
+                reactor.stop()
+                reactor.join()
+            self.reactors = []
+        finally:
+            self.reactorMutex.release()
 
     def onAgentAlive(self, client, tid, request):
         """
@@ -1769,6 +3454,33 @@ class Socket(GenericTool.Tool):
                     self.error('sock type unknown: %s' % request['data']['sock-type'] )
                     self.onToolLogErrorCalled( 'Initialize socket failed - generic error: %s' % sys.platform )
 
+            elif cmd == 'load':
+                self.onToolLogWarningCalled( "<< Starting load=%s TestId=%s AdapterId=%s" % (cmd,
+                                                                                          request['script_id'],
+                                                                                          request['source-adapter']) )
+                self.trace( 'Starting load generator...' )
+
+                generator = LoadGenerator.LoadGenerator(parent=self, request=request)
+                currentTest.ctx_plugin = generator
+                generator.start()
+
+            elif cmd == 'replay':
+                self.onToolLogWarningCalled( "<< Starting replay=%s TestId=%s AdapterId=%s" % (cmd,
+                                                                                            request['script_id'],
+                                                                                            request['source-adapter']) )
+                self.trace( 'Starting pcap replay...' )
+
+                engine = Replay.ReplayEngine(parent=self, request=request)
+                currentTest.ctx_plugin = engine
+                engine.start()
+
+            elif cmd == 'stats':
+                if currentTest.ctx() is not None:
+                    if hasattr(currentTest.ctx(), "onStats"):
+                        currentTest.ctx().onStats(request)
+                    else:
+                        self.error( 'stats not supported by the context' )
+
             elif cmd == 'disconnect':
                 self.onToolLogWarningCalled( "<< Closing socket=%s TestId=%s AdapterId=%s" % (cmd,
                                                                                               request['script_id'],
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Copyright (c) 2010-2019 Denis Machard
+# This file is part of the extensive automation project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA
+# -------------------------------------------------------------------
+
+"""
+Microbenchmark of the receive path of the socket agent
+
+A loopback tcp stream of small messages is read with recv(1MB), as done
+before, then with recv_into and a reusable buffer, as done by the agent.
+Only the bytes received are copied in the second case.
+
+Each reader runs twice: once for the throughput, once with tracemalloc
+to measure the memory allocated by each read (peak above the memory in use
+before the read), the same way for both readers. The allocations are not
+measured without tracemalloc.reset_peak (python 3.9+).
+
+Usage: python RecvBench.py [message size] [number of messages]
+"""
+
+import socket
+import threading
+import time
+import sys
+
+try:
+    import tracemalloc
+except ImportError: # python2 support
+    tracemalloc = None
+
+OLD_RECV_SIZE = 1024*1024
+RECV_BUFFER_SIZE = 256*1024
+
+class AllocationMeter(object):
+    """
+    Sum of the memory allocated by each read, measured with tracemalloc
+    """
+    def __init__(self, enabled):
+        """
+        Constructor
+        """
+        self.enabled = enabled
+        self.allocated = 0
+        self.current = 0
+
+    def begin(self):
+        """
+        Before a read
+        """
+        if self.enabled:
+            tracemalloc.reset_peak()
+            self.current = tracemalloc.get_traced_memory()[0]
+
+    def end(self):
+        """
+        After a read, once the data received is a bytes object
+        """
+        if self.enabled:
+            self.allocated += tracemalloc.get_traced_memory()[1] - self.current
+
+def canMeasure():
+    """
+    Return True if the allocations can be measured
+    """
+    return tracemalloc is not None and hasattr(tracemalloc, 'reset_peak')
+
+def sender(sock, size, count):
+    """
+    Send messages on the socket, one by one
+    """
+    msg = b"x" * size
+    for i in range(count):
+        sock.sendall(msg)
+    sock.close()
+
+def readWithRecv(sock, meter):
+    """
+    Read the stream with recv, a new buffer is allocated for each read
+    """
+    calls = 0
+    total = 0
+    while True:
+        meter.begin()
+        data = sock.recv(OLD_RECV_SIZE)
+        meter.end()
+        calls += 1
+        if not data:
+            break
+        total += len(data)
+    return calls, total
+
+def readWithRecvInto(sock, meter):
+    """
+    Read the stream in a reusable buffer, only received bytes are copied
+    """
+    buf = bytearray(RECV_BUFFER_SIZE)
+    view = memoryview(buf)
+    calls = 0
+    total = 0
+    while True:
+        meter.begin()
+        nbytes = sock.recv_into(buf)
+        data = view[:nbytes].tobytes()
+        meter.end()
+        calls += 1
+        if not nbytes:
+            break
+        total += len(data)
+    return calls, total
+
+def run(reader, size, count, measure=False):
+    """
+    Run one benchmark on a loopback connection,
+    return the number of reads, the bytes received, the duration
+    and the memory allocated by the reads if measured
+    """
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.bind( ("127.0.0.1", 0) )
+    srv.listen(1)
+    cli = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    cli.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    cli.connect( srv.getsockname() )
+    sock, addr = srv.accept()
+    srv.close()
+
+    th = threading.Thread(target=sender, args=(cli, size, count))
+    meter = AllocationMeter(measure)
+    if measure:
+        tracemalloc.start()
+    start = time.time()
+    th.start()
+    calls, total = reader(sock, meter)
+    duration = time.time() - start
+    if measure:
+        tracemalloc.stop()
+    th.join()
+    sock.close()
+    return calls, total, duration, meter.allocated
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    for reader in [ readWithRecv, readWithRecvInto ]:
+        calls, total, duration, _ = run(reader, size, count)
+        line = "%-16s %8d reads %10d bytes in %.3fs (%.1f MB/s)" % (
+                    reader.__name__, calls, total, duration, total / duration / 1e6)
+        if canMeasure():
+            calls, total, _, allocated = run(reader, size, count, measure=True)
+            line += ", %.1f MB allocated by %d reads (%d bytes per read)" % (
+                        allocated / 1e6, calls, allocated // max(calls, 1))
+        print(line)